@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import sys
+import threading
+
+from github.Requester import (
+    HTTPRequestsConnectionClass,
+    HTTPSRequestsConnectionClass,
+    Requester,
+)
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_utils.sqlite_store import SqliteLRUStore, get_store  # noqa: E402
+
+# Persistent conditional-request cache that sits under PyGithub's connection layer.
+# Cached GET responses are revalidated with If-None-Match / If-Modified-Since, and
+# GitHub does not charge rate-limit quota for the resulting 304s. The cache is
+# configured through the environment so daft UDF worker processes pick it up too.
+
+DEFAULT_CACHE_PATH = ".github_http_cache.sqlite"
+DEFAULT_CACHE_MAX_MB = 512
+
+
+class HttpCache(SqliteLRUStore):
+    COLUMNS = ("url TEXT", "etag TEXT", "last_modified TEXT", "headers TEXT", "body BLOB")
+
+    @staticmethod
+    def key(verb, url, headers):
+        # GitHub responses vary on Authorization and Accept, so both are part of the key
+        auth = hashlib.sha256(headers.get("Authorization", "").encode()).hexdigest()
+        accept = headers.get("Accept", "")
+        return hashlib.sha256(f"{verb} {url} {accept} {auth}".encode()).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT etag, last_modified, headers, body FROM responses WHERE key = ?",
+                (key,),
+            ).fetchone()
+        if row is None:
+            return None
+        etag, last_modified, headers, body = row
+        return {
+            "etag": etag,
+            "last_modified": last_modified,
+            "headers": json.loads(headers),
+            "body": body.decode("utf-8"),
+        }
+
+    def touch(self, key):
+        with self._lock:
+            self._touch([key])
+            self._db.commit()
+
+    def put(self, key, url, headers, body):
+        etag = headers.get("etag")
+        last_modified = headers.get("last-modified")
+        if etag is None and last_modified is None:
+            return
+        payload = body.encode("utf-8")
+        with self._lock:
+            self._put_rows([(key, url, etag, last_modified, json.dumps(headers), payload, len(payload))])
+            self._db.commit()
+
+
+def get_cache():
+    path = os.environ.get("GITHUB_HTTP_CACHE_PATH", DEFAULT_CACHE_PATH)
+    max_mb = float(os.environ.get("GITHUB_HTTP_CACHE_MAX_MB", DEFAULT_CACHE_MAX_MB))
+    return get_store(HttpCache, path, int(max_mb * 1024 * 1024))
+
+
+class CachedResponse:
+    # mimics github.Requester.RequestsResponse for responses served from the cache
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def getheaders(self):
+        return self.headers.items()
+
+    def read(self):
+        return self.body
+
+    def raise_for_status(self):
+        pass
+
+
+class CachingConnectionMixin:
+    # PyGithub creates a fresh connection per request once connection classes are
+    # injected, so each thread reuses one HTTP session to keep keep-alive. Sessions
+    # are not thread-safe, so each connection class keeps one per thread.
+
+    def _share_session(self):
+        session = getattr(self._thread_sessions, "session", None)
+        if session is None:
+            self._thread_sessions.session = self.session
+        else:
+            self.session.close()
+            self.session = session
+
+    def getresponse(self):
+        if self.verb != "GET" or self.stream:
+            return super().getresponse()
+
+        cache = get_cache()
+        # the same path on api.github.com and a GHES host are different resources
+        url = f"{self.protocol}://{self.host}:{self.port}{self.url}"
+        key = HttpCache.key(self.verb, url, self.headers)
+        cached = cache.get(key)
+        if cached is not None:
+            self.headers = dict(self.headers)
+            if cached["etag"]:
+                self.headers["If-None-Match"] = cached["etag"]
+            if cached["last_modified"]:
+                self.headers["If-Modified-Since"] = cached["last_modified"]
+
+        response = super().getresponse()
+        if response.status == 304 and cached is not None:
+            cache.record("hits")
+            cache.touch(key)
+            # keep the fresh rate-limit headers from the 304 on top of the cached ones
+            headers = {
+                **cached["headers"],
+                **{k.lower(): v for k, v in response.getheaders()},
+            }
+            return CachedResponse(200, headers, cached["body"])
+
+        cache.record("misses")
+        if response.status == 200:
+            headers = {k.lower(): v for k, v in response.getheaders()}
+            cache.put(key, url, headers, response.read())
+        return response
+
+    def close(self):
+        # the session is shared with the thread's other connections, leave it open
+        pass
+
+
+class CachingHTTPConnection(CachingConnectionMixin, HTTPRequestsConnectionClass):
+    _thread_sessions = threading.local()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._share_session()
+
+
+class CachingHTTPSConnection(CachingConnectionMixin, HTTPSRequestsConnectionClass):
+    _thread_sessions = threading.local()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._share_session()
+
+
+def install_http_cache():
+    # must run before any Github client is constructed
+    Requester.injectConnectionClasses(CachingHTTPConnection, CachingHTTPSConnection)
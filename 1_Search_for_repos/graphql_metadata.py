@@ -0,0 +1,179 @@
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_utils.concurrency import retry_after_seconds  # noqa: E402
+
+# Fetches repository metadata through GitHub's GraphQL API, up to 100 repositories
+# per request, which also gives us fields the search API doesn't return (disk usage,
+# commit count) so later stages can plan clone cost.
+
+MAX_REPOS_PER_QUERY = 100
+
+REPO_FIELDS = """
+fragment RepoFields on Repository {
+  name
+  owner { login }
+  url
+  description
+  stargazerCount
+  createdAt
+  updatedAt
+  diskUsage
+  primaryLanguage { name }
+  defaultBranchRef {
+    name
+    target { ... on Commit { history { totalCount } } }
+  }
+}
+"""
+
+
+def graphql_url(api_url):
+    # https://api.github.com -> /graphql, GitHub Enterprise .../api/v3 -> .../api/graphql
+    api_url = api_url.rstrip("/")
+    if api_url.endswith("/v3"):
+        api_url = api_url[: -len("/v3")]
+    return f"{api_url}/graphql"
+
+
+def build_query(n):
+    params = ", ".join(f"$o{i}: String!, $n{i}: String!" for i in range(n))
+    fields = "\n".join(
+        f"  r{i}: repository(owner: $o{i}, name: $n{i}) {{ ...RepoFields }}" for i in range(n)
+    )
+    return f"query({params}) {{\n  rateLimit {{ cost remaining resetAt }}\n{fields}\n}}\n{REPO_FIELDS}"
+
+
+def format_timestamp(value):
+    # match str(datetime) as produced from PyGithub attributes in get_repo_data
+    if value is None:
+        return None
+    return str(datetime.fromisoformat(value.replace("Z", "+00:00")))
+
+
+def node_to_row(node):
+    if node is None:
+        return None
+    branch = node.get("defaultBranchRef") or {}
+    history = (branch.get("target") or {}).get("history") or {}
+    return {
+        "name": node["name"],
+        "owner": node["owner"]["login"],
+        "url": f"{node['url']}.git",
+        "description": node.get("description"),
+        "stars": node.get("stargazerCount"),
+        "updated": format_timestamp(node.get("updatedAt")),
+        "created_at": format_timestamp(node.get("createdAt")),
+        "disk_usage_kb": node.get("diskUsage"),
+        "default_branch": branch.get("name"),
+        "primary_language": (node.get("primaryLanguage") or {}).get("name"),
+        "commit_count": history.get("totalCount"),
+    }
+
+
+class GraphQLRepoFetcher:
+    def __init__(
+        self,
+        token,
+        api_url="https://api.github.com",
+        max_connections=8,
+        batch_size=MAX_REPOS_PER_QUERY,
+        timeout=60,
+        max_retries=3,
+    ):
+        self.url = graphql_url(api_url)
+        self.batch_size = min(batch_size, MAX_REPOS_PER_QUERY)
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.session = requests.Session()
+        # one pool shared by all worker threads, blocking when every connection is busy
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=max_connections, pool_block=True
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(
+            {"Authorization": f"bearer {token}", "Content-Type": "application/json"}
+        )
+        self.requests = 0
+        self.cost = 0
+        self._lock = threading.Lock()
+
+    def _post(self, repos):
+        variables = {}
+        for i, (owner, name) in enumerate(repos):
+            variables[f"o{i}"] = owner
+            variables[f"n{i}"] = name
+        payload = json.dumps({"query": build_query(len(repos)), "variables": variables})
+        response = self.session.post(self.url, data=payload, timeout=self.timeout)
+        with self._lock:
+            self.requests += 1
+        return response
+
+    def _fetch_batch(self, repos, attempt=0):
+        try:
+            response = self._post(repos)
+        except requests.RequestException as e:
+            response = None
+            error = str(e)
+        else:
+            error = f"HTTP {response.status_code}"
+
+        if response is not None and response.status_code == 200:
+            body = response.json()
+            data = body.get("data") or {}
+            rate_limit = data.get("rateLimit") or {}
+            with self._lock:
+                self.cost += rate_limit.get("cost", 0)
+            if rate_limit.get("remaining", 1) == 0:
+                reset = datetime.fromisoformat(rate_limit["resetAt"].replace("Z", "+00:00"))
+                delay = reset.timestamp() - time.time()
+                print(f"GraphQL quota exhausted, waiting {delay:.1f}s for reset")
+                time.sleep(max(delay, 0))
+            # repos that no longer exist come back as null with a NOT_FOUND error
+            return [node_to_row(data.get(f"r{i}")) for i in range(len(repos))]
+
+        if response is not None and response.status_code in (403, 429) and attempt < self.max_retries:
+            delay = retry_after_seconds(response.headers)
+            if delay is None:
+                delay = 60
+            print(f"GraphQL rate limited, retrying in {delay:.0f}s")
+            time.sleep(delay)
+            return self._fetch_batch(repos, attempt + 1)
+
+        # big batches are what usually time out on GitHub's side, so retry in halves
+        if len(repos) > 1 and attempt < self.max_retries:
+            mid = len(repos) // 2
+            return self._fetch_batch(repos[:mid], attempt + 1) + self._fetch_batch(
+                repos[mid:], attempt + 1
+            )
+        if attempt < self.max_retries:
+            time.sleep(2**attempt)
+            return self._fetch_batch(repos, attempt + 1)
+        print(f"Error fetching metadata for {repos}: {error}")
+        return [None] * len(repos)
+
+    def fetch(self, repos):
+        # returns one row (or None) per (owner, name) in input order
+        valid = [i for i, (owner, name) in enumerate(repos) if owner and name]
+        batches = [
+            [repos[i] for i in valid[start : start + self.batch_size]]
+            for start in range(0, len(valid), self.batch_size)
+        ]
+        with ThreadPoolExecutor(max_workers=self.max_connections) as executor:
+            results = executor.map(self._fetch_batch, batches)
+            fetched = [row for batch in results for row in batch]
+
+        rows = [None] * len(repos)
+        for i, row in zip(valid, fetched):
+            rows[i] = row
+        return rows
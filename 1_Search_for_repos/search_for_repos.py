@@ -1,8 +1,13 @@
 import argparse
+from datetime import datetime, timezone
 from dotenv import load_dotenv
+import json
 import os
 import daft
 from github import Auth, Github
+from graphql_metadata import GraphQLRepoFetcher
+from github_cache import DEFAULT_CACHE_PATH, get_cache, install_http_cache
+from sharded_search import RateLimitBudget, ShardedRepoSearch, repo_to_row
 
 load_dotenv()
 
@@ -12,22 +17,33 @@ if not GITHUB_TOKEN:
         "GitHub token not found. Please set GITHUB_TOKEN in your .env file."
     )
 
+# Point this at a local fake API (see benchmarks/fake_github_api.py) to run offline
+GITHUB_API_URL = os.environ.get("GITHUB_API_URL", "https://api.github.com")
+
+# Conditional-request cache under the client, set GITHUB_HTTP_CACHE_PATH="" to disable
+GITHUB_HTTP_CACHE_PATH = os.environ.get("GITHUB_HTTP_CACHE_PATH", DEFAULT_CACHE_PATH)
+if GITHUB_HTTP_CACHE_PATH:
+    os.environ["GITHUB_HTTP_CACHE_PATH"] = GITHUB_HTTP_CACHE_PATH
+    install_http_cache()
+
 auth = Auth.Token(GITHUB_TOKEN)
-github = Github(auth=auth, per_page=100)
+github = Github(auth=auth, per_page=100, base_url=GITHUB_API_URL)
+
+repo_data_dtype = daft.DataType.struct(
+    {
+        "name": daft.DataType.string(),
+        "owner": daft.DataType.string(),
+        "url": daft.DataType.string(),
+        "description": daft.DataType.string(),
+        "stars": daft.DataType.int64(),
+        "updated": daft.DataType.string(),
+        "created_at": daft.DataType.string(),
+    }
+)
 
 
 @daft.udf(
-    return_dtype=daft.DataType.struct(
-        {
-            "name": daft.DataType.string(),
-            "owner": daft.DataType.string(),
-            "url": daft.DataType.string(),
-            "description": daft.DataType.string(),
-            "stars": daft.DataType.int64(),
-            "updated": daft.DataType.string(),
-            "created_at": daft.DataType.string(),
-        }
-    ),
+    return_dtype=repo_data_dtype,
     batch_size=1,
 )
 def get_repo_data(
@@ -45,27 +61,121 @@ def get_repo_data(
 
     res = []
     for repo in repos[: min(limit or total_count, total_count)]:
-        res.append(
-            {
-                "name": repo.name,
-                "owner": repo.owner.login,
-                "url": repo.clone_url,
-                "description": repo.description,
-                "stars": repo.stargazers_count,
-                "updated": str(repo.updated_at),
-                "created_at": str(repo.created_at),
-            }
-        )
+        res.append(repo_to_row(repo))
     return res
 
 
+# All queries share one budget so parallel shards back off together when the search quota runs low
+search_budget = RateLimitBudget()
+
+
+@daft.udf(
+    return_dtype=repo_data_dtype,
+    batch_size=1,
+)
+def get_repo_data_sharded(
+    query: daft.Series,
+    limit: int | None = None,
+    max_workers: int = 8,
+):
+    [query] = query.to_pylist()
+
+    search = ShardedRepoSearch(
+        lambda: Github(auth=auth, per_page=100, base_url=GITHUB_API_URL),
+        max_workers=max_workers,
+        budget=search_budget,
+    )
+    res = search.search(query, limit)
+    if not res:
+        return [None]
+    return res
+
+
+@daft.udf(
+    return_dtype=daft.DataType.struct(
+        {
+            "disk_usage_kb": daft.DataType.int64(),
+            "default_branch": daft.DataType.string(),
+            "primary_language": daft.DataType.string(),
+            "commit_count": daft.DataType.int64(),
+        }
+    ),
+    batch_size=1000,
+)
+def get_repo_metadata(owner: daft.Series, name: daft.Series, max_connections: int = 8):
+    fetcher = GraphQLRepoFetcher(
+        GITHUB_TOKEN, api_url=GITHUB_API_URL, max_connections=max_connections
+    )
+    repos = list(zip(owner.to_pylist(), name.to_pylist()))
+    rows = fetcher.fetch(repos)
+    print(f"Fetched metadata for {len(repos)} repos in {fetcher.requests} GraphQL requests")
+    return [
+        {
+            "disk_usage_kb": row["disk_usage_kb"],
+            "default_branch": row["default_branch"],
+            "primary_language": row["primary_language"],
+            "commit_count": row["commit_count"],
+        }
+        if row is not None
+        else None
+        for row in rows
+    ]
+
+
+def diff_against_snapshot(repo_data: daft.DataFrame, snapshot_path: str):
+    # Keep only repos that are new or whose `updated` timestamp moved since the snapshot.
+    # One row per url, a snapshot written by several queries can list a repo twice.
+    previous = (
+        daft.read_parquet(snapshot_path)
+        .groupby("url")
+        .agg(daft.col("updated").max().alias("previous_updated"))
+    )
+    joined = repo_data.where(daft.col("url").not_null()).join(
+        previous, on="url", how="left"
+    )
+    joined = joined.with_column(
+        "change",
+        daft.col("previous_updated")
+        .is_null()
+        .if_else(
+            daft.lit("new"),
+            (daft.col("updated") != daft.col("previous_updated")).if_else(
+                daft.lit("changed"), daft.lit("unchanged")
+            ),
+        ),
+    ).collect()
+
+    counts = {"new": 0, "changed": 0, "unchanged": 0}
+    for row in joined.groupby("change").agg(daft.col("url").count()).iter_rows():
+        counts[row["change"]] = row["url"]
+
+    delta = joined.where(daft.col("change") != "unchanged").exclude(
+        "previous_updated", "change"
+    )
+    return delta, counts
+
+
+def write_manifest(path: str, manifest: dict):
+    manifest_path = f"{path.rstrip('/')}_manifest.json"
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"Wrote manifest to {manifest_path}")
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--runner", type=str, default="native")
     parser.add_argument("--keywords", type=str, default="language:rust")
     parser.add_argument("--limit", type=str, default="10")
+    parser.add_argument("--sharded", action="store_true")
+    parser.add_argument("--max-workers", type=int, default=8)
+    # Adds disk_usage_kb, default_branch, primary_language and commit_count via batched GraphQL
+    parser.add_argument("--with-metadata", action="store_true")
     parser.add_argument("--write-to-file", action="store_true")
     parser.add_argument("--output-path", type=str, default="repo_data_files")
+    # Incremental mode: only new or changed repos are written to --output-path
+    parser.add_argument("--since-snapshot", type=str, default=None)
+    parser.add_argument("--snapshot-output-path", type=str, default=None)
     args = parser.parse_args()
 
     if args.runner == "native":
@@ -84,22 +194,92 @@ if __name__ == "__main__":
     queries = args.keywords.split(",")
 
     print(
-        f"Searching for repos with keywords: {queries}, limit: {limit}, runner: {args.runner}, write-to-file: {args.write_to_file}"
+        f"Searching for repos with keywords: {queries}, limit: {limit}, runner: {args.runner}, write-to-file: {args.write_to_file}, sharded: {args.sharded}"
     )
     df = daft.from_pydict({"query": queries})
+    if GITHUB_HTTP_CACHE_PATH:
+        get_cache().reset_stats()
 
     # Get repo data
-    get_repo_data = get_repo_data.with_concurrency(1)
-    repo_data = df.with_column(
-        "repo_data", get_repo_data(df["query"], limit)
-    )
+    if args.sharded:
+        # Sharded mode parallelises inside the UDF, so queries still run one at a time
+        get_repo_data = get_repo_data_sharded.with_concurrency(1)
+        repo_data = df.with_column(
+            "repo_data", get_repo_data(df["query"], limit, args.max_workers)
+        )
+    else:
+        get_repo_data = get_repo_data.with_concurrency(1)
+        repo_data = df.with_column(
+            "repo_data", get_repo_data(df["query"], limit)
+        )
     repo_data = repo_data.select(repo_data["repo_data"].struct.get("*"))
 
+    if args.with_metadata:
+        repo_data = repo_data.with_column(
+            "metadata",
+            get_repo_metadata(repo_data["owner"], repo_data["name"], args.max_workers),
+        )
+        repo_data = repo_data.with_columns(
+            {
+                "disk_usage_kb": daft.col("metadata").struct.get("disk_usage_kb"),
+                "default_branch": daft.col("metadata").struct.get("default_branch"),
+                "primary_language": daft.col("metadata").struct.get("primary_language"),
+                "commit_count": daft.col("metadata").struct.get("commit_count"),
+            }
+        ).exclude("metadata")
+
+    if args.since_snapshot:
+        # materialize once so the search isn't rerun for the diff and the full snapshot
+        repo_data = repo_data.collect()
+        delta, counts = diff_against_snapshot(repo_data, args.since_snapshot)
+        print(
+            f"Compared against snapshot {args.since_snapshot}: {counts['new']} new, "
+            f"{counts['changed']} changed, {counts['unchanged']} unchanged repos"
+        )
+
+        if args.write_to_file:
+            path = args.output_path
+            # replace the previous run's delta, later stages read the whole directory
+            files = delta.write_parquet(path, write_mode="overwrite")
+            print(f"Wrote delta files to {path}")
+            print(files)
+
+            snapshot_files = None
+            if args.snapshot_output_path:
+                snapshot_files = repo_data.where(
+                    daft.col("url").not_null()
+                ).write_parquet(args.snapshot_output_path, write_mode="overwrite")
+                print(f"Wrote full snapshot to {args.snapshot_output_path}")
+
+            write_manifest(
+                path,
+                {
+                    "created_at": datetime.now(timezone.utc).isoformat(),
+                    "keywords": queries,
+                    "since_snapshot": args.since_snapshot,
+                    "snapshot_output_path": args.snapshot_output_path,
+                    "counts": counts,
+                    "delta_files": files.to_pydict()["path"],
+                    "snapshot_files": (
+                        snapshot_files.to_pydict()["path"] if snapshot_files else None
+                    ),
+                },
+            )
+        else:
+            delta.show()
+
     # write to file
-    if args.write_to_file:
+    elif args.write_to_file:
         path = args.output_path
         files = repo_data.write_parquet(path)
         print(f"Wrote files to {path}")
         print(files)
     else:
         repo_data.show()
+
+    if GITHUB_HTTP_CACHE_PATH:
+        stats = get_cache().stats()
+        print(
+            f"GitHub HTTP cache: {stats['hits']} hits, {stats['misses']} misses, "
+            f"{stats['evictions']} evictions, {stats['entries']} entries ({stats['size_bytes'] / 1024 / 1024:.1f} MiB)"
+        )
@@ -0,0 +1,213 @@
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import date
+
+# GitHub's search API never returns more than 1000 results for a single query,
+# so we keep splitting a query into non-overlapping star / created-date ranges
+# until every shard fits under that cap.
+SEARCH_RESULT_CAP = 1000
+SEARCH_PAGE_SIZE = 100
+GITHUB_EPOCH = date(2007, 10, 1)
+
+
+def repo_to_row(repo):
+    return {
+        "name": repo.name,
+        "owner": repo.owner.login,
+        "url": repo.clone_url,
+        "description": repo.description,
+        "stars": repo.stargazers_count,
+        "updated": str(repo.updated_at),
+        "created_at": str(repo.created_at),
+    }
+
+
+class RateLimitBudget:
+    """Request budget shared by all shard workers, fed from X-RateLimit-* headers."""
+
+    def __init__(self, reserve=1):
+        self.reserve = reserve
+        self.remaining = None
+        self.reset_at = 0
+        self.requests = 0
+        self.waited = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.remaining is not None and self.remaining <= self.reserve:
+                delay = self.reset_at - time.time()
+                if delay <= 0:
+                    # the window rolled over, let the next response tell us the new quota
+                    self.remaining = None
+                    break
+                print(f"Search quota exhausted, waiting {delay:.1f}s for reset")
+                start = time.time()
+                self._cond.wait(timeout=delay + 0.5)
+                self.waited += time.time() - start
+            if self.remaining is not None:
+                self.remaining -= 1
+            self.requests += 1
+
+    def update(self, remaining, reset_at):
+        if remaining < 0:
+            return
+        with self._cond:
+            if reset_at > self.reset_at or self.remaining is None:
+                # responses from a new rate-limit window replace the old budget
+                self.remaining = remaining
+                self.reset_at = max(reset_at, self.reset_at)
+            else:
+                # responses can arrive out of order, trust the most pessimistic one
+                self.remaining = min(self.remaining, remaining)
+            self._cond.notify_all()
+
+    def update_from(self, github):
+        remaining, _ = github.rate_limiting
+        self.update(remaining, github.rate_limiting_resettime)
+
+
+class Shard:
+    def __init__(self, base_query, stars, created):
+        self.base_query = base_query
+        self.stars = stars
+        self.created = created
+
+    @property
+    def query(self):
+        stars_lo, stars_hi = self.stars
+        created_lo, created_hi = self.created
+        return (
+            f"{self.base_query} stars:{stars_lo}..{stars_hi} "
+            f"created:{created_lo.isoformat()}..{created_hi.isoformat()}"
+        )
+
+    def split(self):
+        stars_lo, stars_hi = self.stars
+        if stars_lo < stars_hi:
+            # star counts are heavy-tailed, so bisect geometrically to keep halves balanced
+            mid = int(((stars_lo + 1) * (stars_hi + 1)) ** 0.5) - 1
+            mid = min(max(mid, stars_lo), stars_hi - 1)
+            return [
+                Shard(self.base_query, (stars_lo, mid), self.created),
+                Shard(self.base_query, (mid + 1, stars_hi), self.created),
+            ]
+
+        created_lo, created_hi = self.created
+        if created_lo < created_hi:
+            mid = date.fromordinal((created_lo.toordinal() + created_hi.toordinal()) // 2)
+            return [
+                Shard(self.base_query, self.stars, (created_lo, mid)),
+                Shard(self.base_query, self.stars, (date.fromordinal(mid.toordinal() + 1), created_hi)),
+            ]
+
+        return []
+
+
+class ShardedRepoSearch:
+    """Discovers every repo matching a query by fanning sharded searches out over a thread pool.
+
+    `client_factory` must return a new `Github` client; PyGithub connections are not
+    thread-safe, so each worker thread gets its own.
+    """
+
+    def __init__(self, client_factory, max_workers=8, budget=None):
+        self.client_factory = client_factory
+        self.max_workers = max_workers
+        self.budget = budget or RateLimitBudget()
+        self._local = threading.local()
+
+    def _github(self):
+        if not hasattr(self._local, "github"):
+            self._local.github = self.client_factory()
+        return self._local.github
+
+    def _search_page(self, query, page):
+        github = self._github()
+        self.budget.acquire()
+        results = github.search_repositories(query=query, sort="stars", order="desc")
+        items = results.get_page(page)
+        self.budget.update_from(github)
+        return results.totalCount, items
+
+    def plan(self, base_query, executor, limit=None):
+        total_count, items = self._search_page(base_query, 0)
+        max_stars = items[0].stargazers_count if items else 0
+        print(f"Found {total_count} repos for query: {base_query}, max stars: {max_stars}")
+        if total_count == 0:
+            return [], {}
+
+        root = Shard(base_query, (0, max_stars), (GITHUB_EPOCH, date.today()))
+        shards = []
+        first_pages = {}
+        # the probe already is the root's first page, so it isn't requested again
+        probe = Future()
+        probe.set_result((total_count, items))
+        pending = {probe: root}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                shard = pending.pop(future)
+                count, items = future.result()
+                if count == 0:
+                    continue
+                # results come sorted by stars, so the root alone holds the top `limit` if it fits in one search
+                top_only = shard is root and limit is not None and limit <= SEARCH_RESULT_CAP
+                capped = count > SEARCH_RESULT_CAP and not top_only
+                children = shard.split() if capped else []
+                if not children:
+                    if capped:
+                        print(f"[{shard.query}] Cannot split further, only {SEARCH_RESULT_CAP} of {count} repos reachable")
+                    shards.append((shard, count))
+                    first_pages[shard.query] = items
+                    continue
+                for child in children:
+                    pending[executor.submit(self._search_page, child.query, 0)] = child
+        return shards, first_pages
+
+    def _fetch_shard(self, shard, count, first_page, limit=None):
+        rows = [repo_to_row(repo) for repo in first_page]
+        wanted = min(count, SEARCH_RESULT_CAP, limit or SEARCH_RESULT_CAP)
+        pages = -(-wanted // SEARCH_PAGE_SIZE)
+        for page in range(1, pages):
+            _, items = self._search_page(shard.query, page)
+            if not items:
+                break
+            rows.extend(repo_to_row(repo) for repo in items)
+        return rows
+
+    def search(self, base_query, limit=None):
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            shards, first_pages = self.plan(base_query, executor, limit)
+            print(f"[{base_query}] Split into {len(shards)} shards after {self.budget.requests} requests")
+            # shards cover disjoint star ranges, taking the highest first means the top
+            # `limit` repos are in hand before the remaining shards are requested at all
+            shards.sort(key=lambda item: (item[0].stars, item[0].created), reverse=True)
+            rows = {}
+            while shards and (limit is None or len(rows) < limit):
+                missing = None if limit is None else limit - len(rows)
+                batch, covered = [], 0
+                while shards and (missing is None or covered < missing):
+                    shard, count = shards.pop(0)
+                    batch.append((shard, count))
+                    covered += min(count, SEARCH_RESULT_CAP)
+                futures = [
+                    executor.submit(self._fetch_shard, shard, count, first_pages[shard.query], missing)
+                    for shard, count in batch
+                ]
+                # star counts can move between requests, so a repo may show up in two shards
+                for future in futures:
+                    for row in future.result():
+                        rows.setdefault(row["url"], row)
+
+        res = sorted(rows.values(), key=lambda row: row["stars"], reverse=True)
+        if limit is not None:
+            res = res[:limit]
+        elapsed = time.time() - start
+        print(
+            f"[{base_query}] Fetched {len(res)} repos in {elapsed:.1f}s "
+            f"({self.budget.requests} requests, {self.budget.waited:.1f}s waiting on rate limit)"
+        )
+        return res
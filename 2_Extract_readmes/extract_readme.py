@@ -1,8 +1,16 @@
 import argparse
-from git import Repo
+import asyncio
 import daft
-import tempfile
 import os
+import shutil
+import sys
+import tempfile
+import time
+
+from git import GitCommandError
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_utils.repo_mirrors import DEFAULT_MAX_BYTES, get_store, open_repo
 
 readme_patterns = [
     # Most common patterns (80%+ of repositories)
@@ -87,55 +95,241 @@ readme_patterns = [
 ]
 
 
-def extract_readme(url):
-    with tempfile.TemporaryDirectory() as temp_dir:
-        print(f"[{url}] Cloning repo")
-        try:
-            Repo.clone_from(url, to_path=temp_dir, multi_options=["--sparse"])
-        except Exception as e:
-            print(f"[{url}] Error cloning repo: {e}")
-            return None
+# Case-insensitive priority index over readme_patterns: lower-cased path -> rank.
+# An exact-case match breaks ties, so README.md still beats readme.md when both exist.
+readme_priority = {}
+for rank, pattern in enumerate(readme_patterns):
+    readme_priority.setdefault(pattern.lower(), rank)
+readme_exact_priority = {pattern: rank for rank, pattern in enumerate(readme_patterns)}
+readme_dirs = {
+    pattern.split("/")[0].lower() for pattern in readme_patterns if "/" in pattern
+}
 
-        # if the directory is empty, skip
-        try:
-            if not os.listdir(temp_dir):
-                print(f"[{url}] Repo is empty")
-                return None
-        except Exception as e:
-            print(f"[{url}] Error checking if repo is empty: {e}")
-            return None
 
-        # try to find a README file
-        try:
-            for pattern in readme_patterns:
-                readme_path = os.path.join(temp_dir, pattern)
-                if os.path.exists(readme_path):
-                    print(f"[{url}] Found README file")
-                    with open(readme_path, "r") as f:
-                        s = f.read()
-                        s = s.encode("utf-8", "replace").decode("utf-8")
-                        return s
-        except Exception as e:
-            print(f"[{url}] Error finding README file: {e}")
+def parse_ls_tree(output):
+    entries = []
+    for line in output.splitlines():
+        meta, path = line.split("\t", 1)
+        mode, type, sha = meta.split(" ")
+        entries.append((mode, type, sha, path))
+    return entries
+
+
+def find_readme_entry(entries):
+    best = None
+    for mode, type, sha, path in entries:
+        if type != "blob":
+            continue
+        rank = readme_priority.get(path.lower())
+        if rank is None:
+            continue
+        key = (rank, readme_exact_priority.get(path, len(readme_patterns)))
+        if best is None or key < best[0]:
+            best = (key, mode, sha, path)
+    return best
+
+
+def read_readme(url, repo):
+    # list the top-level tree, then the docs directories, in at most two calls
+    if not repo.head.is_valid():
+        print(f"[{url}] Repo is empty")
+        return None
+    try:
+        entries = parse_ls_tree(repo.git.ls_tree("HEAD"))
+    except GitCommandError as e:
+        print(f"[{url}] Error listing files: {e}")
+        return None
+
+    try:
+        dirs = [
+            path
+            for mode, type, sha, path in entries
+            if type == "tree" and path.lower() in readme_dirs
+        ]
+        if dirs:
+            entries += parse_ls_tree(
+                repo.git.ls_tree("HEAD", "--", *[f"{d}/" for d in dirs])
+            )
+
+        match = find_readme_entry(entries)
+        if match is None:
             return None
+        _, mode, sha, path = match
+
+        print(f"[{url}] Found README file")
+        if mode == "120000":
+            # symlinked README, read the file it points at
+            target = repo.git.cat_file("blob", sha)
+            path = os.path.normpath(os.path.join(os.path.dirname(path), target))
+            sha = f"HEAD:{path}"
+        s = repo.git.cat_file(
+            "blob", sha, stdout_as_string=False, strip_newline_in_stdout=False
+        )
+        return s.decode("utf-8", "replace")
+    except Exception as e:
+        print(f"[{url}] Error finding README file: {e}")
+        return None
+
 
-    return None
+def extract_readme(url, mirror_dir=None, mirror_max_bytes=DEFAULT_MAX_BYTES):
+    print(f"[{url}] Cloning repo")
+    try:
+        # without a mirror store only commits and trees of HEAD come over the wire,
+        # the README blob is fetched on demand by cat-file
+        with open_repo(
+            url,
+            mirror_dir,
+            mirror_max_bytes,
+            multi_options=["--filter=blob:none", "--no-checkout", "--depth=1"],
+        ) as repo:
+            return read_readme(url, repo)
+    except Exception as e:
+        print(f"[{url}] Error cloning repo: {e}")
+        return None
 
 
 @daft.udf(
     return_dtype=daft.DataType.string(),
     batch_size=1,
 )
-def extract_readme_to_dataframe(remote_url):
+def extract_readme_to_dataframe(
+    remote_url, mirror_dir=None, mirror_max_bytes=DEFAULT_MAX_BYTES
+):
     readme_list = []
 
     remote_urls = remote_url.to_pylist()
     for url in remote_urls:
-        readme = extract_readme(url)
+        readme = extract_readme(url, mirror_dir, mirror_max_bytes)
         readme_list.append(readme)
 
     return readme_list
 
+
+class GitError(Exception):
+    pass
+
+
+async def run_git(*args, cwd=None, timeout=None):
+    # never prompt for credentials on private or deleted repos, just fail
+    env = {**os.environ, "GIT_TERMINAL_PROMPT": "0"}
+    proc = await asyncio.create_subprocess_exec(
+        "git",
+        *args,
+        cwd=cwd,
+        env=env,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        raise GitError(f"git {args[0]} timed out after {timeout}s")
+    if proc.returncode != 0:
+        lines = stderr.decode("utf-8", "replace").strip().splitlines()
+        fatal = [line for line in lines if line.startswith(("fatal:", "error:"))]
+        reason = (fatal or lines or [f"exit code {proc.returncode}"])[0]
+        raise GitError(f"git {args[0]} failed: {reason}")
+    return stdout
+
+
+async def extract_readme_async(url, network, disk, clone_timeout=300):
+    # network guards transfers (the clone and the on-demand README blob fetch),
+    # disk guards local work on the clone (tree listing and cleanup)
+    result = {"readme": None, "clone_seconds": None, "total_seconds": None, "error": None}
+    start = time.time()
+    temp_dir = tempfile.mkdtemp()
+    try:
+        async with network:
+            clone_start = time.time()
+            await run_git(
+                "clone",
+                "--quiet",
+                "--filter=blob:none",
+                "--no-checkout",
+                "--depth=1",
+                url,
+                temp_dir,
+                timeout=clone_timeout,
+            )
+            result["clone_seconds"] = time.time() - clone_start
+
+        async with disk:
+            try:
+                entries = parse_ls_tree((await run_git("ls-tree", "HEAD", cwd=temp_dir)).decode())
+            except GitError as e:
+                # like extract_readme, an empty repo or one without a README is not an error
+                if "Not a valid object name HEAD" not in str(e):
+                    raise
+                print(f"[{url}] Repo is empty")
+                entries = []
+            dirs = [
+                path
+                for mode, type, sha, path in entries
+                if type == "tree" and path.lower() in readme_dirs
+            ]
+            if dirs:
+                listing = await run_git(
+                    "ls-tree", "HEAD", "--", *[f"{d}/" for d in dirs], cwd=temp_dir
+                )
+                entries += parse_ls_tree(listing.decode())
+
+        match = find_readme_entry(entries)
+        if match is None:
+            return result
+        _, mode, sha, path = match
+
+        async with network:
+            if mode == "120000":
+                target = (await run_git("cat-file", "blob", sha, cwd=temp_dir)).decode()
+                path = os.path.normpath(os.path.join(os.path.dirname(path), target))
+                sha = f"HEAD:{path}"
+            readme = await run_git("cat-file", "blob", sha, cwd=temp_dir, timeout=clone_timeout)
+        result["readme"] = readme.decode("utf-8", "replace")
+    except Exception as e:
+        result["error"] = str(e)
+        print(f"[{url}] {e}")
+    finally:
+        async with disk:
+            await asyncio.to_thread(shutil.rmtree, temp_dir, True)
+        result["total_seconds"] = time.time() - start
+    return result
+
+
+@daft.udf(
+    return_dtype=daft.DataType.struct(
+        dict(
+            readme=daft.DataType.string(),
+            clone_seconds=daft.DataType.float64(),
+            total_seconds=daft.DataType.float64(),
+            error=daft.DataType.string(),
+        )
+    ),
+)
+def extract_readmes_async(remote_url, max_network=32, max_disk=8, clone_timeout=300):
+    # takes the whole partition at once and overlaps the git subprocesses on one event loop
+    remote_urls = remote_url.to_pylist()
+
+    async def run_all():
+        network = asyncio.Semaphore(max_network)
+        disk = asyncio.Semaphore(max_disk)
+        return await asyncio.gather(
+            *[
+                extract_readme_async(url, network, disk, clone_timeout)
+                for url in remote_urls
+            ]
+        )
+
+    start = time.time()
+    results = asyncio.run(run_all())
+    failed = sum(r["error"] is not None for r in results)
+    print(
+        f"Extracted {len(results) - failed}/{len(results)} READMEs in {time.time() - start:.1f}s"
+    )
+    return results
+
+
 uncloneable_repos = [
     "chromium",
     "cdnjs",
@@ -148,6 +342,13 @@ if __name__ == "__main__":
     parser.add_argument("--runner", type=str, default="native")
     parser.add_argument("--write-to-file", action="store_true")
     parser.add_argument("--output-path", type=str, default="repos_with_readme")
+    # Reuse bare mirrors shared with 4_Extract_commits instead of cloning from scratch
+    parser.add_argument("--mirror-dir", type=str, default=None)
+    parser.add_argument("--mirror-max-gb", type=float, default=50)
+    # Clone a whole partition at once with asyncio git subprocesses
+    parser.add_argument("--async-clone", action="store_true")
+    parser.add_argument("--max-network", type=int, default=32)
+    parser.add_argument("--max-disk", type=int, default=8)
     args = parser.parse_args()
 
     if args.runner == "native":
@@ -163,8 +364,28 @@ if __name__ == "__main__":
         ~daft.col("name").is_in(uncloneable_repos)
     )
 
-    extractor = extract_readme_to_dataframe.with_concurrency(10)
-    df = df.with_column("readme", extractor(df["url"]))
+    start = time.time()
+    if args.async_clone:
+        if args.mirror_dir:
+            raise ValueError("--async-clone does not support --mirror-dir")
+        df = df.with_column(
+            "readme_result",
+            extract_readmes_async(df["url"], args.max_network, args.max_disk),
+        )
+        df = df.with_columns(
+            {
+                "readme": daft.col("readme_result").struct.get("readme"),
+                "readme_clone_seconds": daft.col("readme_result").struct.get("clone_seconds"),
+                "readme_total_seconds": daft.col("readme_result").struct.get("total_seconds"),
+                "readme_error": daft.col("readme_result").struct.get("error"),
+            }
+        ).exclude("readme_result")
+    else:
+        mirror_max_bytes = int(args.mirror_max_gb * 1024**3)
+        extractor = extract_readme_to_dataframe.with_concurrency(10)
+        df = df.with_column(
+            "readme", extractor(df["url"], args.mirror_dir, mirror_max_bytes)
+        )
 
     if args.write_to_file:
         path = args.output_path
@@ -173,3 +394,6 @@ if __name__ == "__main__":
         print(files)
     else:
         df.show()
+
+    if args.mirror_dir:
+        print(get_store(args.mirror_dir).summary(since=start))
@@ -0,0 +1,238 @@
+import argparse
+import daft
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "4_Extract_commits")
+)
+from pipeline_utils.commit_store import read_commits
+from pipeline_utils.repo_mirrors import DEFAULT_MAX_BYTES, get_store, open_repo
+from pipeline_utils.scheduling import schedule_repos
+from extract_readme import read_readme, uncloneable_repos
+from extract_commits import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_SPLIT_COMMITS,
+    DEFAULT_SPLIT_RANGES,
+    LAYOUTS,
+    index_file,
+    open_commit_repo,
+    previous_seconds,
+    print_extract_summary,
+    save_index,
+    state_file,
+    unique_repos,
+    window_date,
+    with_last_hashes,
+    with_repo_ids,
+    write_repo_commits,
+    write_repo_table,
+    write_state,
+)
+
+# Fused stage 2 + stage 4: clones each repo once and produces both the README
+# dataset (same schema as 2_Extract_readmes) and the commit dataset (same schema as
+# 4_Extract_commits) from that clone. Commits are streamed to the commit output
+# directory while the README rows flow through the dataframe.
+
+
+@daft.udf(
+    return_dtype=daft.DataType.struct(
+        dict(
+            readme=daft.DataType.string(),
+            repo_name=daft.DataType.string(),
+            repo_owner=daft.DataType.string(),
+            head=daft.DataType.string(),
+            mode=daft.DataType.string(),
+            commits=daft.DataType.int64(),
+            batches=daft.DataType.int64(),
+            ranges=daft.DataType.int64(),
+            duplicates=daft.DataType.int64(),
+            duplicate_bytes=daft.DataType.int64(),
+            canonical=daft.DataType.string(),
+            seconds=daft.DataType.float64(),
+            worker=daft.DataType.string(),
+            started=daft.DataType.float64(),
+            error=daft.DataType.string(),
+        )
+    ),
+    batch_size=1,
+)
+def extract_readme_and_commits(
+    remote_url,
+    last_hash,
+    repo_ids,
+    commits_output_path=None,
+    batch_size=DEFAULT_BATCH_SIZE,
+    mirror_dir=None,
+    mirror_max_bytes=DEFAULT_MAX_BYTES,
+    split_commits=DEFAULT_SPLIT_COMMITS,
+    split_ranges=DEFAULT_SPLIT_RANGES,
+    since=None,
+    until=None,
+    layout="wide",
+    index_path=None,
+):
+    results = []
+    for url, last, repo_id in zip(remote_url.to_pylist(), last_hash.to_pylist(), repo_ids.to_pylist()):
+        want_commits = commits_output_path is not None
+
+        print(f"[{url}] Cloning repo")
+        start = time.time()
+        stats = dict(
+            readme=None, repo_name=None, repo_owner=None, head=None, mode=None, commits=0, batches=0, ranges=0,
+            duplicates=0, duplicate_bytes=0, canonical=None, worker=f"{socket.gethostname()}:{os.getpid()}", started=start, error=None,
+        )
+        try:
+            if want_commits:
+                clone = open_commit_repo(url, mirror_dir, mirror_max_bytes, since)
+            else:
+                # README-only runs don't need history, so they get the cheap blobless clone
+                clone = open_repo(url, mirror_dir, mirror_max_bytes, ["--filter=blob:none", "--no-checkout", "--depth=1"])
+            with clone as repo:
+                stats["readme"] = read_readme(url, repo)
+                if want_commits:
+                    stats.update(
+                        write_repo_commits(
+                            url, repo, commits_output_path, batch_size, last, split_commits, split_ranges, since, until,
+                            layout, repo_id, index_path,
+                        )
+                    )
+        except Exception as e:
+            print(f"[{url}] Error cloning repo: {e}")
+            stats["error"] = str(e)
+        stats["seconds"] = time.time() - start
+        results.append(stats)
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input-path", type=str, default="repo_data_files")
+    parser.add_argument("--runner", type=str, default="native")
+    parser.add_argument("--partition-size", type=int, default=1024)
+    parser.add_argument("--write-to-file", action="store_true")
+    parser.add_argument("--readme-output-path", type=str, default="repos_with_readme")
+    parser.add_argument("--commits-output-path", type=str, default="raw_commits")
+    parser.add_argument("--no-commits", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Commits per record batch, bounds memory per repo")
+    parser.add_argument("--split-commits", type=int, default=DEFAULT_SPLIT_COMMITS, help="Read histories with more commits than this as parallel ranges, 0 disables it")
+    parser.add_argument("--split-ranges", type=int, default=DEFAULT_SPLIT_RANGES, help="Number of ranges, and git log processes, per split history")
+    parser.add_argument("--since", type=window_date, default=None, help="Only extract commits from this ISO date on, with a shallow clone")
+    parser.add_argument("--until", type=window_date, default=None, help="Only extract commits up to this ISO date")
+    parser.add_argument("--layout", type=str, default="wide", choices=list(LAYOUTS), help="normalized moves repo columns to <commits-output-path>_repos.parquet")
+    parser.add_argument("--state-path", type=str, default=None, help="Head extracted per repo, defaults to <commits-output-path>_state.parquet")
+    parser.add_argument("--full-rescan", action="store_true", help="Ignore the state and extract every repo's full history")
+    parser.add_argument("--dedup", action="store_true", help="Skip commits already extracted from another repo, e.g. forks")
+    parser.add_argument("--index-path", type=str, default=None, help="Commit hash index for --dedup, defaults to <commits-output-path>_commit_index.sqlite")
+    parser.add_argument("--mirror-dir", type=str, default=None)
+    parser.add_argument("--mirror-max-gb", type=float, default=50)
+    args = parser.parse_args()
+
+    if args.runner == "native":
+        daft.context.set_runner_native()
+    elif args.runner == "ray":
+        daft.context.set_runner_ray()
+    else:
+        raise ValueError(f"Invalid runner: {args.runner}")
+
+    print(
+        f"Extracting READMEs{'' if args.no_commits else ' and commits'} from repos in {args.input_path}, "
+        f"runner: {args.runner}, write-to-file: {args.write_to_file}"
+    )
+
+    start = time.time()
+    df = unique_repos(daft.read_parquet(args.input_path).where(~daft.col("name").is_in(uncloneable_repos)))
+
+    mirror_max_bytes = int(args.mirror_max_gb * 1024**3)
+    commits_output_path = state_path = index_path = None
+    if not args.no_commits:
+        commits_output_path = args.commits_output_path if args.write_to_file else tempfile.mkdtemp()
+        os.makedirs(commits_output_path, exist_ok=True)
+        if args.write_to_file:
+            state_path = args.state_path or state_file(args.commits_output_path)
+        if args.dedup:
+            index_path = args.index_path or index_file(commits_output_path)
+    df = with_last_hashes(df, None if args.full_rescan else state_path, args.since, args.until, args.layout)
+    df = with_repo_ids(df, commits_output_path, args.layout if commits_output_path else "wide")
+    # the native runner ignores partitions and runs rows in order, so it gets one, largest repo first
+    df = schedule_repos(
+        df, args.partition_size if args.runner == "ray" else 1, previous_seconds(state_path, args.since, args.until)
+    )
+    extractor = extract_readme_and_commits.with_concurrency(10)
+    df = df.with_column(
+        "extracted",
+        extractor(
+            df["url"],
+            df["last_hash"],
+            df["repo_id"],
+            commits_output_path,
+            args.batch_size,
+            args.mirror_dir,
+            mirror_max_bytes,
+            args.split_commits,
+            args.split_ranges,
+            args.since,
+            args.until,
+            args.layout,
+            index_path,
+        ),
+    )
+
+    # one materialized pass clones each repo once, writing its commits as it goes
+    fused_path = f"{args.readme_output_path.rstrip('/')}_fused_tmp"
+    if args.write_to_file:
+        df.write_parquet(fused_path)
+        df = daft.read_parquet(fused_path)
+    else:
+        df = df.collect()
+    readmes = df.with_column(
+        "readme", daft.col("extracted").struct.get("readme")
+    ).exclude("extracted", "last_hash", "repo_id")
+    stats = None
+    if not args.no_commits:
+        stats = df.select(
+            daft.col("url"),
+            daft.col("repo_id"),
+            daft.col("extracted").struct.get("repo_name"),
+            daft.col("extracted").struct.get("repo_owner"),
+            daft.col("extracted").struct.get("head"),
+            daft.col("extracted").struct.get("mode"),
+            daft.col("extracted").struct.get("commits"),
+            daft.col("extracted").struct.get("batches"),
+            daft.col("extracted").struct.get("ranges"),
+            daft.col("extracted").struct.get("duplicates"),
+            daft.col("extracted").struct.get("duplicate_bytes"),
+            daft.col("extracted").struct.get("canonical"),
+            daft.col("extracted").struct.get("seconds"),
+            daft.col("extracted").struct.get("worker"),
+            daft.col("extracted").struct.get("started"),
+            daft.col("extracted").struct.get("error"),
+        ).to_pydict()
+        print_extract_summary(stats)
+        if args.layout == "normalized":
+            write_repo_table(commits_output_path, stats, args.since, args.until)
+        if index_path:
+            print(save_index(index_path))
+
+    if args.write_to_file:
+        files = readmes.write_parquet(args.readme_output_path)
+        print(f"Wrote README files to {args.readme_output_path}")
+        print(files)
+        if not args.no_commits:
+            write_state(state_path, stats, args.since, args.until, args.layout)
+            print(f"Wrote commit files to {commits_output_path}")
+        shutil.rmtree(fused_path, ignore_errors=True)
+    else:
+        readmes.show()
+        if not args.no_commits:
+            read_commits(commits_output_path).show()
+
+    if args.mirror_dir:
+        print(get_store(args.mirror_dir).summary(since=start))
@@ -4,14 +4,33 @@ from pydantic import BaseModel
 import daft
 import os
 from dotenv import load_dotenv
-import pypandoc
-import re
 from openai import AsyncOpenAI
 from fireworks.client import AsyncFireworks
 import asyncio
+import sys
+import multiprocessing
+import multiprocessing.util
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_utils.batch_inference import (
+    BatchJob,
+    load_openai_batch_client_and_model,
+    parquet_partitions,
+    parse_tool_response,
+    run_batch_jobs,
+    tool_request,
+)
+from pipeline_utils.llm_cache import DEFAULT_MAX_BYTES, cache_key, get_cache
+from pipeline_utils.concurrency import AIMDLimiter
+from pipeline_utils.llm_clients import BackgroundLoop, make_http_client, validation_retries
+from readme_text import TOKEN_COUNTER, compact_readme
 
 load_dotenv()
 
+# Part of the LLM cache key, bump whenever the prompt or post-processing below changes
+PROMPT_VERSION = 1
+
 def load_fireworks_client_and_model(timeout=60):
     FIREWORKS_API_KEY = os.environ.get("FIREWORKS_API_KEY")
     if not FIREWORKS_API_KEY:
@@ -23,7 +42,7 @@ def load_fireworks_client_and_model(timeout=60):
     
     return instructor.from_fireworks(AsyncFireworks(api_key=FIREWORKS_API_KEY, timeout=timeout)), FIREWORKS_MODEL
 
-def load_openai_client_and_model(timeout=60):
+def load_openai_client_and_model(timeout=60, http_client=None, max_retries=2):
     OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
     if not OPENAI_API_KEY:
         raise ValueError("OPENAI_API_KEY is not set")
@@ -32,63 +51,15 @@ def load_openai_client_and_model(timeout=60):
     if not OPENAI_MODEL:
         raise ValueError("OPENAI_MODEL is not set")
     
-    return instructor.from_openai(AsyncOpenAI(api_key=OPENAI_API_KEY, timeout=timeout)), OPENAI_MODEL
-
-def guess_format(text):
-    if text is None:
-        return "unknown"
-    md_score = 0
-    rst_score = 0
-    
-    # Very rough heuristic checks:
-    if re.search(r'\[[^\]]+\]\(http', text):
-        md_score += 1
-    if re.search(r'^\s*#{1,6}\s+\S', text, flags=re.MULTILINE):
-        md_score += 1
-    if re.search(r'^\.\.\s+\w+::', text, flags=re.MULTILINE):
-        rst_score += 1
-    if re.search(r'^[=\-`:\.' "'^~*+#]+(\r?\n)+", text, flags=re.MULTILINE):
-        rst_score += 1
-    
-    if md_score > rst_score:
-        return "markdown"
-    elif rst_score > md_score:
-        return "rst"
-    else:
-        return "unknown"
+    return instructor.from_openai(AsyncOpenAI(api_key=OPENAI_API_KEY, timeout=timeout, http_client=http_client, max_retries=max_retries)), OPENAI_MODEL
 
 class ProjectAnalysis(BaseModel):
     languages: list[str]
     keywords: list[str]
 
-@daft.udf(
-    return_dtype=daft.DataType.struct(
-        dict(
-            languages=daft.DataType.list(daft.DataType.string()),
-            keywords=daft.DataType.list(daft.DataType.string()),
-        )
-    ),
-)
-def analyze_repo_readme_and_description(repo_name, readme, description, max_concurrent_requests=64, max_tokens=256, provider="OpenAI"):
-    if provider == "OpenAI":
-        client, model = load_openai_client_and_model()
-    elif provider == "Fireworks":
-        client, model = load_fireworks_client_and_model()
-    else:
-        raise ValueError(f"Invalid provider: {provider}")
 
-    async def analyze_single_readme_and_description(client, repo_name, readme, description):
-        print(f"Analyzing {repo_name}")
-        try:
-            format = guess_format(readme)
-            if format == "markdown":
-                readme = pypandoc.convert_text(readme, to="plain", format="markdown")
-            elif format == "rst":
-                readme = pypandoc.convert_text(readme, to="plain", format="rst")
-        except Exception as e:
-            readme = readme
-
-        prompt = f"""You are an expert at analyzing GitHub repositories. Your task is to analyze this GitHub repository to:
+def build_prompt(repo_name, description, readme):
+    prompt = f"""You are an expert at analyzing GitHub repositories. Your task is to analyze this GitHub repository to:
         1. Determine the programming languages used in the repository.
         2. Generate a list of relevant keywords that describe the repository. 
         The keywords should contain the most important concepts and ideas in the repository, 
@@ -103,49 +74,166 @@ def analyze_repo_readme_and_description(repo_name, readme, description, max_conc
         1. A list of the top 2 programming languages used in this repository. Make sure to not produce more than 2 languages.
         2. A list of the top 10 relevant keywords that describe the repository. Make sure to not produce more than 10 keywords. If the keywords are compound words, use a hyphen to join them.
         """
+    return prompt
 
-        from tenacity import retry, stop_after_attempt, wait_exponential
 
-        @retry(stop=stop_after_attempt(5), wait=wait_exponential(multiplier=1, min=4, max=60), reraise=True)
-        async def fetch_completion(client, model, prompt, max_tokens):
-            return await client.chat.completions.create(
-                model=model,
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=max_tokens,
-                response_model=ProjectAnalysis,
+def postprocess(result_dict, readme_tokens, prompt_readme_tokens):
+    result_dict['languages'] = sorted(result_dict['languages'])
+    result_dict['keywords'] = sorted([keyword.replace(" ", "-") for keyword in result_dict['keywords']])
+    result_dict['readme_tokens'] = readme_tokens
+    result_dict['prompt_readme_tokens'] = prompt_readme_tokens
+    return result_dict
+
+
+@daft.udf(
+    return_dtype=daft.DataType.struct(
+        dict(
+            languages=daft.DataType.list(daft.DataType.string()),
+            keywords=daft.DataType.list(daft.DataType.string()),
+            readme_tokens=daft.DataType.int64(),
+            prompt_readme_tokens=daft.DataType.int64(),
+        )
+    ),
+)
+class AnalyzeRepoReadmeAndDescription:
+    # Stateful UDF, run it with with_concurrency() so each worker builds its client,
+    # HTTP connection pool, event loop and conversion pool once for the whole run
+    def __init__(
+        self,
+        max_concurrent_requests=64,
+        initial_concurrent_requests=8,
+        max_tokens=256,
+        provider="OpenAI",
+        cache_path=None,
+        cache_max_bytes=DEFAULT_MAX_BYTES,
+        use_pandoc=False,
+        convert_workers=None,
+        readme_max_tokens=None,
+    ):
+        if provider == "OpenAI":
+            self.client, self.model = load_openai_client_and_model(
+                http_client=make_http_client(max_concurrent_requests), max_retries=0
             )
+        elif provider == "Fireworks":
+            self.client, self.model = load_fireworks_client_and_model()
+        else:
+            raise ValueError(f"Invalid provider: {provider}")
+
+        self.loop = BackgroundLoop()
+        # README conversion and compaction are CPU bound, run them in worker processes so
+        # they don't block the event loop (spawned, forking next to the loop thread isn't safe)
+        self.executor = ProcessPoolExecutor(max_workers=convert_workers, mp_context=multiprocessing.get_context("spawn"))
+        # daft's UDF worker joins its child processes on exit, shut the pool down before that.
+        # Above the priority (10) of multiprocessing's own queue finalizers, which would otherwise
+        # close the pool's call queue first and leave the workers waiting for a shutdown signal
+        multiprocessing.util.Finalize(self, self.executor.shutdown, exitpriority=100)
+        self.limiter = AIMDLimiter(initial=initial_concurrent_requests, max_limit=max_concurrent_requests)
+        self.max_tokens = max_tokens
+        self.provider = provider
+        self.cache = get_cache(cache_path, cache_max_bytes) if cache_path else None
+        self.use_pandoc = use_pandoc
+        self.readme_max_tokens = readme_max_tokens
+
+    async def analyze_single_readme_and_description(self, repo_name, readme, description):
+        print(f"Analyzing {repo_name}")
+        readme, readme_tokens, prompt_readme_tokens = await asyncio.get_running_loop().run_in_executor(
+            self.executor, compact_readme, readme, self.readme_max_tokens, self.use_pandoc
+        )
+
+        prompt = build_prompt(repo_name, description, readme)
 
         try:
-            result = await fetch_completion(client, model, prompt, max_tokens)
-            print(f"Analyzed {repo_name} with {model}")
-            result_dict = result.model_dump()
-            result_dict['languages'] = sorted(result_dict['languages'])
-            result_dict['keywords'] = sorted([keyword.replace(" ", "-") for keyword in result_dict['keywords']])
-            return result_dict
+            result = await self.limiter.run(
+                self.client.chat.completions.create,
+                model=self.model,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=self.max_tokens,
+                response_model=ProjectAnalysis,
+                max_retries=validation_retries(5),
+            )
+            print(f"Analyzed {repo_name} with {self.model}")
+            return postprocess(result.model_dump(), readme_tokens, prompt_readme_tokens)
         except Exception as e:
             print(f"Error analyzing {repo_name}: {e}")
             return None
 
-    semaphore = asyncio.Semaphore(max_concurrent_requests)
+    async def analyze_rows(self, rows):
+        results = await asyncio.gather(*[self.analyze_single_readme_and_description(*row) for row in rows])
+        print(self.limiter.summary())
+        return results
 
-    async def analyze_with_semaphore(*args):
-        async with semaphore:
-            return await analyze_single_readme_and_description(*args)
+    def __call__(self, repo_name, readme, description):
+        rows = list(zip(repo_name.to_pylist(), readme.to_pylist(), description.to_pylist()))
 
-    tasks = [
-        analyze_with_semaphore(client, repo_name, readme, description)
-        for repo_name, readme, description in zip(
-            repo_name,
-            readme,
-            description,
+        # Resolve the whole batch against the cache first, only misses go to the provider
+        keys = [
+            cache_key(
+                self.provider, self.model, PROMPT_VERSION, self.use_pandoc, self.readme_max_tokens, TOKEN_COUNTER,
+                name, desc, text,
+            )
+            for name, text, desc in rows
+        ]
+        cached = self.cache.get_many(keys) if self.cache else {}
+
+        misses = [i for i, key in enumerate(keys) if key not in cached]
+        results = [cached.get(key) for key in keys]
+        if misses:
+            for i, result in zip(misses, self.loop.run(self.analyze_rows([rows[i] for i in misses]))):
+                results[i] = result
+        if self.cache:
+            self.cache.put_many([(keys[i], results[i]) for i in misses if results[i] is not None])
+        readme_tokens = sum(r["readme_tokens"] for r in results if r)
+        prompt_readme_tokens = sum(r["prompt_readme_tokens"] for r in results if r)
+        print(
+            f"Analyzed {len(rows)} repos, {len(rows) - len(misses)} from cache, "
+            f"README tokens {readme_tokens} -> {prompt_readme_tokens} after compaction"
         )
-    ]
+        return results
+
+
+def analyze_in_batch_mode(input_path, batch_dir, cache=None, use_pandoc=False, readme_max_tokens=None, poll_interval=30, wait=True, max_tokens=256):
+    # One batch job per input parquet file, with the LLM cache key as the request id so
+    # cached rows are never submitted. Returns None until every job has finished, rerun
+    # with the same --batch-dir to pick up where the last run left off.
+    client, model = load_openai_batch_client_and_model()
+    partitions = []
+    for partition, path in parquet_partitions(input_path):
+        table = daft.read_parquet(path).to_arrow()
+        rows = list(zip(*(table.column(name).to_pylist() for name in ["name", "readme", "description"])))
+        keys = [
+            cache_key("OpenAI", model, PROMPT_VERSION, use_pandoc, readme_max_tokens, TOKEN_COUNTER, name, desc, text)
+            for name, text, desc in rows
+        ]
+        cached = cache.get_many(keys) if cache else {}
+        requests, tokens = {}, {}
+        for key, (name, text, desc) in zip(keys, rows):
+            if key in cached or key in requests:
+                continue
+            readme, readme_tokens, prompt_readme_tokens = compact_readme(text, readme_max_tokens, use_pandoc)
+            tokens[key] = (readme_tokens, prompt_readme_tokens)
+            requests[key] = tool_request(key, model, build_prompt(name, desc, readme), ProjectAnalysis, max_tokens)
+        job = BatchJob(client, os.path.join(batch_dir, partition), requests, lambda body: parse_tool_response(body, ProjectAnalysis))
+        partitions.append((table, keys, cached, tokens, job))
+        print(f"{partition}: {len(rows)} repos, {len(rows) - len(requests)} from cache or duplicates")
 
-    async def run_tasks():
-        return await asyncio.gather(*tasks)
+    if not run_batch_jobs([job for *_, job in partitions], poll_interval, wait):
+        return None
 
-    results = asyncio.run(run_tasks())
-    return results
+    import pyarrow as pa
+
+    tables = []
+    for table, keys, cached, tokens, job in partitions:
+        fresh = {key: postprocess(result, *tokens[key]) for key, result in job.results().items()}
+        if cache:
+            cache.put_many(list(fresh.items()))
+        results = [cached.get(key) or fresh.get(key) or {} for key in keys]
+        strings = pa.list_(pa.large_string())
+        table = table.append_column("languages", pa.array([r.get("languages") for r in results], strings))
+        table = table.append_column("keywords", pa.array([r.get("keywords") for r in results], strings))
+        table = table.append_column("readme_tokens", pa.array([r.get("readme_tokens") for r in results], pa.int64()))
+        table = table.append_column("prompt_readme_tokens", pa.array([r.get("prompt_readme_tokens") for r in results], pa.int64()))
+        tables.append(table)
+    return daft.from_arrow(tables)
 
 
 if __name__ == "__main__":
@@ -154,31 +242,76 @@ if __name__ == "__main__":
     parser.add_argument("--runner", type=str, default="native")
     parser.add_argument("--write-to-file", action="store_true")
     parser.add_argument("--output-path", type=str, default="analyzed_repos")
+    parser.add_argument("--provider", type=str, default="OpenAI")
+    parser.add_argument("--llm-cache-path", type=str, default=".llm_cache/analyze_repo.sqlite")
+    parser.add_argument("--llm-cache-max-mb", type=float, default=256)
+    parser.add_argument("--no-llm-cache", action="store_true")
+    parser.add_argument("--pandoc", action="store_true", help="Convert READMEs with pandoc instead of the in-process converter")
+    parser.add_argument("--convert-workers", type=int, default=None)
+    parser.add_argument("--readme-max-tokens", type=int, default=2048, help="Compact READMEs to this many tokens, 0 to disable")
+    parser.add_argument("--max-concurrent-requests", type=int, default=64, help="Upper bound for the adaptive concurrency limit")
+    parser.add_argument("--initial-concurrent-requests", type=int, default=8)
+    parser.add_argument("--mode", type=str, default="sync", choices=["sync", "batch"], help="batch submits the prompts to the OpenAI batch endpoint")
+    parser.add_argument("--batch-dir", type=str, default=".batch_jobs/analyze_repo", help="Request files, batch ids and results for --mode batch")
+    parser.add_argument("--batch-poll-interval", type=float, default=30)
+    parser.add_argument("--batch-submit-only", action="store_true", help="Submit the batches and exit without waiting for them")
     args = parser.parse_args()
 
+    cache_path = None if args.no_llm_cache else args.llm_cache_path
+    cache_max_bytes = int(args.llm_cache_max_mb * 1024 * 1024)
+    if cache_path:
+        get_cache(cache_path, cache_max_bytes).reset_stats()
+
     print(f"Analyzing repos from {args.input_path}, runner: {args.runner}, write-to-file: {args.write_to_file}")
 
-    repo_data = daft.read_parquet(args.input_path)
-
-    # Analyze readme and description
-    readme_and_description_analyzer = (
-        analyze_repo_readme_and_description.with_concurrency(1)
-    )
-    repo_data_with_keywords = repo_data.with_column(
-        "project_analysis",
-        readme_and_description_analyzer(
-            repo_data["name"], repo_data["readme"], repo_data["description"]
-        ),
-    )
-    repo_data_with_keywords = repo_data_with_keywords.with_columns(
-        {
-            "languages": daft.col("project_analysis").struct.get("languages"),
-            "keywords": daft.col("project_analysis").struct.get("keywords"),
-        }
-    )
-    repo_data_with_keywords = repo_data_with_keywords.exclude(
-        "project_analysis"
-    )
+    if args.mode == "batch":
+        if args.provider != "OpenAI":
+            raise ValueError("--mode batch is only supported with the OpenAI provider")
+        repo_data_with_keywords = analyze_in_batch_mode(
+            args.input_path,
+            args.batch_dir,
+            cache=get_cache(cache_path, cache_max_bytes) if cache_path else None,
+            use_pandoc=args.pandoc,
+            readme_max_tokens=args.readme_max_tokens,
+            poll_interval=args.batch_poll_interval,
+            wait=not args.batch_submit_only,
+        )
+        if repo_data_with_keywords is None:
+            print(f"Batch jobs in {args.batch_dir} are still running, rerun to collect the results")
+            sys.exit(0)
+    else:
+        repo_data = daft.read_parquet(args.input_path)
+
+        # Analyze readme and description
+        readme_and_description_analyzer = AnalyzeRepoReadmeAndDescription.with_init_args(
+            max_concurrent_requests=args.max_concurrent_requests,
+            initial_concurrent_requests=args.initial_concurrent_requests,
+            provider=args.provider,
+            cache_path=cache_path,
+            cache_max_bytes=cache_max_bytes,
+            use_pandoc=args.pandoc,
+            convert_workers=args.convert_workers,
+            readme_max_tokens=args.readme_max_tokens,
+        ).with_concurrency(1)
+        repo_data_with_keywords = repo_data.with_column(
+            "project_analysis",
+            readme_and_description_analyzer(
+                repo_data["name"],
+                repo_data["readme"],
+                repo_data["description"],
+            ),
+        )
+        repo_data_with_keywords = repo_data_with_keywords.with_columns(
+            {
+                "languages": daft.col("project_analysis").struct.get("languages"),
+                "keywords": daft.col("project_analysis").struct.get("keywords"),
+                "readme_tokens": daft.col("project_analysis").struct.get("readme_tokens"),
+                "prompt_readme_tokens": daft.col("project_analysis").struct.get("prompt_readme_tokens"),
+            }
+        )
+        repo_data_with_keywords = repo_data_with_keywords.exclude(
+            "project_analysis"
+        )
 
     if args.write_to_file:
         files = repo_data_with_keywords.write_parquet(
@@ -189,3 +322,6 @@ if __name__ == "__main__":
         print(files)
     else:
         repo_data_with_keywords.show()
+
+    if cache_path:
+        print(get_cache(cache_path).summary())
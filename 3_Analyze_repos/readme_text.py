@@ -0,0 +1,304 @@
+import html
+import re
+import traceback
+
+# Fast in-process README to plain text conversion. It covers the markdown and
+# reStructuredText constructs that show up in READMEs well enough for an LLM
+# prompt, without paying for a pandoc subprocess per row. pandoc is still
+# available through readme_to_text(..., use_pandoc=True).
+
+# The token counter is part of the LLM cache key, since it decides what compaction keeps.
+# It's a fixed estimate rather than a tokenizer that may or may not be installed, so the
+# same README always gives the same prompt.
+TOKEN_COUNTER = "chars/4"
+
+
+def count_tokens(text):
+    if not text:
+        return 0
+    # roughly 4 characters per token for English prose and markup
+    return (len(text) + 3) // 4
+
+
+def guess_format(text):
+    if text is None:
+        return "unknown"
+    md_score = 0
+    rst_score = 0
+
+    # Very rough heuristic checks:
+    if re.search(r'\[[^\]]+\]\(http', text):
+        md_score += 1
+    if re.search(r'^\s*#{1,6}\s+\S', text, flags=re.MULTILINE):
+        md_score += 1
+    if re.search(r'^\.\.\s+\w+::', text, flags=re.MULTILINE):
+        rst_score += 1
+    if re.search(r'^[=\-`:\.' "'^~*+#]+(\r?\n)+", text, flags=re.MULTILINE):
+        rst_score += 1
+
+    if md_score > rst_score:
+        return "markdown"
+    elif rst_score > md_score:
+        return "rst"
+    else:
+        return "unknown"
+
+
+HTML_COMMENT = re.compile(r"<!--.*?-->", re.DOTALL)
+HTML_TAG = re.compile(r"</?[a-zA-Z][^>]*>")
+BLANK_LINES = re.compile(r"\n{3,}")
+
+MD_FENCE = re.compile(r"^\s*(```|~~~)")
+MD_IMAGE = re.compile(r"!\[([^\]]*)\]\([^)]*\)")
+MD_LINK = re.compile(r"\[([^\]]*)\]\([^)]*\)")
+MD_REF_LINK = re.compile(r"\[([^\]]+)\]\[[^\]]*\]")
+MD_REF_DEF = re.compile(r"^\s{0,3}\[[^\]]+\]:\s+\S+.*$")
+MD_AUTOLINK = re.compile(r"<((?:https?|mailto):[^>]+)>")
+MD_HEADING = re.compile(r"^\s{0,3}#{1,6}\s+(.*?)\s*#*\s*$")
+MD_SETEXT = re.compile(r"^\s{0,3}(=+|-+)\s*$")
+MD_BLOCKQUOTE = re.compile(r"^\s{0,3}>\s?")
+MD_TABLE_RULE = re.compile(r"^\s*\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?\s*$")
+MD_EMPHASIS = re.compile(r"(\*\*|__|~~)(.+?)\1|(?<![\w*])\*(?!\s)(.+?)(?<!\s)\*(?!\w)|(?<!\w)_(?!\s)(.+?)(?<!\s)_(?!\w)")
+MD_INLINE_CODE = re.compile(r"`+([^`]+)`+")
+
+RST_SECTION_RULE = re.compile(r"^([=\-`:.'\"^~*+#])\1{2,}\s*$")
+RST_DIRECTIVE = re.compile(r"^\.\.\s+(\|[^|]+\|\s+)?[\w-]+::.*$")
+RST_COMMENT = re.compile(r"^\.\.(\s|$)")
+RST_FIELD = re.compile(r"^\s+:[\w-]+:.*$")
+RST_LINK = re.compile(r"`([^`<]+?)\s*<[^>]+>`__?")
+RST_REF = re.compile(r"`([^`]+)`__?")
+RST_ROLE = re.compile(r":[\w-]+:`([^`]+)`")
+RST_LITERAL = re.compile(r"``(.+?)``")
+RST_SUBSTITUTION = re.compile(r"\|([^|\s][^|]*)\|_?")
+
+
+def markdown_to_text(text):
+    text = HTML_COMMENT.sub("", text)
+    out = []
+    in_fence = False
+    for line in text.splitlines():
+        if MD_FENCE.match(line):
+            in_fence = not in_fence
+            continue
+        if in_fence:
+            # code stays, like pandoc's plain writer, just without the fences
+            out.append(line)
+            continue
+        if MD_REF_DEF.match(line) or MD_TABLE_RULE.match(line) or MD_SETEXT.match(line):
+            continue
+
+        line = MD_BLOCKQUOTE.sub("", line)
+        heading = MD_HEADING.match(line)
+        if heading:
+            line = heading.group(1)
+        if line.lstrip().startswith("|"):
+            line = "  ".join(cell.strip() for cell in line.strip().strip("|").split("|"))
+
+        line = MD_IMAGE.sub(r"\1", line)
+        line = MD_LINK.sub(r"\1", line)
+        line = MD_REF_LINK.sub(r"\1", line)
+        line = MD_AUTOLINK.sub(r"\1", line)
+        line = HTML_TAG.sub("", line)
+        line = MD_INLINE_CODE.sub(r"\1", line)
+        line = MD_EMPHASIS.sub(lambda m: m.group(2) or m.group(3) or m.group(4) or "", line)
+        out.append(html.unescape(line).rstrip())
+    return BLANK_LINES.sub("\n\n", "\n".join(out)).strip()
+
+
+def rst_to_text(text):
+    out = []
+    in_directive = False
+    for line in text.splitlines():
+        if RST_SECTION_RULE.match(line):
+            continue
+        if RST_DIRECTIVE.match(line) or RST_COMMENT.match(line):
+            # directive bodies (code blocks, notes) are kept, their options are not
+            in_directive = True
+            continue
+        if in_directive and RST_FIELD.match(line):
+            continue
+        if line.strip() and not line[0].isspace():
+            in_directive = False
+
+        line = RST_LINK.sub(r"\1", line)
+        line = RST_ROLE.sub(r"\1", line)
+        line = RST_LITERAL.sub(r"\1", line)
+        line = RST_REF.sub(r"\1", line)
+        line = RST_SUBSTITUTION.sub(r"\1", line)
+        line = MD_EMPHASIS.sub(lambda m: m.group(2) or m.group(3) or m.group(4) or "", line)
+        if line.endswith("::"):
+            line = line[:-1]
+        out.append(line.rstrip())
+    return BLANK_LINES.sub("\n\n", "\n".join(out)).strip()
+
+
+# (format, exception type) pairs already printed, so a broken converter shows up in the
+# logs once per worker instead of once per README
+_logged_failures = set()
+
+
+def readme_to_text(readme, use_pandoc=False, format=None):
+    if readme is None:
+        return None
+    try:
+        format = format or guess_format(readme)
+        if use_pandoc:
+            import pypandoc
+
+            if format in ("markdown", "rst"):
+                return pypandoc.convert_text(readme, to="plain", format=format)
+            return readme
+        if format == "markdown":
+            return markdown_to_text(readme)
+        elif format == "rst":
+            return rst_to_text(readme)
+    except Exception as e:
+        failure = (format, type(e).__name__)
+        if failure not in _logged_failures:
+            _logged_failures.add(failure)
+            print(f"Converting a {format} README failed, using it as is: {traceback.format_exc()}")
+    return readme
+
+
+# README compaction: split the raw README into sections by heading, strip the
+# parts that cost tokens without saying what the project is about (code blocks,
+# tables, badge walls, link lists, repeated boilerplate) and keep the most useful
+# sections, in their original order, until the token budget is spent.
+
+HIGH_VALUE_HEADINGS = re.compile(
+    r"about|overview|introduction|intro\b|description|what|why|features|highlights|summary|motivation|goals",
+    re.IGNORECASE,
+)
+LOW_VALUE_HEADINGS = re.compile(
+    r"licen[cs]e|changelog|change log|changes|history|release|contribut|authors|maintainers|credits|"
+    r"acknowledg|thanks|sponsor|backers|donat|citation|cite|code of conduct|support|contact|faq|"
+    r"table of contents|contents|toc\b|badges|status|troubleshoot|test",
+    re.IGNORECASE,
+)
+MID_VALUE_HEADINGS = re.compile(r"usage|getting started|quick ?start|example|install|setup|build|api", re.IGNORECASE)
+
+MD_TABLE_ROW = re.compile(r"^\s*\|.*\|\s*$")
+RST_TABLE_ROW = re.compile(r"^\s*(\+[-=+]+\+|\|.*\|)\s*$")
+RST_ADORNMENT = re.compile(r"^([=\-`:.'\"^~*+#])\1+\s*$")
+LINK_ONLY_LINE = re.compile(r"^\s*([-*+]\s+)?((!?\[[^\]]*\]\([^)]*\)|\[!\[[^\]]*\]\([^)]*\)\]\([^)]*\)|<img[^>]*>|<a [^>]*>|</a>)\s*)+$")
+RST_CODE_DIRECTIVE = re.compile(r"^\.\.\s+(code|code-block|sourcecode|literalinclude|image|figure|raw|csv-table|list-table|table|\|[^|]+\|\s+image)::")
+
+
+def split_sections(readme, format):
+    # returns [(heading, body lines)], the text before the first heading has heading None
+    sections = [(None, [])]
+    lines = readme.splitlines()
+    in_fence = False
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if format != "rst" and MD_FENCE.match(line):
+            in_fence = not in_fence
+        elif not in_fence:
+            heading = MD_HEADING.match(line) if format != "rst" else None
+            next_line = lines[i + 1] if i + 1 < len(lines) else ""
+            if heading:
+                sections.append((heading.group(1), []))
+                i += 1
+                continue
+            if line.strip() and not line[0].isspace() and RST_ADORNMENT.match(next_line) and len(next_line.strip()) >= len(line.strip()):
+                sections.append((line.strip(), []))
+                i += 2
+                continue
+            if RST_ADORNMENT.match(line) and format == "rst" and RST_ADORNMENT.match(lines[i + 2] if i + 2 < len(lines) else ""):
+                # overlined rst title
+                sections.append((next_line.strip(), []))
+                i += 3
+                continue
+        sections[-1][1].append(line)
+        i += 1
+    return sections
+
+
+def strip_noise(lines, format):
+    out = []
+    in_fence = False
+    skip_indented = False
+    for line in lines:
+        if MD_FENCE.match(line):
+            in_fence = not in_fence
+            continue
+        if in_fence:
+            continue
+        if skip_indented:
+            # rst literal and directive bodies are indented, blank lines don't end them
+            if not line.strip() or line[0].isspace():
+                continue
+            skip_indented = False
+        if RST_CODE_DIRECTIVE.match(line) or (format == "rst" and line.rstrip().endswith("::")):
+            skip_indented = True
+            if not line.startswith(".."):
+                out.append(line.rstrip()[:-1])
+            continue
+        if MD_TABLE_ROW.match(line) or MD_TABLE_RULE.match(line) or RST_TABLE_ROW.match(line):
+            continue
+        if LINK_ONLY_LINE.match(line) or MD_REF_DEF.match(line) or line.startswith(".. _"):
+            continue
+        out.append(line)
+    return out
+
+
+def section_score(index, heading):
+    if index == 0 or heading is None:
+        return 3
+    if HIGH_VALUE_HEADINGS.search(heading):
+        return 2
+    if LOW_VALUE_HEADINGS.search(heading):
+        return -1
+    if MID_VALUE_HEADINGS.search(heading):
+        return 0
+    return 1
+
+
+def truncate_to_tokens(text, max_tokens):
+    return text[: max_tokens * 4]
+
+
+def compact_readme(readme, max_tokens=None, use_pandoc=False):
+    # returns (text, original_tokens, compacted_tokens), where original_tokens counts
+    # the converted README as it would have gone into the prompt uncompacted
+    text = readme_to_text(readme, use_pandoc)
+    original_tokens = count_tokens(text)
+    if not max_tokens or original_tokens <= max_tokens:
+        return text, original_tokens, original_tokens
+
+    format = guess_format(readme)
+    seen = set()
+    sections = []
+    for index, (heading, lines) in enumerate(split_sections(readme, format)):
+        body = readme_to_text("\n".join(strip_noise(lines, format)), use_pandoc, format)
+        paragraphs = []
+        for paragraph in re.split(r"\n\s*\n", body or ""):
+            normalized = " ".join(paragraph.split()).lower()
+            if not normalized or normalized in seen:
+                continue
+            seen.add(normalized)
+            paragraphs.append(paragraph.strip("\n"))
+        if heading:
+            heading = rst_to_text(heading) if format == "rst" else markdown_to_text(heading)
+        if not paragraphs:
+            continue
+        section = "\n\n".join(([heading] if heading else []) + paragraphs)
+        sections.append((section_score(index, heading), index, section))
+
+    budget = max_tokens
+    kept = []
+    for score, index, section in sorted(sections, key=lambda s: (-s[0], s[1])):
+        tokens = count_tokens(section) + 1
+        if tokens <= budget:
+            kept.append((index, section))
+            budget -= tokens
+        elif not kept:
+            # the most important section alone is over budget, keep its start
+            kept.append((index, truncate_to_tokens(section, budget)))
+            budget = 0
+        if budget <= 0:
+            break
+
+    compacted = "\n\n".join(section for _, section in sorted(kept))
+    return compacted, original_tokens, count_tokens(compacted)
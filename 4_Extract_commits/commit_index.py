@@ -0,0 +1,184 @@
+import os
+import sqlite3
+import threading
+from collections import Counter
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Index of every commit hash extracted so far and the repo it was first extracted
+# from, used to drop the history forks and mirrors share with a repo that is already
+# in the output. The exact set is a SQLite table shared by all UDF worker processes.
+# In front of it sits a Bloom filter, so hashes that are certainly new (nearly all of
+# them outside forks) never need a lookup. The filter is saved next to the database
+# with the last row it covers and caught up from the table before every claim. It
+# therefore has no false negatives, even with other workers inserting at the same time.
+# A repo that fails partway releases the hashes it claimed (their owner goes back to
+# null, rows are never deleted so the filter's last row stays valid), and the next repo
+# with those commits claims them.
+
+BITS_PER_COMMIT = 10
+# hash functions, each takes 4 bytes of the (already uniformly random) commit hash
+HASHES = 5
+DEFAULT_CAPACITY = 1_000_000
+
+
+class BloomFilter:
+    def __init__(self, capacity, bits=None):
+        self.capacity = capacity
+        self.size = capacity * BITS_PER_COMMIT
+        self.bits = bits if bits is not None else bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        return [int.from_bytes(key[4 * i : 4 * i + 4], "little") % self.size for i in range(HASHES)]
+
+    def add(self, key):
+        bits = self.bits
+        for position in self._positions(key):
+            bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class CommitIndex:
+    def __init__(self, path, capacity=DEFAULT_CAPACITY):
+        self.path = path
+        self.bloom_path = f"{path}.bloom"
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=600, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS repos (id INTEGER PRIMARY KEY, url TEXT UNIQUE)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS commits (hash BLOB PRIMARY KEY, repo INTEGER)")
+        self._repo_ids = {}
+        self._load_bloom(capacity)
+
+    def _load_bloom(self, capacity):
+        # the saved filter if there is one big enough, otherwise a new one built from the table
+        (count,) = self._db.execute("SELECT COUNT(*) FROM commits").fetchone()
+        capacity = max(capacity, 2 * count)
+        self.bloom, self.last_row = BloomFilter(capacity), 0
+        if os.path.exists(self.bloom_path):
+            with open(self.bloom_path, "rb") as f:
+                saved_capacity = int.from_bytes(f.read(8), "little")
+                last_row = int.from_bytes(f.read(8), "little")
+                if saved_capacity >= capacity:
+                    self.bloom, self.last_row = BloomFilter(saved_capacity, bytearray(f.read())), last_row
+        self._catch_up()
+
+    def _catch_up(self):
+        # adds the hashes other workers inserted since the filter was last updated
+        for row, key in self._db.execute("SELECT rowid, hash FROM commits WHERE rowid > ? ORDER BY rowid", (self.last_row,)):
+            self.bloom.add(key)
+            self.last_row = row
+        if self.last_row > self.bloom.capacity:
+            # too full for its false positive rate, start over twice as big
+            self.bloom, self.last_row = BloomFilter(2 * self.last_row), 0
+            self._catch_up()
+
+    def save(self):
+        with self._lock:
+            self._catch_up()
+            tmp = f"{self.bloom_path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(self.bloom.capacity.to_bytes(8, "little"))
+                f.write(self.last_row.to_bytes(8, "little"))
+                f.write(self.bloom.bits)
+            os.replace(tmp, self.bloom_path)
+
+    def summary(self):
+        with self._lock:
+            (commits,) = self._db.execute("SELECT COUNT(*) FROM commits WHERE repo IS NOT NULL").fetchone()
+            (repos,) = self._db.execute("SELECT COUNT(DISTINCT repo) FROM commits").fetchone()
+        return (
+            f"Commit index {self.path}: {commits} commits from {repos} repos, "
+            f"Bloom filter {len(self.bloom.bits) / 1024 / 1024:.1f} MiB for up to {self.bloom.capacity} commits"
+        )
+
+    def _repo_id(self, url):
+        if url not in self._repo_ids:
+            self._db.execute("INSERT OR IGNORE INTO repos (url) VALUES (?)", (url,))
+            (self._repo_ids[url],) = self._db.execute("SELECT id FROM repos WHERE url = ?", (url,)).fetchone()
+        return self._repo_ids[url]
+
+    def claim(self, url, hashes):
+        # Records the hashes not seen before as url's, returns the url each hash was
+        # first extracted from for the ones another repo already has
+        keys = [bytes.fromhex(h) for h in hashes]
+        owners = {}
+        with self._lock:
+            # one writer at a time across processes, so nobody claims a hash in between
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                repo = self._repo_id(url)
+                self._catch_up()
+                maybe = [key for key in keys if key in self.bloom]
+                for start in range(0, len(maybe), 500):
+                    chunk = maybe[start : start + 500]
+                    placeholders = ",".join("?" * len(chunk))
+                    owners.update(
+                        self._db.execute(
+                            f"SELECT hash, repo FROM commits WHERE hash IN ({placeholders})", chunk
+                        ).fetchall()
+                    )
+                new = [key for key in keys if key not in owners]
+                self._db.executemany("INSERT INTO commits VALUES (?, ?)", [(key, repo) for key in new])
+                released = [key for key, owner in owners.items() if owner is None]
+                self._db.executemany("UPDATE commits SET repo = ? WHERE hash = ?", [(repo, key) for key in released])
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._catch_up()
+            # a repo's own hashes from an earlier extraction aren't duplicates
+            owners = {key: owner for key, owner in owners.items() if owner is not None and owner != repo}
+            if owners:
+                urls = dict(self._db.execute("SELECT id, url FROM repos").fetchall())
+        return {key.hex(): urls[owner] for key, owner in owners.items()}
+
+    def position(self):
+        # the last row so far, claims after it can be released with release()
+        with self._lock:
+            (row,) = self._db.execute("SELECT MAX(rowid) FROM commits").fetchone()
+        return row or 0
+
+    def release(self, url, position):
+        # gives up the hashes url claimed after position, e.g. when its extraction failed
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE commits SET repo = NULL WHERE repo = ? AND rowid > ?", (self._repo_id(url), position)
+            )
+        return cursor.rowcount
+
+
+def dedup_batches(batches, index, url, dropped):
+    # Drops the commits another repo already claimed from a stream of record batches.
+    # dropped counts them in place: commits, bytes (arrow size) and the repos they came from.
+    for batch in batches:
+        owners = index.claim(url, batch.column("hash").to_pylist())
+        if owners:
+            duplicate = pc.is_in(batch.column("hash"), value_set=pa.array(list(owners), batch.schema.field("hash").type))
+            dropped["commits"] += len(owners)
+            dropped["bytes"] += batch.filter(duplicate).nbytes
+            dropped["repos"].update(owners.values())
+            batch = batch.filter(pc.invert(duplicate))
+        # empty batches are still written, so a repo with nothing of its own gets a file to resume from
+        yield batch
+
+
+def new_dropped():
+    return dict(commits=0, bytes=0, repos=Counter())
+
+
+_indexes = {}
+
+
+def get_index(path):
+    index = _indexes.get(path)
+    if index is None:
+        index = _indexes[path] = CommitIndex(path)
+    return index
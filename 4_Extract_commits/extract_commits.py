@@ -1,194 +1,397 @@
 import argparse
-from git import Repo
-from datetime import datetime
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timezone
 import daft
+import os
+import socket
+import sys
 import tempfile
-from datetime import datetime
-
-
-def safe_encode(text):
-    if isinstance(text, str):
-        return text.encode("utf-8", "replace").decode("utf-8")
-    return text
-
-
-def parse_logs(logs):
-    commits = []
-    current_commit = None
-
-    lines = logs.split("\n")
-    i = 0
-
-    while i < len(lines):
-        line = lines[i]
-        # Start of a new commit
-        if line == "---COMMIT START---":
-            current_commit = {}
-            i += 1
-            continue
-
-        # End of current commit
-        elif line == "---COMMIT END---":
-            # Look ahead for file stats before next commit
-            file_stats = []
-            j = i + 1
-
-            while (
-                j < len(lines)
-                and lines[j] != "---COMMIT START---"
-                and lines[j] != "---COMMIT END---"
-            ):
-                parts = lines[j].strip().split("\t")
-                if len(parts) >= 3:
-                    file_stats.append(parts)
-                j += 1
-
-            # Process file stats for current commit
-            if current_commit:
-                lines_added = 0
-                lines_deleted = 0
-                lines_modified = 0
-                files_changed = []
-
-                for file_stat in file_stats:
-                    try:
-                        added = int(file_stat[0]) if file_stat[0] != "-" else 0
-                        deleted = int(file_stat[1]) if file_stat[1] != "-" else 0
-                        lines_added += added
-                        lines_deleted += deleted
-                        lines_modified += added + deleted
-                        files_changed.append(file_stat[2])
-                    except ValueError:
-                        continue
-
-                current_commit["lines_added"] = lines_added
-                current_commit["lines_deleted"] = lines_deleted
-                current_commit["lines_modified"] = lines_modified
-                current_commit["files_changed"] = files_changed
-
-                safe_encoded_commit = {
-                    k: safe_encode(v) for k, v in current_commit.items()
-                }
-                commits.append(safe_encoded_commit)
-
-            # Skip processed file stats
-            i = j
-            continue
-
-        # Parse commit details
-        elif current_commit is not None:
-            # Hash
-            if "hash" not in current_commit:
-                current_commit["hash"] = line.strip()
-            # Author name
-            elif "author_name" not in current_commit:
-                current_commit["author_name"] = line.strip()
-            # Author email
-            elif "author_email" not in current_commit:
-                current_commit["author_email"] = line.strip()
-            # Date
-            elif "date" not in current_commit:
-                try:
-                    dt = datetime.strptime(line.strip(), "%Y-%m-%d %H:%M:%S %z")
-                    current_commit["date"] = dt
-                except ValueError:
-                    # Handle potential date format issues
-                    current_commit["date"] = None
-            # Commit message
-            elif "message" not in current_commit:
-                message_lines = [line]
-                i += 1
-
-                while i < len(lines) and lines[i] != "---COMMIT END---":
-                    message_lines.append(lines[i])
-                    i += 1
-
-                # Join message lines, handling empty messages
-                if len(message_lines) > 1:
-                    message = message_lines[0] + "\n" + "\n".join(message_lines[1:])
-                else:
-                    message = message_lines[0]
-
-                current_commit["message"] = message
-
-                i -= 1  # Adjust index since we'll increment at the end of the loop
-
-        i += 1
-
-    return commits
+import time
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from git import GitCommandError
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_utils.commit_store import assign_repo_ids, read_commits, read_repos, write_repos
+from pipeline_utils.repo_mirrors import DEFAULT_MAX_BYTES, get_store, open_repo
+from pipeline_utils.scheduling import print_schedule_summary, schedule_repos
+from commit_index import dedup_batches, get_index, new_dropped
+from git_log_stream import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_SPLIT_COMMITS,
+    DEFAULT_SPLIT_RANGES,
+    LAYOUTS,
+    commit_batches,
+    commit_count,
+    delta_files,
+    git_log_chunks,
+    output_file,
+    parallel_commit_batches,
+    repo_columns,
+    revision_ranges,
+    write_batches,
+)
 
 
-@daft.udf(
-    return_dtype=daft.DataType.struct(
-        dict(
-            repo_name=daft.DataType.string(),
-            url=daft.DataType.string(),
-            repo_owner=daft.DataType.string(),
-            hash=daft.DataType.string(),
-            author_name=daft.DataType.string(),
-            author_email=daft.DataType.string(),
-            date=daft.DataType.timestamp(daft.TimeUnit.from_str("ms")),
-            message=daft.DataType.string(),
-            files_changed=daft.DataType.list(daft.DataType.string()),
-            lines_added=daft.DataType.uint64(),
-            lines_deleted=daft.DataType.uint64(),
-            lines_modified=daft.DataType.uint64(),
+STATE_SCHEMA = pa.schema(
+    [
+        ("url", pa.large_string()),
+        ("head", pa.large_string()),
+        ("extracted_at", pa.timestamp("ms", tz="UTC")),
+        ("window_since", pa.timestamp("ms")),
+        ("window_until", pa.timestamp("ms")),
+        ("layout", pa.large_string()),
+        ("seconds", pa.float64()),
+    ]
+)
+
+
+def repo_owner_and_name(repo):
+    remote_url = repo.remotes.origin.url
+
+    # Extract owner and repo name from remote URL
+    # Handle both HTTPS and SSH URLs
+    if remote_url.startswith("https://"):
+        parts = remote_url.split("/")
+        owner = parts[-2]
+        repo_name = parts[-1].replace(".git", "")
+    else:  # SSH format
+        parts = remote_url.split(":")[1].split("/")
+        owner = parts[0]
+        repo_name = parts[1].replace(".git", "")
+    return owner, repo_name
+
+
+def can_resume(repo, output_path, url, last_hash):
+    # incremental runs need the earlier extraction on disk and the old head still
+    # in the history, a force push that dropped it means rescanning everything
+    if not last_hash or not os.path.exists(output_file(output_path, url)):
+        return False
+    try:
+        return repo.is_ancestor(last_hash, "HEAD")
+    except GitCommandError:
+        # the old head isn't in the clone anymore
+        return False
+
+
+def window_date(value):
+    # --since/--until: an ISO date or datetime, UTC unless it has an offset, stored
+    # naive in UTC like the commit dates
+    date = datetime.fromisoformat(value)
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return date.replace(microsecond=0)
+
+
+def git_date(date):
+    return f"@{int(date.replace(tzinfo=timezone.utc).timestamp())}"
+
+
+def window_args(since=None, until=None):
+    args = []
+    if since is not None:
+        args.append(f"--since={git_date(since)}")
+    if until is not None:
+        args.append(f"--until={git_date(until)}")
+    return args
+
+
+@contextmanager
+def open_commit_repo(url, mirror_dir=None, mirror_max_bytes=DEFAULT_MAX_BYTES, since=None):
+    # With a window, throwaway clones only fetch history from `since` on, deepened by
+    # one commit so the oldest commit in the window still diffs against its parent
+    # (a shallow boundary commit would count its whole tree as added). Mirrors are
+    # shared with full runs and stay complete.
+    if since is None or mirror_dir:
+        with open_repo(url, mirror_dir, mirror_max_bytes, multi_options=["--no-checkout"]) as repo:
+            yield repo
+        return
+    with ExitStack() as stack:
+        try:
+            repo = stack.enter_context(
+                open_repo(url, multi_options=["--no-checkout", f"--shallow-since={git_date(since)}"])
+            )
+            repo.git.fetch("--deepen=1", "origin")
+        except GitCommandError as e:
+            if "no commits selected" not in str(e):
+                raise
+            # nothing was committed in the window, the head is all that's needed
+            repo = stack.enter_context(open_repo(url, multi_options=["--no-checkout", "--depth=1"]))
+        yield repo
+
+
+def repo_batches(url, repo, revs, repo_values, batch_size, split_commits, split_ranges, layout):
+    # record batches for `git log *revs`, read as several ranges at once for big histories
+    if split_ranges > 1 and split_commits:
+        count = commit_count(repo, *revs)
+        if count > split_commits:
+            ranges = revision_ranges(repo, revs, split_ranges)
+            print(f"[{url}] Streaming {count} commits as {len(ranges)} ranges in parallel...")
+            return parallel_commit_batches(repo, ranges, repo_values, batch_size, layout), len(ranges)
+    print(f"[{url}] Streaming logs...")
+    return commit_batches(git_log_chunks(repo, *revs), repo_values, batch_size, layout), 1
+
+
+def write_deduped(batches, path, index_path, url, dropped):
+    # write_batches, dropping the commits another repo already claimed. If the repo
+    # fails partway, the commits it claimed on the way are released, otherwise forks
+    # extracted later would drop them and they'd be in no output file.
+    if index_path is None:
+        return write_batches(batches, path)
+    index = get_index(index_path)
+    position = index.position()
+    try:
+        return write_batches(dedup_batches(batches, index, url, dropped), path)
+    except BaseException:
+        released = index.release(url, position)
+        print(f"[{url}] Released {released} commits claimed before the extraction failed")
+        raise
+
+
+def duplicate_stats(dropped):
+    # the repo most of the dropped commits belong to is the one this is a fork or mirror of
+    canonical = dropped["repos"].most_common(1)
+    return dict(
+        duplicates=dropped["commits"], duplicate_bytes=dropped["bytes"], canonical=canonical[0][0] if canonical else None
+    )
+
+
+def write_repo_commits(
+    url,
+    repo,
+    output_path,
+    batch_size=DEFAULT_BATCH_SIZE,
+    last_hash=None,
+    split_commits=DEFAULT_SPLIT_COMMITS,
+    split_ranges=DEFAULT_SPLIT_RANGES,
+    since=None,
+    until=None,
+    layout="wide",
+    repo_id=None,
+    index_path=None,
+):
+    # streams the repo's history, or the part of it in the window, into output_path,
+    # returns a dict of stats. With an index_path, commits another repo was extracted
+    # with first are dropped.
+    owner, repo_name = repo_owner_and_name(repo)
+    repo_values = repo_columns(repo_name, owner, url, since, until, repo_id)
+    window = window_args(since, until)
+    head = repo.head.commit.hexsha
+    stats = dict(repo_name=repo_name, repo_owner=owner, head=head)
+    dropped = new_dropped()
+    if can_resume(repo, output_path, url, last_hash):
+        if head == last_hash:
+            print(f"[{url}] No new commits since {head[:12]}")
+            return dict(stats, commits=0, batches=0, ranges=0, mode="unchanged")
+        print(f"[{url}] New commits {last_hash[:12]}..{head[:12]}")
+        batches, ranges = repo_batches(
+            url, repo, [head, f"^{last_hash}", *window], repo_values, batch_size, split_commits, split_ranges, layout
         )
-    ),
-    batch_size=1,       
+        path = output_file(output_path, url, head[:12])
+        commits, count = write_deduped(batches, path, index_path, url, dropped)
+        return dict(stats, commits=commits, batches=count, ranges=ranges, mode="incremental", **duplicate_stats(dropped))
+
+    if last_hash:
+        print(f"[{url}] History changed since {last_hash[:12]}, rescanning")
+    batches, ranges = repo_batches(
+        url, repo, [head, *window], repo_values, batch_size, split_commits, split_ranges, layout
+    )
+    commits, count = write_deduped(batches, output_file(output_path, url), index_path, url, dropped)
+    # the full file now covers whatever earlier incremental runs added
+    for path in delta_files(output_path, url):
+        os.remove(path)
+    return dict(stats, commits=commits, batches=count, ranges=ranges, mode="full", **duplicate_stats(dropped))
+
+
+extract_stats_dtype = daft.DataType.struct(
+    dict(
+        url=daft.DataType.string(),
+        repo_id=daft.DataType.int32(),
+        repo_name=daft.DataType.string(),
+        repo_owner=daft.DataType.string(),
+        head=daft.DataType.string(),
+        mode=daft.DataType.string(),
+        commits=daft.DataType.int64(),
+        batches=daft.DataType.int64(),
+        ranges=daft.DataType.int64(),
+        duplicates=daft.DataType.int64(),
+        duplicate_bytes=daft.DataType.int64(),
+        canonical=daft.DataType.string(),
+        seconds=daft.DataType.float64(),
+        worker=daft.DataType.string(),
+        started=daft.DataType.float64(),
+        error=daft.DataType.string(),
+    )
 )
-def extract_commits_to_dataframe(remote_urls):
-    commits_list = []
-    for url in remote_urls:
-        with tempfile.TemporaryDirectory() as temp_dir:
-            try:
-                print(f"[{url}] Cloning repo...")
-                repo = Repo.clone_from(
-                    url, to_path=temp_dir, multi_options=["--no-checkout"]
-                )
-                remote_url = repo.remotes.origin.url
-            except Exception as e:
-                continue
-
-            try:
-                # Extract owner and repo name from remote URL
-                # Handle both HTTPS and SSH URLs
-                if remote_url.startswith("https://"):
-                    parts = remote_url.split("/")
-                    owner = parts[-2]
-                    repo_name = parts[-1].replace(".git", "")
-                else:  # SSH format
-                    parts = remote_url.split(":")[1].split("/")
-                    owner = parts[0]
-                    repo_name = parts[1].replace(".git", "")
-            except Exception as e:
-                continue
-
-            try:
-                logs = repo.git.log(
-                    "--pretty=format:---COMMIT START---%n%H%n%an%n%ae%n%ai%n%B%n---COMMIT END---",
-                    "--date=iso",
-                    "--numstat",
+
+
+@daft.udf(
+    return_dtype=extract_stats_dtype,
+    batch_size=1,
+)
+def extract_commits_to_parquet(
+    remote_urls,
+    last_hashes,
+    repo_ids,
+    output_path,
+    batch_size=DEFAULT_BATCH_SIZE,
+    mirror_dir=None,
+    mirror_max_bytes=DEFAULT_MAX_BYTES,
+    split_commits=DEFAULT_SPLIT_COMMITS,
+    split_ranges=DEFAULT_SPLIT_RANGES,
+    since=None,
+    until=None,
+    layout="wide",
+    index_path=None,
+):
+    # commits go straight to output_path, one file per repo, the UDF only returns stats
+    results = []
+    for url, last_hash, repo_id in zip(remote_urls.to_pylist(), last_hashes.to_pylist(), repo_ids.to_pylist()):
+        start = time.time()
+        stats = dict(
+            url=url, repo_id=repo_id, repo_name=None, repo_owner=None, head=None, mode=None,
+            commits=0, batches=0, ranges=0, duplicates=0, duplicate_bytes=0, canonical=None,
+            worker=f"{socket.gethostname()}:{os.getpid()}", started=start, error=None,
+        )
+        try:
+            print(f"[{url}] Cloning repo...")
+            with open_commit_repo(url, mirror_dir, mirror_max_bytes, since) as repo:
+                stats.update(
+                    write_repo_commits(
+                        url, repo, output_path, batch_size, last_hash, split_commits, split_ranges, since, until,
+                        layout, repo_id, index_path,
+                    )
                 )
-                print(f"[{url}] Parsing logs...")
-                parsed_logs = parse_logs(logs)
-                for log in parsed_logs:
-                    log["repo_name"] = repo_name
-                    log["repo_owner"] = owner
-                    log["url"] = url
-                commits_list.extend(parsed_logs)
-            except Exception as e:
-                continue
-
-    return commits_list
-
-repo_blacklist = [
-    "chromium",
-    "cdnjs",
-    "leetcode",
-    "aws-sdk-java",
-    "languagetool",
-]
+        except Exception as e:
+            print(f"[{url}] Error extracting commits: {e}")
+            stats["error"] = str(e)
+        stats["seconds"] = time.time() - start
+        results.append(stats)
+
+    return results
+
+
+def print_extract_summary(stats):
+    commits = stats["commits"]
+    errors = [e for e in stats["error"] if e]
+    modes = {mode: stats["mode"].count(mode) for mode in ["full", "incremental", "unchanged"]}
+    print(
+        f"Extracted {sum(commits)} commits from {len(commits) - len(errors)} repos "
+        f"({len(errors)} failed), largest repo {max(commits, default=0)} commits, "
+        f"{sum(stats['batches'])} record batches, {sum(stats['seconds']):.1f}s in extraction"
+    )
+    print(
+        f"{modes['full']} full extractions, {modes['incremental']} incremental, {modes['unchanged']} unchanged, "
+        f"{sum(1 for ranges in stats['ranges'] if ranges > 1)} split into parallel ranges"
+    )
+    duplicates = stats["duplicates"]
+    if sum(duplicates):
+        print(
+            f"Dropped {sum(duplicates)} commits ({sum(stats['duplicate_bytes']) / 1e6:.1f} MB) already extracted "
+            f"from another repo, in {sum(1 for d in duplicates if d)} forks or mirrors"
+        )
+    print_schedule_summary(stats["worker"], stats["started"], stats["seconds"])
+
+
+def state_file(output_path):
+    return f"{output_path.rstrip('/')}_state.parquet"
+
+
+def index_file(output_path):
+    return f"{output_path.rstrip('/')}_commit_index.sqlite"
+
+
+def unique_repos(df):
+    # one row per url: stage 1 lists a repo once for every keyword that found it, and
+    # two copies of a repo would write the same output files at the same time
+    others = [name for name in df.column_names if name != "url"]
+    return df.groupby("url").agg(*[daft.col(name).any_value() for name in others]).select(*df.column_names)
+
+
+def with_last_hashes(df, state_path, since=None, until=None, layout="wide"):
+    # adds the head each repo was extracted at last time, null for repos not seen yet
+    # or extracted with a different window or layout, which get a full extraction
+    rows = []
+    if state_path and os.path.exists(state_path):
+        rows = [
+            dict(url=row["url"], last_hash=row["head"])
+            for row in pq.read_table(state_path).to_pylist()
+            if (row.get("window_since"), row.get("window_until"), row.get("layout")) == (since, until, layout)
+        ]
+    if rows:
+        state = daft.from_pylist(rows)
+        return df.join(state, on="url", how="left").select(*df.column_names, "last_hash")
+    return df.with_column("last_hash", daft.lit(None).cast(daft.DataType.string()))
+
+
+def previous_seconds(state_path, since=None, until=None):
+    # url -> seconds each repo took in the previous run with the same window, the
+    # scheduler's cost for it
+    if not state_path or not os.path.exists(state_path):
+        return {}
+    return {
+        row["url"]: row.get("seconds")
+        for row in pq.read_table(state_path).to_pylist()
+        if (row.get("window_since"), row.get("window_until")) == (since, until)
+    }
+
+
+def with_repo_ids(df, output_path, layout="wide"):
+    # the normalized layout's repo_id for each repo, null in the wide layout
+    if layout != "normalized":
+        return df.with_column("repo_id", daft.lit(None).cast(daft.DataType.int32()))
+    ids = assign_repo_ids(output_path, df.select("url").to_pydict()["url"])
+    ids = daft.from_pydict(dict(url=list(ids), repo_id=list(ids.values()))).with_column(
+        "repo_id", daft.col("repo_id").cast(daft.DataType.int32())
+    )
+    return df.join(ids, on="url", how="left").select(*df.column_names, "repo_id")
+
+
+def write_repo_table(output_path, stats, since=None, until=None):
+    # a row for every repo_id with commits on disk, otherwise read_commits can't resolve
+    # them. Urls repo_owner_and_name can't parse get a null name and owner, repos that
+    # failed this run keep their old row, or get one if commits of earlier runs have none.
+    known = {row["repo_id"] for row in read_repos(output_path)}
+    rows = [
+        dict(
+            repo_id=repo_id, repo_name=name or None, url=url, repo_owner=owner or None,
+            window_since=since, window_until=until,
+        )
+        for url, repo_id, name, owner, error in zip(
+            stats["url"], stats["repo_id"], stats["repo_name"], stats["repo_owner"], stats["error"]
+        )
+        if not error
+        or (repo_id not in known and (os.path.exists(output_file(output_path, url)) or delta_files(output_path, url)))
+    ]
+    write_repos(output_path, rows)
+
+
+def save_index(index_path):
+    # saves the Bloom filter with this run's hashes, so the next run doesn't rebuild it
+    index = get_index(index_path)
+    index.save()
+    return index.summary()
+
+
+def write_state(state_path, stats, since=None, until=None, layout="wide"):
+    # (url, head, extracted_at, window, layout, seconds) per repo, repos that failed this run keep their old row
+    rows = {}
+    if os.path.exists(state_path):
+        rows = {row["url"]: row for row in pq.read_table(state_path).to_pylist()}
+    extracted_at = datetime.now(timezone.utc)
+    for url, head, seconds, error in zip(stats["url"], stats["head"], stats["seconds"], stats["error"]):
+        if head and not error:
+            rows[url] = dict(
+                url=url, head=head, extracted_at=extracted_at, window_since=since, window_until=until, layout=layout,
+                seconds=seconds,
+            )
+    table = pa.Table.from_pylist(list(rows.values()), schema=STATE_SCHEMA)
+    tmp = f"{state_path}.tmp"
+    pq.write_table(table, tmp)
+    os.replace(tmp, state_path)
+    print(f"Wrote extraction state for {len(rows)} repos to {state_path}")
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -197,6 +400,19 @@ if __name__ == "__main__":
     parser.add_argument("--partition-size", type=int, default=1024)
     parser.add_argument("--write-to-file", action="store_true")
     parser.add_argument("--output-path", type=str, default="raw_commits")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Commits per record batch, bounds memory per repo")
+    parser.add_argument("--split-commits", type=int, default=DEFAULT_SPLIT_COMMITS, help="Read histories with more commits than this as parallel ranges, 0 disables it")
+    parser.add_argument("--split-ranges", type=int, default=DEFAULT_SPLIT_RANGES, help="Number of ranges, and git log processes, per split history")
+    parser.add_argument("--since", type=window_date, default=None, help="Only extract commits from this ISO date on, with a shallow clone")
+    parser.add_argument("--until", type=window_date, default=None, help="Only extract commits up to this ISO date")
+    parser.add_argument("--layout", type=str, default="wide", choices=list(LAYOUTS), help="normalized moves repo columns to <output-path>_repos.parquet")
+    parser.add_argument("--state-path", type=str, default=None, help="Head extracted per repo, defaults to <output-path>_state.parquet")
+    parser.add_argument("--full-rescan", action="store_true", help="Ignore the state and extract every repo's full history")
+    parser.add_argument("--dedup", action="store_true", help="Skip commits already extracted from another repo, e.g. forks")
+    parser.add_argument("--index-path", type=str, default=None, help="Commit hash index for --dedup, defaults to <output-path>_commit_index.sqlite")
+    # Reuse bare mirrors shared with 2_Extract_readmes instead of cloning from scratch
+    parser.add_argument("--mirror-dir", type=str, default=None)
+    parser.add_argument("--mirror-max-gb", type=float, default=50)
     args = parser.parse_args()
 
     if args.runner == "native":
@@ -207,24 +423,57 @@ if __name__ == "__main__":
         raise ValueError(f"Invalid runner: {args.runner}")
 
     print(f"Extracing commits from repo files in {args.input_path}, runner: {args.runner}, write-to-file: {args.write_to_file}")
-
-    df = (
-        daft.read_parquet(args.input_path)
-        .where(
-            ~daft.col("name").is_in(repo_blacklist)
-        )
-        .into_partitions(args.partition_size)
+    if args.since or args.until:
+        print(f"Commit window: {args.since or 'start'} to {args.until or 'now'}")
+
+    df = unique_repos(daft.read_parquet(args.input_path))
+    # only runs that write to file keep state, so only they can resume from it
+    state_path = (args.state_path or state_file(args.output_path)) if args.write_to_file else None
+    df = with_last_hashes(df, None if args.full_rescan else state_path, args.since, args.until, args.layout)
+
+    start = time.time()
+    mirror_max_bytes = int(args.mirror_max_gb * 1024**3)
+    output_path = args.output_path if args.write_to_file else tempfile.mkdtemp()
+    os.makedirs(output_path, exist_ok=True)
+    df = with_repo_ids(df, output_path, args.layout)
+    # the native runner ignores partitions and runs rows in order, so it gets one, largest repo first
+    df = schedule_repos(
+        df, args.partition_size if args.runner == "ray" else 1, previous_seconds(state_path, args.since, args.until)
+    )
+    index_path = (args.index_path or index_file(output_path)) if args.dedup else None
+    extractor = extract_commits_to_parquet.with_concurrency(10)
+
+    stats = df.select(
+        extractor(
+            df["url"],
+            df["last_hash"],
+            df["repo_id"],
+            output_path,
+            args.batch_size,
+            args.mirror_dir,
+            mirror_max_bytes,
+            args.split_commits,
+            args.split_ranges,
+            args.since,
+            args.until,
+            args.layout,
+            index_path,
+        ).alias("extract")
     )
+    stats = stats.select(daft.col("extract").struct.get("*")).to_pydict()
+    print_extract_summary(stats)
 
-    extractor = extract_commits_to_dataframe.with_concurrency(10)
+    if args.layout == "normalized":
+        write_repo_table(output_path, stats, args.since, args.until)
 
-    df = df.select(extractor(df["url"]).alias("commit"))
-    df = df.select(daft.col("commit").struct.get("*"))
+    if index_path:
+        print(save_index(index_path))
 
     if args.write_to_file:
-        path = args.output_path
-        files = df.write_parquet(path)
-        print(f"Wrote files to {path}")
-        print(files)
-    else:
-        df.show()
+        write_state(state_path, stats, args.since, args.until, args.layout)
+        print(f"Wrote files to {output_path}")
+    elif sum(stats["commits"]):
+        read_commits(output_path).show()
+
+    if args.mirror_dir:
+        print(get_store(args.mirror_dir).summary(since=start))
@@ -0,0 +1,142 @@
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Single pass parser for `git log -z --numstat` output. Every header field is NUL
+# terminated, so commit messages can contain anything, including the old sentinel
+# lines. The parser works on raw bytes and keeps one list per column rather than a
+# dict per commit; text is decoded once per column when a batch is built.
+#
+# Layout of one commit in the output:
+#
+#   <hash>\0<name>\0<email>\0<epoch>\0<message>\0
+#   \n<added>\t<deleted>\t<path>\0...        one entry per file, if any
+#   <added>\t<deleted>\t\0<old path>\0<new path>\0   for renames and copies
+#
+# Header fields are read by position. After the message, a token without a tab can
+# only be the next commit's hash, numstat entries always contain one.
+
+LOG_FORMAT_Z = "--format=%H%x00%an%x00%ae%x00%at%x00%B"
+LOG_ARGS_Z = [LOG_FORMAT_Z, "-z", "--numstat"]
+
+HASH, AUTHOR_NAME, AUTHOR_EMAIL, DATE, MESSAGE, STATS = range(6)
+HEADER_COLUMNS = ["hash", "author_name", "author_email", "date", "message"]
+
+
+def new_columns():
+    return dict(
+        hash=[], author_name=[], author_email=[], date=[], message=[],
+        lines_added=[], lines_deleted=[], files_changed=[], file_offsets=[0],
+    )
+
+
+class LogParser:
+    # Feed it chunks of any size, feed() and finish() return the column batches that
+    # are complete. A batch holds batch_size commits, the last one may hold fewer.
+    def __init__(self, batch_size=10_000):
+        self.batch_size = batch_size
+        self.columns = new_columns()
+        self.tail = b""
+        self.state = HASH
+        self.rename = 0
+
+    def feed(self, chunk):
+        tokens = (self.tail + chunk).split(b"\0")
+        self.tail = tokens.pop()
+        return self._parse(tokens)
+
+    def finish(self):
+        tokens = [self.tail] if self.tail or self.state == MESSAGE else []
+        self.tail = b""
+        batches = self._parse(tokens)
+        if self.columns["hash"]:
+            self._end_commit()
+            batches.append(self._flush())
+        return batches
+
+    def _parse(self, tokens):
+        batches = []
+        columns = self.columns
+        header = [columns[name] for name in HEADER_COLUMNS]
+        files = columns["files_changed"]
+        added_column, deleted_column = columns["lines_added"], columns["lines_deleted"]
+        state = self.state
+        for token in tokens:
+            if state == STATS:
+                if self.rename:
+                    # old path then new path, the file is counted under its new path
+                    self.rename -= 1
+                    if not self.rename:
+                        files.append(token)
+                    continue
+                if b"\t" not in token:
+                    self._end_commit()
+                    if len(columns["hash"]) >= self.batch_size:
+                        batches.append(self._flush())
+                        columns = self.columns
+                        header = [columns[name] for name in HEADER_COLUMNS]
+                        files = columns["files_changed"]
+                        added_column, deleted_column = columns["lines_added"], columns["lines_deleted"]
+                    state = HASH
+                else:
+                    if token[:1] == b"\n":
+                        token = token[1:]
+                    added, deleted, path = token.split(b"\t", 2)
+                    # binary files show "-" for both counts
+                    if added != b"-":
+                        added_column[-1] += int(added)
+                    if deleted != b"-":
+                        deleted_column[-1] += int(deleted)
+                    if path:
+                        files.append(path)
+                    else:
+                        self.rename = 2
+                    continue
+            header[state].append(token)
+            if state == MESSAGE:
+                added_column.append(0)
+                deleted_column.append(0)
+            state += 1
+        self.state = state
+        return batches
+
+    def _end_commit(self):
+        self.columns["file_offsets"].append(len(self.columns["files_changed"]))
+
+    def _flush(self):
+        columns, self.columns = self.columns, new_columns()
+        return columns
+
+
+def parse_log_z(chunks, batch_size=10_000):
+    # column batches for a whole `git log` output given as an iterable of byte chunks
+    parser = LogParser(batch_size)
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    yield from parser.finish()
+
+
+def decode_column(values, encoding="utf-8"):
+    # one decode call per column instead of one per field, NUL can't occur in the values
+    if not values:
+        return []
+    return b"\0".join(values).decode(encoding, "replace").split("\0")
+
+
+def columns_to_arrays(columns):
+    # dict of arrow arrays in the raw_commits layout, without the repo columns
+    added = pa.array(columns["lines_added"], pa.uint64())
+    deleted = pa.array(columns["lines_deleted"], pa.uint64())
+    return dict(
+        hash=pa.array(decode_column(columns["hash"], "ascii"), pa.large_string()),
+        author_name=pa.array(decode_column(columns["author_name"]), pa.large_string()),
+        author_email=pa.array(decode_column(columns["author_email"]), pa.large_string()),
+        date=pa.array([int(value) for value in columns["date"]], pa.timestamp("s")).cast(pa.timestamp("ms")),
+        message=pa.array(decode_column(columns["message"]), pa.large_string()),
+        files_changed=pa.LargeListArray.from_arrays(
+            pa.array(columns["file_offsets"], pa.int64()),
+            pa.array(decode_column(columns["files_changed"]), pa.large_string()),
+        ),
+        lines_added=added,
+        lines_deleted=deleted,
+        lines_modified=pc.add(added, deleted),
+    )
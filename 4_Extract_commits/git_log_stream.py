@@ -0,0 +1,216 @@
+import glob
+import hashlib
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from git_log_parser import LOG_ARGS_Z, columns_to_arrays, parse_log_z
+
+# Streaming commit extraction. `git log` stdout is read in chunks, parsed by
+# git_log_parser and written to parquet in fixed-size record batches, so memory
+# stays bounded by the batch size however long the repo's history is. Each repo
+# gets its own file in the output directory, named after its url, plus one delta
+# file per incremental run that found new commits.
+
+DEFAULT_BATCH_SIZE = 10_000
+# histories with more commits than this are read as several ranges in parallel
+DEFAULT_SPLIT_COMMITS = 50_000
+DEFAULT_SPLIT_RANGES = 4
+READ_SIZE = 1 << 16
+
+COMMIT_SCHEMA = pa.schema(
+    [
+        ("repo_name", pa.large_string()),
+        ("url", pa.large_string()),
+        ("repo_owner", pa.large_string()),
+        ("hash", pa.large_string()),
+        ("author_name", pa.large_string()),
+        ("author_email", pa.large_string()),
+        ("date", pa.timestamp("ms")),
+        ("message", pa.large_string()),
+        ("files_changed", pa.large_list(pa.large_string())),
+        ("lines_added", pa.uint64()),
+        ("lines_deleted", pa.uint64()),
+        ("lines_modified", pa.uint64()),
+        # the extraction's time window, null when the history wasn't limited on that side
+        ("window_since", pa.timestamp("ms")),
+        ("window_until", pa.timestamp("ms")),
+    ]
+)
+
+# Normalized layout: the per-repo columns move to a repo dimension table referenced
+# by repo_id, author names and emails are dictionary encoded and file paths are
+# interned per record batch, see pipeline_utils/commit_store.py for reading it back
+NORMALIZED_COMMIT_SCHEMA = pa.schema(
+    [
+        ("repo_id", pa.int32()),
+        ("hash", pa.large_string()),
+        ("author_name", pa.dictionary(pa.int32(), pa.large_string())),
+        ("author_email", pa.dictionary(pa.int32(), pa.large_string())),
+        ("date", pa.timestamp("ms")),
+        ("message", pa.large_string()),
+        ("files_changed", pa.large_list(pa.dictionary(pa.int32(), pa.large_string()))),
+        ("lines_added", pa.uint64()),
+        ("lines_deleted", pa.uint64()),
+        ("lines_modified", pa.uint64()),
+    ]
+)
+LAYOUTS = {"wide": COMMIT_SCHEMA, "normalized": NORMALIZED_COMMIT_SCHEMA}
+
+
+def git_log_chunks(repo, *args):
+    # raw `git log -z --numstat` stdout, read incrementally from the subprocess
+    process = repo.git.log(*LOG_ARGS_Z, *args, as_process=True)
+    try:
+        while chunk := process.stdout.read(READ_SIZE):
+            yield chunk
+    except GeneratorExit:
+        # the reader stopped early, git would only die of SIGPIPE on its next write
+        process.proc.kill()
+        process.proc.wait()
+        raise
+    finally:
+        process.stdout.close()
+    # raises if git failed, e.g. on a bad revision
+    process.wait()
+
+
+def repo_columns(repo_name, repo_owner, url, since=None, until=None, repo_id=None):
+    return dict(
+        repo_id=repo_id, repo_name=repo_name, repo_owner=repo_owner, url=url, window_since=since, window_until=until
+    )
+
+
+def conform(array, type):
+    # the parser's plain arrays in the layout's types
+    if pa.types.is_dictionary(type):
+        return array.dictionary_encode()
+    if pa.types.is_large_list(type) and pa.types.is_dictionary(type.value_type):
+        return pa.LargeListArray.from_arrays(array.offsets, array.values.dictionary_encode())
+    return array
+
+
+def commit_batches(chunks, repo_values, batch_size=DEFAULT_BATCH_SIZE, layout="wide"):
+    # repo_values: from repo_columns(), fills the layout's columns the parser doesn't produce
+    schema = LAYOUTS[layout]
+    for columns in parse_log_z(chunks, batch_size):
+        arrays = columns_to_arrays(columns)
+        n = len(arrays["hash"])
+        yield pa.RecordBatch.from_arrays(
+            [
+                conform(arrays[field.name], field.type)
+                if field.name in arrays
+                else pa.array([repo_values[field.name]] * n, field.type)
+                for field in schema
+            ],
+            schema=schema,
+        )
+
+
+def commit_count(repo, *revs):
+    return int(repo.git.rev_list("--count", *revs))
+
+
+def revision_ranges(repo, revs, parts):
+    # Cuts `git log *revs` into disjoint revision ranges along the first-parent chain.
+    # With cut points c1..ck (newest first) the ranges are HEAD ^c1, c1 ^c2, ..., ck,
+    # each keeping the rest of revs (exclusions, date limits): every commit reachable
+    # from HEAD is in exactly one of them. Ranges are even in first-parent commits, merged-in
+    # branches land in the range of the merge that brought them in.
+    head, excludes = revs[0], list(revs[1:])
+    first_parent = int(repo.git.rev_list("--count", "--first-parent", *revs))
+    cuts = []
+    for i in range(1, min(parts, first_parent)):
+        cut = repo.git.rev_list("--first-parent", f"--skip={first_parent * i // parts}", "--max-count=1", *revs)
+        if cut:
+            cuts.append(cut)
+    tips = [head] + cuts
+    return [
+        [tip, *([f"^{tips[i + 1]}"] if i + 1 < len(tips) else []), *excludes]
+        for i, tip in enumerate(tips)
+    ]
+
+
+def parallel_commit_batches(repo, ranges, repo_values, batch_size=DEFAULT_BATCH_SIZE, layout="wide"):
+    # One `git log` per range, each read on its own thread, so the diffing git does
+    # for --numstat runs on several cores. Batches come out in whatever order they
+    # are ready, the queue bounds how many are held in memory.
+    batches = queue.Queue(maxsize=2 * len(ranges))
+    stop = threading.Event()
+
+    def read_range(revs):
+        try:
+            for batch in commit_batches(git_log_chunks(repo, *revs), repo_values, batch_size, layout):
+                while not stop.is_set():
+                    try:
+                        batches.put(batch, timeout=1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+        finally:
+            batches.put(None)
+
+    with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+        futures = [executor.submit(read_range, revs) for revs in ranges]
+        try:
+            running = len(ranges)
+            while running:
+                batch = batches.get()
+                if batch is None:
+                    running -= 1
+                else:
+                    yield batch
+        finally:
+            stop.set()
+            # let blocked readers see the stop flag
+            while not all(future.done() for future in futures):
+                try:
+                    batches.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+        for future in futures:
+            future.result()
+
+
+def url_key(url):
+    return hashlib.sha256(url.encode()).hexdigest()[:16]
+
+
+def output_file(output_path, url, delta=None):
+    # a full extraction is <key>.parquet, commits added by later incremental runs go
+    # into <key>-<delta>.parquet next to it
+    name = url_key(url) if delta is None else f"{url_key(url)}-{delta}"
+    return os.path.join(output_path, f"{name}.parquet")
+
+
+def delta_files(output_path, url):
+    return glob.glob(os.path.join(output_path, f"{url_key(url)}-*.parquet"))
+
+
+def write_batches(batches, path):
+    # returns (rows, batches) written, the file only appears once it's complete
+    tmp = f"{path}.tmp"
+    writer = None
+    rows = count = 0
+    try:
+        for batch in batches:
+            if writer is None:
+                writer = pq.ParquetWriter(tmp, batch.schema)
+            writer.write_batch(batch)
+            rows += batch.num_rows
+            count += 1
+    except BaseException:
+        if writer is not None:
+            writer.close()
+            os.remove(tmp)
+        raise
+    if writer is not None:
+        writer.close()
+        os.replace(tmp, path)
+    return rows, count
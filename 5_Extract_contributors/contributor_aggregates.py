@@ -0,0 +1,286 @@
+import heapq
+import json
+import os
+from collections import Counter
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Per-contributor aggregates of raw_commits with bounded message and file columns.
+# Stage 6 only puts a contributor's first 500 lines / 10,000 words of messages and 100
+# files into its prompt, so rather than concatenating everything, stage 5 keeps the
+# most recent messages up to those limits and the files changed most often. The state
+# kept per contributor is proportional to the caps, not to the length of their history.
+# That state is written out with the aggregates (the counted files, the date and length
+# of each kept message), so a later run can merge new commits into a contributor
+# without reading their old ones again. A merge gives the same aggregates as reading
+# everything again, as long as a contributor's distinct files fit in the sketch.
+
+MAX_MESSAGE_LINES = 500
+MAX_MESSAGE_WORDS = 10_000
+MAX_FILES = 100
+# distinct files counted per contributor before the rarest are pruned, the top files
+# stay exact unless the counts are spread thinly over a very long tail
+FILE_SKETCH_SIZE = 1_000
+READ_BATCH_SIZE = 10_000
+
+KEY_COLUMNS = ["repo_id", "repo_owner", "repo_name", "author_email"]
+WINDOW_COLUMNS = ["window_since", "window_until"]
+COMMIT_COLUMNS = ["author_name", "date", "message", "files_changed", "lines_added", "lines_deleted", "lines_modified"]
+CONTRIBUTOR_KEYS = ["repo_owner", "repo_name", "author_email"]
+
+CONTRIBUTOR_SCHEMA = pa.schema(
+    [
+        ("repo_owner", pa.large_string()),
+        ("repo_name", pa.large_string()),
+        ("author_email", pa.large_string()),
+        ("author_name", pa.large_string()),
+        ("commit_count", pa.uint64()),
+        ("lines_added", pa.uint64()),
+        ("lines_deleted", pa.uint64()),
+        ("lines_modified", pa.uint64()),
+        ("files_changed", pa.large_list(pa.large_string())),
+        ("message", pa.large_string()),
+        ("first_commit", pa.timestamp("ms")),
+        ("last_commit", pa.timestamp("ms")),
+        ("window_since", pa.timestamp("ms")),
+        ("window_until", pa.timestamp("ms")),
+        # the sketches later runs merge into
+        ("file_sketch", pa.large_list(pa.large_string())),
+        ("file_counts", pa.large_list(pa.uint64())),
+        ("message_dates", pa.large_list(pa.timestamp("ms"))),
+        ("message_lengths", pa.large_list(pa.int64())),
+    ]
+)
+# what a contributor's row in stage 6 is made of, a change to any of them means a new analysis
+COMPARED_COLUMNS = [
+    "author_name", "commit_count", "lines_added", "lines_deleted", "lines_modified", "files_changed", "message",
+    "first_commit", "last_commit", "window_since", "window_until",
+]
+DATE_COLUMNS = ["first_commit", "last_commit", "message_dates"]
+# parquet metadata key of the commit files and caps an output file was aggregated from
+SOURCES_KEY = b"aggregated_from"
+
+
+class Caps:
+    def __init__(self, max_lines=MAX_MESSAGE_LINES, max_words=MAX_MESSAGE_WORDS, max_files=MAX_FILES):
+        self.max_lines = max_lines
+        self.max_words = max_words
+        self.max_files = max_files
+        self.file_sketch_size = max(FILE_SKETCH_SIZE, 10 * max_files)
+
+
+class Contributor:
+    __slots__ = [
+        "author_name", "commit_count", "lines_added", "lines_deleted", "lines_modified", "first_commit",
+        "last_commit", "messages", "message_lines", "message_words", "files", "window",
+    ]
+
+    def __init__(self, window):
+        self.author_name = None
+        self.commit_count = self.lines_added = self.lines_deleted = self.lines_modified = 0
+        self.first_commit = self.last_commit = None
+        # min-heap of (date, -order, message, lines, words), the oldest message on top
+        self.messages = []
+        self.message_lines = self.message_words = 0
+        self.files = Counter()
+        self.window = window
+
+    @classmethod
+    def from_row(cls, row, caps):
+        # a contributor as an earlier run wrote them, to add newer commits to
+        contributor = cls({name: row[name] for name in WINDOW_COLUMNS})
+        for name in ["author_name", "commit_count", "lines_added", "lines_deleted", "lines_modified", "first_commit", "last_commit"]:
+            setattr(contributor, name, row[name])
+        contributor.files = Counter(dict(zip(row["file_sketch"], row["file_counts"])))
+        start = 0
+        # newest first, the order they were read in
+        for order, (date, length) in enumerate(zip(row["message_dates"], row["message_lengths"])):
+            contributor.add_message(order, date, row["message"][start : start + length], caps)
+            start += length
+        return contributor
+
+    def add(self, order, name, date, message, files, added, deleted, modified, caps):
+        self.commit_count += 1
+        self.lines_added += added or 0
+        self.lines_deleted += deleted or 0
+        self.lines_modified += modified or 0
+        if date is not None:
+            if self.last_commit is None or date >= self.last_commit:
+                # the name on the latest commit
+                self.author_name = name
+                self.last_commit = date
+            if self.first_commit is None or date < self.first_commit:
+                self.first_commit = date
+        elif self.author_name is None:
+            self.author_name = name
+        if message:
+            self.add_message(order, date, message, caps)
+        if files:
+            self.files.update(files)
+            if len(self.files) > 2 * caps.file_sketch_size:
+                self.files = Counter(dict(self.files.most_common(caps.file_sketch_size)))
+
+    def add_message(self, order, date, message, caps):
+        # messages are joined as they are, so a message's lines are its newlines
+        lines = message.count("\n") + (not message.endswith("\n"))
+        words = len(message.split())
+        heapq.heappush(self.messages, (date or 0, -order, message, lines, words))
+        self.message_lines += lines
+        self.message_words += words
+        # the oldest message can go once the newer ones fill the budget without it
+        while len(self.messages) > 1:
+            _, _, _, oldest_lines, oldest_words = self.messages[0]
+            if self.message_lines - oldest_lines < caps.max_lines and self.message_words - oldest_words < caps.max_words:
+                break
+            heapq.heappop(self.messages)
+            self.message_lines -= oldest_lines
+            self.message_words -= oldest_words
+
+    def row(self, caps):
+        messages = sorted(self.messages, reverse=True)
+        files = sorted(self.files.items(), key=lambda item: (-item[1], item[0]))[: caps.file_sketch_size]
+        return dict(
+            author_name=self.author_name,
+            commit_count=self.commit_count,
+            lines_added=self.lines_added,
+            lines_deleted=self.lines_deleted,
+            lines_modified=self.lines_modified,
+            files_changed=[path for path, _ in files[: caps.max_files]],
+            # newest first, stage 6 reads from the start
+            message="".join(message for _, _, message, _, _ in messages),
+            first_commit=self.first_commit,
+            last_commit=self.last_commit,
+            window_since=self.window.get("window_since"),
+            window_until=self.window.get("window_until"),
+            file_sketch=[path for path, _ in files],
+            file_counts=[count for _, count in files],
+            message_dates=[date for date, _, _, _, _ in messages],
+            message_lengths=[len(message) for _, _, message, _, _ in messages],
+        )
+
+
+def column_values(column):
+    # a column as python values, dictionary-encoded ones (the normalized layout) through
+    # their dictionary so each distinct value is converted once
+    if pa.types.is_dictionary(column.type):
+        values = column.dictionary.to_pylist()
+        return [None if i is None else values[i] for i in column.indices.to_pylist()]
+    if pa.types.is_large_list(column.type) and pa.types.is_dictionary(column.type.value_type):
+        values, offsets = column_values(column.values), column.offsets.to_pylist()
+        return [values[start:end] for start, end in zip(offsets, offsets[1:])]
+    return column.to_pylist()
+
+
+def aggregate_files(files, caps=None, repos=None, contributors=None):
+    # adds the commits in the given raw_commits files to contributors, a dict of
+    # (repo_owner, repo_name, author_email) -> Contributor, which has to end up with all
+    # of the commits of their repos. repos maps the repo_id of normalized files to the
+    # repo's row in the dimension table. Returns the dict and the commits read.
+    caps = caps or Caps()
+    contributors = {} if contributors is None else contributors
+    order = commits = 0
+    for file in files:
+        parquet = pq.ParquetFile(file)
+        names = parquet.schema_arrow.names
+        keys = [name for name in KEY_COLUMNS if name in names]
+        window = [name for name in WINDOW_COLUMNS if name in names]
+        for batch in parquet.iter_batches(READ_BATCH_SIZE, columns=keys + window + COMMIT_COLUMNS):
+            columns = {name: batch.column(name) for name in batch.schema.names}
+            # epoch milliseconds, compared and kept as ints and converted back on output
+            columns["date"] = columns["date"].cast(pa.int64())
+            columns = {name: column_values(column) for name, column in columns.items()}
+            if "repo_id" in columns:
+                # the normalized layout's repo and window columns are in the dimension table
+                repo_rows = [repos[repo_id] for repo_id in columns["repo_id"]]
+                key_values = [(r["repo_owner"], r["repo_name"], email) for r, email in zip(repo_rows, columns["author_email"])]
+                window_names = WINDOW_COLUMNS
+                window_values = [[r[name] for name in WINDOW_COLUMNS] for r in repo_rows]
+            else:
+                key_values = list(zip(*[columns[name] for name in CONTRIBUTOR_KEYS]))
+                window_names = window
+                window_values = list(zip(*[columns[name] for name in window])) if window else None
+            for i, (key, name, date, message, changed, added, deleted, modified) in enumerate(
+                zip(key_values, *[columns[name] for name in COMMIT_COLUMNS])
+            ):
+                contributor = contributors.get(key)
+                if contributor is None:
+                    contributor = contributors[key] = Contributor(dict(zip(window_names, window_values[i])) if window_names else {})
+                contributor.add(order, name, date, message, changed, added, deleted, modified, caps)
+                order += 1
+            commits += batch.num_rows
+    return contributors, commits
+
+
+def contributor_rows(contributors, caps):
+    # dates stay epoch milliseconds, the schema converts them
+    return [dict(zip(CONTRIBUTOR_KEYS, key), **contributor.row(caps)) for key, contributor in contributors.items()]
+
+
+def read_output(path):
+    # the rows of a file written by write_output, dates as epoch milliseconds, and the
+    # sources it was aggregated from
+    table = pq.read_table(path)
+    for name in DATE_COLUMNS:
+        column = table.column(name)
+        type = pa.large_list(pa.int64()) if pa.types.is_large_list(column.type) else pa.int64()
+        table = table.set_column(table.schema.get_field_index(name), name, column.cast(type))
+    metadata = table.schema.metadata or {}
+    sources = json.loads(metadata[SOURCES_KEY]) if SOURCES_KEY in metadata else None
+    if table.schema.names != CONTRIBUTOR_SCHEMA.names:
+        # written without the sketches, nothing to merge into
+        sources = None
+    return table.to_pylist(), sources
+
+
+def write_output(path, rows, sources):
+    # the sources go into the file's own metadata, so they can't get out of step with
+    # the aggregates however a run ends
+    schema = CONTRIBUTOR_SCHEMA.with_metadata({SOURCES_KEY: json.dumps(sources)})
+    tmp = f"{path}.tmp"
+    pq.write_table(pa.Table.from_pylist(rows, schema=schema), tmp)
+    os.replace(tmp, path)
+
+
+def file_sources(files, input_path, caps):
+    # what an output file is aggregated from: each commit file's size and mtime, and the caps
+    root = input_path if os.path.isdir(input_path) else os.path.dirname(input_path)
+    sizes = {}
+    for file in files:
+        stat = os.stat(file)
+        sizes[os.path.relpath(file, root)] = [stat.st_size, stat.st_mtime_ns]
+    return dict(files=sizes, caps=[caps.max_lines, caps.max_words, caps.max_files])
+
+
+def update_output(path, files, input_path, caps, repos=None, rescan=False):
+    # Brings the output file at path up to date with a group of commit files, returns a
+    # dict of stats and the keys of the contributors whose rows changed.
+    # - unchanged: the files are the ones it was aggregated from, nothing is read
+    # - merged: the only difference is new files (delta files from incremental stage 4
+    #   runs), only those are read and merged into the contributors in the output
+    # - full: anything else, e.g. a rescanned repo, all of the files are read again
+    sources = file_sources(files, input_path, caps)
+    old_rows, old_sources = read_output(path) if os.path.exists(path) else ([], None)
+    if not rescan and old_sources == sources:
+        return dict(mode="unchanged", commits=0, contributors=len(old_rows), changed=[])
+    mode, contributors, read = "full", {}, files
+    if (
+        not rescan
+        and old_sources
+        and old_sources["caps"] == sources["caps"]
+        and all(sources["files"].get(name) == value for name, value in old_sources["files"].items())
+    ):
+        # files not rewritten since, so the output already covers them
+        mode = "merged"
+        contributors = {tuple(row[name] for name in CONTRIBUTOR_KEYS): Contributor.from_row(row, caps) for row in old_rows}
+        read = [file for file, name in zip(files, sources["files"]) if name not in old_sources["files"]]
+    contributors, commits = aggregate_files(read, caps, repos, contributors)
+    rows = contributor_rows(contributors, caps)
+    write_output(path, rows, sources)
+    old = {tuple(row[name] for name in CONTRIBUTOR_KEYS): row for row in old_rows}
+    changed = []
+    for row in rows:
+        previous = old.get(tuple(row[name] for name in CONTRIBUTOR_KEYS))
+        if previous is None or any(row[name] != previous[name] for name in COMPARED_COLUMNS):
+            changed.append({name: row[name] for name in CONTRIBUTOR_KEYS})
+    return dict(mode=mode, commits=commits, contributors=len(rows), changed=changed)
@@ -1,5 +1,92 @@
 import argparse
+import glob
+import os
+import sys
+import tempfile
+
 import daft
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_utils.commit_store import read_repos, repo_file_groups
+from contributor_aggregates import CONTRIBUTOR_KEYS, MAX_FILES, MAX_MESSAGE_LINES, MAX_MESSAGE_WORDS, Caps, update_output
+
+aggregate_stats_dtype = daft.DataType.struct(
+    dict(
+        key=daft.DataType.string(),
+        mode=daft.DataType.string(),
+        commits=daft.DataType.int64(),
+        contributors=daft.DataType.int64(),
+        changed=daft.DataType.list(daft.DataType.struct({name: daft.DataType.string() for name in CONTRIBUTOR_KEYS})),
+    )
+)
+
+_repos = {}
+
+
+def repo_rows(input_path):
+    # repo_id -> row of the normalized layout's dimension table, read once per process
+    if input_path not in _repos:
+        _repos[input_path] = {row["repo_id"]: row for row in read_repos(input_path)}
+    return _repos[input_path]
+
+
+@daft.udf(
+    return_dtype=aggregate_stats_dtype,
+    batch_size=1,
+)
+def aggregate_contributors(
+    keys,
+    file_groups,
+    input_path,
+    output_path,
+    max_lines=MAX_MESSAGE_LINES,
+    max_words=MAX_MESSAGE_WORDS,
+    max_files=MAX_FILES,
+    rescan=False,
+):
+    # every group holds all the commits of its repos, so each repo's contributors are
+    # aggregated in one place, into <output_path>/<key>.parquet, and nothing is shuffled
+    caps = Caps(max_lines, max_words, max_files)
+    results = []
+    for key, files in zip(keys.to_pylist(), file_groups.to_pylist()):
+        path = os.path.join(output_path, f"{key}.parquet")
+        stats = update_output(path, files, input_path, caps, repo_rows(input_path), rescan)
+        results.append(dict(stats, key=key))
+    return results
+
+
+def remove_stale_outputs(output_path, keys):
+    # output files of repos no longer in raw_commits, and any written by daft before
+    # the output was kept per repo
+    removed = 0
+    for path in glob.glob(os.path.join(output_path, "*.parquet")):
+        if os.path.basename(path)[: -len(".parquet")] not in keys:
+            os.remove(path)
+            removed += 1
+    return removed
+
+
+def changed_file(output_path):
+    return f"{output_path.rstrip('/')}_changed.parquet"
+
+
+def write_changed(path, changed):
+    schema = pa.schema([(name, pa.large_string()) for name in CONTRIBUTOR_KEYS])
+    tmp = f"{path}.tmp"
+    pq.write_table(pa.Table.from_pylist(changed, schema=schema), tmp)
+    os.replace(tmp, path)
+
+
+def print_aggregate_summary(stats, changed, removed):
+    modes = {mode: stats["mode"].count(mode) for mode in ["full", "merged", "unchanged"]}
+    print(
+        f"Aggregated {sum(stats['commits'])} commits into {sum(stats['contributors'])} contributors "
+        f"of {len(stats['key'])} repo file groups: {modes['full']} full, {modes['merged']} merged, {modes['unchanged']} unchanged"
+    )
+    print(f"{len(changed)} contributors changed, removed {removed} outputs of repos no longer in the input")
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -7,6 +94,12 @@ if __name__ == "__main__":
     parser.add_argument("--runner", type=str, default="native")
     parser.add_argument("--write-to-file", action="store_true")
     parser.add_argument("--output-path", type=str, default="raw_contributors")
+    # stage 6 reads no more than this of each contributor, so nothing more is aggregated
+    parser.add_argument("--max-message-lines", type=int, default=MAX_MESSAGE_LINES, help="Keep the most recent messages up to this many lines")
+    parser.add_argument("--max-message-words", type=int, default=MAX_MESSAGE_WORDS, help="and this many words")
+    parser.add_argument("--max-files", type=int, default=MAX_FILES, help="Keep this many of the files a contributor changed most often")
+    parser.add_argument("--concurrency", type=int, default=os.cpu_count())
+    parser.add_argument("--full-rescan", action="store_true", help="Ignore the previous output and aggregate every repo's commits again")
     args = parser.parse_args()
 
     if args.runner == "native":
@@ -18,26 +111,33 @@ if __name__ == "__main__":
 
     print(f"Reading commits from {args.input_path}, runner: {args.runner}, write-to-file: {args.write_to_file}")
 
-    df = daft.read_parquet(args.input_path)
-
-    df = df.groupby("repo_owner", "repo_name", "author_email").agg(
-        [
-            daft.col("author_name").any_value(),
-            daft.col("date").count().alias("commit_count"),
-            daft.col("lines_added").sum(),
-            daft.col("lines_deleted").sum(),
-            daft.col("lines_modified").sum(),
-            daft.col("files_changed").agg_concat(),
-            daft.col("message").agg_concat(),
-            daft.col("date").min().alias("first_commit"),
-            daft.col("date").max().alias("last_commit"),
-        ]
+    groups = repo_file_groups(args.input_path)
+    print(f"Aggregating contributors of {len(groups)} repo file groups")
+    output_path = args.output_path if args.write_to_file else tempfile.mkdtemp()
+    os.makedirs(output_path, exist_ok=True)
+    aggregator = aggregate_contributors.with_concurrency(args.concurrency)
+    df = daft.from_pydict(dict(key=list(groups), files=list(groups.values())))
+    stats = df.select(
+        aggregator(
+            df["key"],
+            df["files"],
+            args.input_path,
+            output_path,
+            args.max_message_lines,
+            args.max_message_words,
+            args.max_files,
+            args.full_rescan,
+        ).alias("stats")
     )
+    stats = stats.select(daft.col("stats").struct.get("*")).to_pydict()
+    removed = remove_stale_outputs(output_path, set(groups))
+    changed = [key for keys in stats["changed"] for key in keys]
+    print_aggregate_summary(stats, changed, removed)
 
     if args.write_to_file:
-        path = args.output_path
-        files = df.write_parquet(path)
-        print(f"Wrote files to {path}")
-        print(files)
+        # the contributors whose aggregates moved in this run, what stage 6 has to analyze again
+        path = changed_file(output_path)
+        write_changed(path, changed)
+        print(f"Wrote files to {output_path}, changed contributors to {path}")
     else:
-        df.show()
+        daft.read_parquet(output_path).show()
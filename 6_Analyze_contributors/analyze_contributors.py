@@ -11,6 +11,22 @@ from pydantic import BaseModel
 import os
 from dotenv import load_dotenv
 import asyncio
+import re
+import shutil
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_utils.batch_inference import (
+    BatchJob,
+    load_openai_batch_client_and_model,
+    parquet_partitions,
+    parse_tool_response,
+    run_batch_jobs,
+    tool_request,
+)
+from pipeline_utils.concurrency import AIMDLimiter
+from pipeline_utils.llm_cache import cache_key
+from pipeline_utils.llm_clients import BackgroundLoop, make_http_client, validation_retries
 
 load_dotenv()
 
@@ -25,7 +41,7 @@ def load_fireworks_client_and_model(timeout=60):
     
     return instructor.from_fireworks(AsyncFireworks(api_key=FIREWORKS_API_KEY, timeout=timeout)), FIREWORKS_MODEL
 
-def load_openai_client_and_model(timeout=60):
+def load_openai_client_and_model(timeout=60, http_client=None, max_retries=2):
     OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
     if not OPENAI_API_KEY:
         raise ValueError("OPENAI_API_KEY is not set")
@@ -34,7 +50,7 @@ def load_openai_client_and_model(timeout=60):
     if not OPENAI_MODEL:
         raise ValueError("OPENAI_MODEL is not set")
     
-    return instructor.from_openai(AsyncOpenAI(api_key=OPENAI_API_KEY, timeout=timeout)), OPENAI_MODEL
+    return instructor.from_openai(AsyncOpenAI(api_key=OPENAI_API_KEY, timeout=timeout, http_client=http_client, max_retries=max_retries)), OPENAI_MODEL
 
 class CommitQuality(BaseModel):
     impact_to_project: int = Field(
@@ -50,49 +66,19 @@ class CommitQuality(BaseModel):
     reason: str
 
 
-@daft.udf(
-    return_dtype=daft.DataType.struct(
-        dict(
-            impact_to_project=daft.DataType.int64(),
-            technical_ability=daft.DataType.int64(),
-            reason=daft.DataType.string(),
-        )
-    ),
-)
-def analyze_commit_message(
-    repo_name,
-    commit_count,
-    lines_added,
-    lines_deleted,
-    lines_modified,
-    files_changed,
-    message,
-    provider="OpenAI",
-    max_concurrent_requests=64,
-    max_tokens=128,
-    max_retries=3,
-):
-    if provider == "OpenAI":
-        client, model = load_openai_client_and_model()
-    elif provider == "Fireworks":
-        client, model = load_fireworks_client_and_model()
-    else:
-        raise ValueError(f"Invalid provider: {provider}")
-
-    results = []
+def build_prompt(repo, c, la, ld, lm, f, msg):
+    # Limit message length to first 500 lines or 10000 words
+    msg_lines = msg.split("\n")[:500]
+    msg_text = "\n".join(msg_lines)
 
-    async def analyze_single_commit(client, repo, c, la, ld, lm, f, msg):
-        # Limit message length to first 500 lines or 10000 words
-        msg_lines = msg.split("\n")[:500]
-        msg_text = "\n".join(msg_lines)
+    msg_words = msg_text.split()[:10000]
+    msg_text = " ".join(msg_words)
+    msg = msg_text
 
-        msg_words = msg_text.split()[:10000]
-        msg_text = " ".join(msg_words)
-        msg = msg_text
+    # sorted so the prompt, and the batch request id hashed from it, is the same in every process
+    f = sorted(set(f))[:100]
 
-        f = list(set(f))[:100]
-
-        prompt = f"""You are an expert at analyzing GitHub contributions and determining developer impact and technical ability.
+    prompt = f"""You are an expert at analyzing GitHub contributions and determining developer impact and technical ability.
 
         Analyze the following GitHub contribution data to assess:
         1. The contributor's impact to the project (score 1-10):
@@ -120,13 +106,53 @@ def analyze_commit_message(
 
         Keep your reason explanation brief - maximum 4 sentences.
         """
+    return prompt
+
+
+@daft.udf(
+    return_dtype=daft.DataType.struct(
+        dict(
+            impact_to_project=daft.DataType.int64(),
+            technical_ability=daft.DataType.int64(),
+            reason=daft.DataType.string(),
+        )
+    ),
+)
+class AnalyzeCommitMessage:
+    # Stateful UDF, run it with with_concurrency() so each worker builds its client,
+    # HTTP connection pool and event loop once for the whole run
+    def __init__(
+        self,
+        provider="OpenAI",
+        max_concurrent_requests=64,
+        initial_concurrent_requests=8,
+        max_tokens=128,
+        max_retries=3,
+    ):
+        if provider == "OpenAI":
+            self.client, self.model = load_openai_client_and_model(
+                http_client=make_http_client(max_concurrent_requests), max_retries=0
+            )
+        elif provider == "Fireworks":
+            self.client, self.model = load_fireworks_client_and_model()
+        else:
+            raise ValueError(f"Invalid provider: {provider}")
+
+        self.loop = BackgroundLoop()
+        self.limiter = AIMDLimiter(initial=initial_concurrent_requests, max_limit=max_concurrent_requests)
+        self.max_tokens = max_tokens
+        self.max_retries = max_retries
+
+    async def analyze_single_commit(self, repo, c, la, ld, lm, f, msg):
+        prompt = build_prompt(repo, c, la, ld, lm, f, msg)
         try:
-            result = await client.chat.completions.create(
-                model=model,
+            result = await self.limiter.run(
+                self.client.chat.completions.create,
+                model=self.model,
                 response_model=CommitQuality,
                 messages=[{"role": "user", "content": prompt}],
-                max_tokens=max_tokens,
-                max_retries=max_retries,
+                max_tokens=self.max_tokens,
+                max_retries=validation_retries(self.max_retries),
             )
 
             return result.model_dump()
@@ -134,15 +160,22 @@ def analyze_commit_message(
             print(f"Got error when validating input from model {e}")
             return None
 
-    semaphore = asyncio.Semaphore(max_concurrent_requests)
+    async def analyze_rows(self, rows):
+        results = await asyncio.gather(*[self.analyze_single_commit(*row) for row in rows])
+        print(self.limiter.summary())
+        return results
 
-    async def analyze_with_semaphore(*args):
-        async with semaphore:
-            return await analyze_single_commit(*args)
-
-    tasks = [
-        analyze_with_semaphore(client, repo, c, la, ld, lm, f, msg)
-        for repo, c, la, ld, lm, f, msg in zip(
+    def __call__(
+        self,
+        repo_name,
+        commit_count,
+        lines_added,
+        lines_deleted,
+        lines_modified,
+        files_changed,
+        message,
+    ):
+        rows = zip(
             repo_name,
             commit_count,
             lines_added,
@@ -151,13 +184,84 @@ def analyze_commit_message(
             files_changed,
             message,
         )
-    ]
+        return self.loop.run(self.analyze_rows(rows))
+
+
+PROMPT_COLUMNS = ["repo_name", "commit_count", "lines_added", "lines_deleted", "lines_modified", "files_changed", "message"]
+# we only care about folks who have contributed at least 100 lines of code and 3 commits
+CONTRIBUTOR_FILTER = "lines_modified > 100 AND commit_count >= 3"
+CONTRIBUTOR_KEYS = ["repo_owner", "repo_name", "author_email"]
+# stage 5 writes a file per repo named by a hash of its url, batch mode groups them by
+# the first hex digits of the hash so a run is at most 256 jobs, and a repo is in the
+# same job from run to run
+REPO_FILE = re.compile(r"^[0-9a-f]{16}$")
+JOB_PREFIX = 2
+
+
+def unchanged_analyses(input_path, previous_path, changed_path):
+    # the previous output's rows of contributors still in the input that aren't in
+    # stage 5's list of changed contributors, their aggregates and so their prompts are
+    # the same as last time
+    previous = daft.read_parquet(previous_path)
+    current = daft.read_parquet(input_path)
+    missing = set(current.column_names) - set(previous.column_names)
+    if missing:
+        print(f"{previous_path} has no {', '.join(sorted(missing))} columns, analyzing every contributor again")
+        return None
+    current = current.select(*CONTRIBUTOR_KEYS)
+    changed = daft.read_parquet(changed_path).select(*CONTRIBUTOR_KEYS)
+    df = previous.join(current, on=CONTRIBUTOR_KEYS, how="semi").join(changed, on=CONTRIBUTOR_KEYS, how="anti")
+    # read in full, the output they came from gets replaced
+    return daft.from_arrow(df.to_arrow())
+
+
+def contributors_to_analyze(df, kept):
+    df = df.where(CONTRIBUTOR_FILTER)
+    if kept is not None:
+        df = df.join(kept.select(*CONTRIBUTOR_KEYS), on=CONTRIBUTOR_KEYS, how="anti")
+    return df
+
+
+def batch_partitions(input_path):
+    # {job name: files}
+    partitions = {}
+    for partition, path in parquet_partitions(input_path):
+        name = f"repos-{partition[:JOB_PREFIX]}" if REPO_FILE.match(partition) else partition
+        partitions.setdefault(name, []).append(path)
+    return partitions
 
-    async def run_tasks():
-        return await asyncio.gather(*tasks)
 
-    results = asyncio.run(run_tasks())
-    return results
+def analyze_in_batch_mode(input_path, batch_dir, poll_interval=30, wait=True, max_tokens=128, kept=None):
+    # One batch job per input parquet file, or group of stage 5's repo files. Returns None
+    # until every job has finished, rerun with the same --batch-dir to pick up where the
+    # last run left off.
+    client, model = load_openai_batch_client_and_model()
+    partitions = []
+    for partition, paths in batch_partitions(input_path).items():
+        table = contributors_to_analyze(daft.read_parquet(paths), kept).to_arrow()
+        keys, requests = [], {}
+        for row in zip(*(table.column(name).to_pylist() for name in PROMPT_COLUMNS)):
+            prompt = build_prompt(*row)
+            key = cache_key(model, max_tokens, prompt)
+            keys.append(key)
+            requests[key] = tool_request(key, model, prompt, CommitQuality, max_tokens)
+        job = BatchJob(client, os.path.join(batch_dir, partition), requests, lambda body: parse_tool_response(body, CommitQuality))
+        partitions.append((table, keys, job))
+
+    if not run_batch_jobs([job for _, _, job in partitions], poll_interval, wait):
+        return None
+
+    import pyarrow as pa
+
+    tables = []
+    for table, keys, job in partitions:
+        results = job.results()
+        rows = [results.get(key) or {} for key in keys]
+        table = table.append_column("impact_to_project", pa.array([r.get("impact_to_project") for r in rows], pa.int64()))
+        table = table.append_column("technical_ability", pa.array([r.get("technical_ability") for r in rows], pa.int64()))
+        table = table.append_column("reason", pa.array([r.get("reason") for r in rows], pa.large_string()))
+        tables.append(table)
+    return daft.from_arrow(tables)
 
 
 if __name__ == "__main__":
@@ -166,6 +270,14 @@ if __name__ == "__main__":
     parser.add_argument("--runner", type=str, default="native")
     parser.add_argument("--write-to-file", action="store_true")
     parser.add_argument("--output-path", type=str, default="analyzed_contributors")
+    parser.add_argument("--max-concurrent-requests", type=int, default=64, help="Upper bound for the adaptive concurrency limit")
+    parser.add_argument("--initial-concurrent-requests", type=int, default=8)
+    parser.add_argument("--mode", type=str, default="sync", choices=["sync", "batch"], help="batch submits the prompts to the OpenAI batch endpoint")
+    parser.add_argument("--batch-dir", type=str, default=".batch_jobs/analyze_contributors", help="Request files, batch ids and results for --mode batch")
+    parser.add_argument("--batch-poll-interval", type=float, default=30)
+    parser.add_argument("--batch-submit-only", action="store_true", help="Submit the batches and exit without waiting for them")
+    parser.add_argument("--changed-path", type=str, default=None, help="Only analyze the contributors in stage 5's <output-path>_changed.parquet, keep the previous analyses of the rest")
+    parser.add_argument("--previous-path", type=str, default=None, help="Previous output for --changed-path, defaults to --output-path")
     args = parser.parse_args()
 
     if args.runner == "native":
@@ -177,32 +289,50 @@ if __name__ == "__main__":
     
     print(f"Reading contributors from {args.input_path}, runner: {args.runner}, write-to-file: {args.write_to_file}")
 
-    df = daft.read_parquet(args.input_path)
-    # we only care about folks who have contributed at least 100 lines of code and 3 commits
-    df = df.where("lines_modified > 100 AND commit_count >= 3")
-    df = df.with_column(
-        "commit_analysis",
-        analyze_commit_message(
-            df["repo_name"],
-            df["commit_count"],
-            df["lines_added"],
-            df["lines_deleted"],
-            df["lines_modified"],
-            df["files_changed"],
-            df["message"],
-        ),
-    )
-    df = df.with_columns(
-        {
-            "impact_to_project": df["commit_analysis"].struct.get("impact_to_project"),
-            "technical_ability": df["commit_analysis"].struct.get("technical_ability"),
-            "reason": df["commit_analysis"].struct.get("reason"),
-        }
-    )
-    df = df.exclude("commit_analysis")
-    
+    kept = None
+    previous_path = args.previous_path or args.output_path
+    if args.changed_path and os.path.exists(previous_path):
+        kept = unchanged_analyses(args.input_path, previous_path, args.changed_path)
+        if kept is not None:
+            print(f"Keeping the analyses of {kept.count_rows()} unchanged contributors from {previous_path}")
+
+    if args.mode == "batch":
+        df = analyze_in_batch_mode(args.input_path, args.batch_dir, args.batch_poll_interval, not args.batch_submit_only, kept=kept)
+        if df is None:
+            print(f"Batch jobs in {args.batch_dir} are still running, rerun to collect the results")
+            sys.exit(0)
+    else:
+        df = contributors_to_analyze(daft.read_parquet(args.input_path), kept)
+        commit_message_analyzer = AnalyzeCommitMessage.with_init_args(
+            max_concurrent_requests=args.max_concurrent_requests,
+            initial_concurrent_requests=args.initial_concurrent_requests,
+        ).with_concurrency(1)
+        df = df.with_column(
+            "commit_analysis",
+            commit_message_analyzer(*[df[name] for name in PROMPT_COLUMNS]),
+        )
+        df = df.with_columns(
+            {
+                "impact_to_project": df["commit_analysis"].struct.get("impact_to_project"),
+                "technical_ability": df["commit_analysis"].struct.get("technical_ability"),
+                "reason": df["commit_analysis"].struct.get("reason"),
+            }
+        )
+        df = df.exclude("commit_analysis")
+
+    if kept is not None:
+        df = df.concat(kept.select(*df.column_names))
+
     if args.write_to_file:
-        files = df.write_parquet(args.output_path)
+        # write_parquet adds files to a directory, so an output that can also be the
+        # previous one is written next to it and swapped in
+        path = f"{args.output_path.rstrip('/')}.tmp" if args.changed_path and os.path.exists(args.output_path) else args.output_path
+        if path != args.output_path:
+            shutil.rmtree(path, ignore_errors=True)
+        files = df.write_parquet(path)
+        if path != args.output_path:
+            shutil.rmtree(args.output_path)
+            os.replace(path, args.output_path)
         print(f"Wrote files to {args.output_path}")
         print(files)
     else:
@@ -91,7 +91,9 @@ if __name__ == "__main__":
     contributors_dedupped = contributors_consolidated_emails.where('email_count <= 15')
     
     # Step 2: Process repos data
-    repos = daft.read_parquet(args.input_repos_path).exclude('readme', 'reason').with_columns(dict(
+    repos = daft.read_parquet(args.input_repos_path)
+    token_columns = [c for c in ('readme_tokens', 'prompt_readme_tokens') if c in repos.column_names]
+    repos = repos.exclude('readme', 'reason', *token_columns).with_columns(dict(
         languages=col('languages').list.join(delimiter='|').str.normalize(remove_punct=False, lowercase=True, white_space=True).str.split('|'),
         keywords=col('keywords').list.join(delimiter='|').str.normalize(remove_punct=False, lowercase=True, white_space=True).str.split('|'),
     ))
@@ -0,0 +1,110 @@
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import daft
+import httpx
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from bench_batch_inference import write_contributors
+from bench_llm_client import start_fake_server
+from bench_readme_text import synthetic_corpus
+
+# Runs the LLM analysis stages end to end against the fake OpenAI server and reports
+# rows/sec and per-call latency. Per-call latency is measured by the server, from the
+# first attempt at a request to its successful response, so it includes time lost to
+# 429s and retries. Rows/sec includes process start-up.
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def write_repos(directory, n, seed=0):
+    readmes = synthetic_corpus(n, seed)
+    pq.write_table(
+        pa.table(
+            {
+                "name": [f"org/project{i}" for i in range(n)],
+                "url": [f"https://github.com/org/project{i}" for i in range(n)],
+                "description": [f"A library for doing things quickly, number {i}" for i in range(n)],
+                "readme": readmes,
+            }
+        ),
+        os.path.join(directory, "repos.parquet"),
+    )
+
+
+def run_stage(url, script, args):
+    env = dict(os.environ, OPENAI_BASE_URL=url, OPENAI_API_KEY="fake", OPENAI_MODEL="fake")
+    subprocess.run([sys.executable, os.path.join(ROOT, script), *args], env=env, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def format_seconds(value):
+    return f"{value * 1000:.0f}ms" if value is not None else "n/a"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stages", type=str, default="analyze_repo,analyze_contributors,demo_analyze_commits")
+    parser.add_argument("--repos", type=int, default=500)
+    parser.add_argument("--contributors", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--latency-dist", type=str, default="lognormal", choices=["fixed", "uniform", "exponential", "lognormal"])
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--max-in-flight", type=int, default=None)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--recording", type=str, default=None, help="Replay responses recorded with fake_openai_api.py --upstream")
+    parser.add_argument("--replay-latency", action="store_true", help="Replay with the recorded latencies instead of --latency")
+    parser.add_argument("--max-concurrent-requests", type=int, default=64)
+    parser.add_argument("--initial-concurrent-requests", type=int, default=8)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    repos_path, contributors_path = os.path.join(tmp, "repos"), os.path.join(tmp, "contributors")
+    os.makedirs(repos_path)
+    os.makedirs(contributors_path)
+    write_repos(repos_path, args.repos)
+    write_contributors(contributors_path, 1, args.contributors)
+
+    server_args = ["--latency-dist", args.latency_dist, "--throttle-rate", str(args.throttle_rate), "--retry-after", str(args.retry_after)]
+    if args.max_in_flight is not None:
+        server_args += ["--max-in-flight", str(args.max_in_flight)]
+    if args.recording:
+        server_args += ["--recording", args.recording] + (["--replay-latency"] if args.replay_latency else [])
+    process, url = start_fake_server(args.latency, 0.0, False, server_args)
+
+    concurrency = ["--max-concurrent-requests", str(args.max_concurrent_requests), "--initial-concurrent-requests", str(args.initial_concurrent_requests)]
+    stages = {
+        "analyze_repo": ("3_Analyze_repos/analyze_repo.py", ["--input-path", repos_path, "--no-llm-cache", *concurrency]),
+        "analyze_contributors": ("6_Analyze_contributors/analyze_contributors.py", ["--input-path", contributors_path, *concurrency]),
+        "demo_analyze_commits": ("demo/analyze_commits.py", ["--input-path", contributors_path, "--limit", str(args.contributors)]),
+    }
+    print(
+        f"{args.latency_dist} latency around {args.latency * 1000:.0f}ms, {args.throttle_rate:.0%} random 429s, "
+        f"{'no in-flight cap' if args.max_in_flight is None else f'429 beyond {args.max_in_flight} in flight'}"
+        f"{f', replaying {args.recording}' if args.recording else ''}"
+    )
+
+    try:
+        for name in args.stages.split(","):
+            script, stage_args = stages[name]
+            output_path = os.path.join(tmp, f"{name}_output")
+            httpx.post(f"{url}/stats/reset")
+            start = time.time()
+            run_stage(url, script, [*stage_args, "--write-to-file", "--output-path", output_path])
+            elapsed = time.time() - start
+            stats = httpx.get(f"{url}/stats").json()
+            rows = daft.read_parquet(output_path).count_rows()
+            print(
+                f"{name:>22}: {rows} rows in {elapsed:.2f}s, {rows / elapsed:,.1f} rows/sec, {stats['calls']} calls, "
+                f"p50 {format_seconds(stats['latency_p50'])}, p99 {format_seconds(stats['latency_p99'])}, "
+                f"{stats['throttled']} 429s"
+                + (f", {stats['replayed']} replayed, {stats['replay_misses']} not in the recording" if args.recording else "")
+            )
+    finally:
+        process.kill()
+        shutil.rmtree(tmp)
@@ -0,0 +1,94 @@
+import argparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import daft
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from bench_llm_client import server_stats, start_fake_server
+
+# Runs stage 6 against the fake OpenAI server in sync mode and in --mode batch. The
+# batch run is split into a --batch-submit-only run and a second run that collects
+# the results, the same as a restart while the batches are in flight.
+
+STAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "6_Analyze_contributors", "analyze_contributors.py")
+
+
+def write_contributors(directory, files, rows, seed=0):
+    rng = random.Random(seed)
+    for part in range(files):
+        pq.write_table(
+            pa.table(
+                {
+                    "repo_name": [f"org/repo{rng.randint(0, 20)}" for _ in range(rows)],
+                    "author_email": [f"dev{part}-{i}@example.com" for i in range(rows)],
+                    "commit_count": [rng.randint(3, 200) for _ in range(rows)],
+                    "lines_added": [rng.randint(100, 20000) for _ in range(rows)],
+                    "lines_deleted": [rng.randint(0, 5000) for _ in range(rows)],
+                    "lines_modified": [rng.randint(101, 25000) for _ in range(rows)],
+                    "files_changed": [[f"src/module{rng.randint(0, 50)}.py" for _ in range(rng.randint(1, 8))] for _ in range(rows)],
+                    "message": [f"Fix edge case {i} in the parser\nAdd tests" for i in range(rows)],
+                }
+            ),
+            os.path.join(directory, f"part-{part}.parquet"),
+        )
+
+
+def run_stage(url, *args):
+    env = dict(os.environ, OPENAI_BASE_URL=url, OPENAI_API_KEY="fake", OPENAI_MODEL="fake")
+    subprocess.run([sys.executable, STAGE, *args], env=env, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--rows-per-file", type=int, default=250)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--batch-latency", type=float, default=2.0)
+    parser.add_argument("--batch-error-rate", type=float, default=0.05)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    input_path = os.path.join(tmp, "raw_contributors")
+    os.makedirs(input_path)
+    write_contributors(input_path, args.files, args.rows_per_file)
+    process, url = start_fake_server(
+        args.latency, 0.0, False,
+        ["--batch-latency", str(args.batch_latency), "--batch-error-rate", str(args.batch_error_rate)],
+    )
+    print(
+        f"{args.files} files of {args.rows_per_file} contributors, {args.latency * 1000:.0f}ms per request, "
+        f"batches finish after {args.batch_latency:.1f}s with {args.batch_error_rate:.0%} of requests failing"
+    )
+
+    try:
+        batch_dir = os.path.join(tmp, "batch_jobs")
+        runs = (
+            ("sync", [["--mode", "sync"]]),
+            ("batch, submit then collect", [
+                ["--mode", "batch", "--batch-dir", batch_dir, "--batch-submit-only"],
+                ["--mode", "batch", "--batch-dir", batch_dir, "--batch-poll-interval", "1"],
+            ]),
+        )
+        for label, commands in runs:
+            output_path = os.path.join(tmp, label.split(",")[0])
+            before = server_stats(url)
+            start = time.time()
+            for command in commands:
+                run_stage(url, "--input-path", input_path, "--write-to-file", "--output-path", output_path, *command)
+            elapsed = time.time() - start
+            after = server_stats(url)
+            reasons = daft.read_parquet(output_path).to_pydict()["reason"]
+            print(
+                f"{label:>28}: {elapsed:.2f}s, {after['http_requests'] - before['http_requests']} HTTP requests, "
+                f"{after['requests'] - before['requests']} completions, {sum(r is not None for r in reasons)}/{len(reasons)} rows analyzed"
+            )
+    finally:
+        process.kill()
+        shutil.rmtree(tmp)
@@ -0,0 +1,139 @@
+import argparse
+import glob
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "4_Extract_commits"))
+from commit_index import get_index  # noqa: E402
+import extract_commits  # noqa: E402
+from extract_commits import index_file, open_commit_repo, write_repo_commits  # noqa: E402
+
+# Builds an upstream repo and a few forks of it, each with some commits of its own,
+# then extracts all of them into parquet with and without the commit index. Reports
+# the rows and bytes written, the duplicates dropped and the time spent on both runs.
+# The repos are served from a local directory through git's url.<base>.insteadOf.
+# With --fail-after, the upstream extraction also fails partway through in a third
+# run, and the forks extracted after it have to keep the commits it had claimed.
+
+
+def fast_import(path, commits, start, parent=None, seed=0):
+    # appends `commits` commits to the default branch of the bare repo at path
+    rng = random.Random(seed)
+    out = []
+    for i in range(commits):
+        message = f"change {start + i}\n".encode()
+        content = f"{rng.getrandbits(64)}\n".encode()
+        author = f"Author {rng.randrange(200)} <author{rng.randrange(200)}@example.com> {1500000000 + 600 * (start + i)} +0000"
+        out.append(b"commit refs/heads/main\n")
+        out.append(f"author {author}\ncommitter {author}\n".encode())
+        out.append(b"data %d\n%s" % (len(message), message))
+        if i == 0 and parent:
+            out.append(f"from {parent}\n".encode())
+        out.append(f"M 100644 inline src/file_{rng.randrange(500)}.py\n".encode())
+        out.append(b"data %d\n%s\n" % (len(content), content))
+    subprocess.run(["git", "-C", path, "fast-import", "--quiet"], input=b"".join(out), check=True)
+
+
+def make_repos(root, commits, forks, fork_commits):
+    upstream = os.path.join(root, "upstream", "project.git")
+    subprocess.run(["git", "init", "-q", "--bare", "-b", "main", upstream], check=True)
+    fast_import(upstream, commits, 0)
+    urls = ["https://github.com/upstream/project"]
+    for i in range(forks):
+        path = os.path.join(root, f"fork{i}", "project.git")
+        subprocess.run(["git", "clone", "-q", "--bare", upstream, path], check=True)
+        head = subprocess.run(["git", "-C", path, "rev-parse", "main"], capture_output=True, text=True, check=True)
+        fast_import(path, fork_commits, commits + i * fork_commits, head.stdout.strip(), seed=i + 1)
+        urls.append(f"https://github.com/fork{i}/project")
+    return urls
+
+
+def failing_after(count):
+    # repo_batches that raises after count record batches, like git dying mid-history
+    repo_batches = extract_commits.repo_batches
+
+    def failing(*args, **kwargs):
+        batches, ranges = repo_batches(*args, **kwargs)
+
+        def fail():
+            for i, batch in enumerate(batches):
+                if i == count:
+                    raise RuntimeError(f"failed after {count} batches")
+                yield batch
+
+        return fail(), ranges
+
+    return failing
+
+
+def extract_with_failing_upstream(urls, output_path, index_path, count):
+    repo_batches = extract_commits.repo_batches
+    extract_commits.repo_batches = failing_after(count)
+    try:
+        with open_commit_repo(urls[0]) as repo:
+            write_repo_commits(urls[0], repo, output_path, batch_size=1000, index_path=index_path)
+    except RuntimeError:
+        pass
+    finally:
+        extract_commits.repo_batches = repo_batches
+    return extract(urls[1:], output_path, index_path)
+
+
+def extract(urls, output_path, index_path):
+    rows = duplicates = duplicate_bytes = 0
+    start = time.perf_counter()
+    for url in urls:
+        with open_commit_repo(url) as repo:
+            stats = write_repo_commits(url, repo, output_path, index_path=index_path)
+        rows += stats["commits"]
+        duplicates += stats.get("duplicates", 0)
+        duplicate_bytes += stats.get("duplicate_bytes", 0)
+    seconds = time.perf_counter() - start
+    disk = sum(os.path.getsize(path) for path in glob.glob(os.path.join(output_path, "*.parquet")))
+    return rows, disk, duplicates, duplicate_bytes, seconds
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--commits", type=int, default=20_000, help="Commits in the upstream repo")
+    parser.add_argument("--forks", type=int, default=4)
+    parser.add_argument("--fork-commits", type=int, default=50, help="Commits of its own in each fork")
+    parser.add_argument("--fail-after", type=int, default=None, help="Also run with the upstream failing after this many batches of 1000 commits")
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    try:
+        urls = make_repos(os.path.join(root, "remote"), args.commits, args.forks, args.fork_commits)
+        os.environ.update(
+            GIT_CONFIG_COUNT="1",
+            GIT_CONFIG_KEY_0=f"url.file://{root}/remote/.insteadOf",
+            GIT_CONFIG_VALUE_0="https://github.com/",
+        )
+        print(f"upstream with {args.commits:,} commits, {args.forks} forks with {args.fork_commits} commits of their own")
+        for label, dedup in [("without index", False), ("with index", True)]:
+            output_path = os.path.join(root, label.replace(" ", "_"))
+            os.makedirs(output_path)
+            index_path = index_file(output_path) if dedup else None
+            rows, disk, duplicates, duplicate_bytes, seconds = extract(urls, output_path, index_path)
+            print(
+                f"{label:>14}: {rows:8,} commits, {disk / 1e6:6.1f} MB parquet, {seconds:5.1f}s, "
+                f"dropped {duplicates:,} duplicates ({duplicate_bytes / 1e6:.1f} MB in arrow)"
+            )
+            if dedup:
+                print(get_index(index_path).summary())
+        if args.fail_after is not None:
+            output_path = os.path.join(root, "failing_upstream")
+            os.makedirs(output_path)
+            rows, disk, duplicates, _, _ = extract_with_failing_upstream(urls, output_path, index_file(output_path), args.fail_after)
+            # the forks hold every commit between them, so they should write all of them
+            print(
+                f"upstream failing after {args.fail_after} batches: forks wrote {rows:,} commits "
+                f"({args.commits + args.forks * args.fork_commits:,} distinct in all repos), dropped {duplicates:,}"
+            )
+    finally:
+        shutil.rmtree(root)
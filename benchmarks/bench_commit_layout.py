@@ -0,0 +1,106 @@
+import argparse
+import glob
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import pyarrow.parquet as pq
+
+from bench_git_log_parser import render_z, synthetic_commits
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "4_Extract_commits"))
+from pipeline_utils.commit_store import repos_file, write_repos  # noqa: E402
+from git_log_stream import commit_batches, output_file, repo_columns, write_batches  # noqa: E402
+
+# Writes the same synthetic histories in the wide and the normalized raw_commits
+# layouts, then compares their size on disk, their size in memory when read with
+# pyarrow, and stage 5's runtime and peak RSS on each.
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def write_layouts(wide_path, normalized_path, repos, commits_per_repo, batch_size):
+    rows = []
+    for i in range(repos):
+        log = render_z(synthetic_commits(commits_per_repo, seed=i))
+        owner, name = "some-organization", f"some-project-{i}"
+        url = f"https://github.com/{owner}/{name}"
+        values = repo_columns(name, owner, url, repo_id=i)
+        for layout, path in [("wide", wide_path), ("normalized", normalized_path)]:
+            write_batches(commit_batches([log], values, batch_size, layout), output_file(path, url))
+        rows.append(dict(repo_id=i, repo_name=name, url=url, repo_owner=owner, window_since=None, window_until=None))
+    write_repos(normalized_path, rows)
+
+
+def disk_bytes(path):
+    files = glob.glob(os.path.join(path, "*.parquet"))
+    if os.path.exists(repos_file(path)):
+        files.append(repos_file(path))
+    return sum(os.path.getsize(f) for f in files)
+
+
+def memory_bytes(path):
+    size = pq.read_table(path).nbytes
+    if os.path.exists(repos_file(path)):
+        size += pq.read_table(repos_file(path)).nbytes
+    return size
+
+
+def run_stage5(input_path, output_path):
+    # seconds and peak RSS of one extract_contributors.py run
+    shutil.rmtree(output_path, ignore_errors=True)
+    start = time.time()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "5_Extract_contributors", "extract_contributors.py"),
+         "--input-path", input_path, "--write-to-file", "--output-path", output_path],
+        stdout=subprocess.DEVNULL,
+    )
+    _, status, usage = os.wait4(process.pid, 0)
+    if status:
+        raise RuntimeError(f"stage 5 failed on {input_path}")
+    return time.time() - start, usage.ru_maxrss * 1024
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repos", type=int, default=50)
+    parser.add_argument("--commits-per-repo", type=int, default=4000)
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--generate", nargs=2, metavar=("WIDE", "NORMALIZED"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.generate:
+        write_layouts(*args.generate, args.repos, args.commits_per_repo, args.batch_size)
+        sys.exit()
+
+    tmp = tempfile.mkdtemp()
+    paths = {layout: os.path.join(tmp, layout) for layout in ["wide", "normalized"]}
+    for path in paths.values():
+        os.makedirs(path)
+    # in a subprocess, and stage 5 runs before anything is read back, since a child forked
+    # from a big parent starts out with the parent's RSS
+    subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--generate", paths["wide"], paths["normalized"],
+         "--repos", str(args.repos), "--commits-per-repo", str(args.commits_per_repo), "--batch-size", str(args.batch_size)],
+        check=True,
+    )
+    print(f"{args.repos} repos x {args.commits_per_repo:,} commits")
+
+    try:
+        runs = {
+            layout: [run_stage5(path, os.path.join(tmp, f"{layout}_contributors")) for _ in range(args.repeat)]
+            for layout, path in paths.items()
+        }
+        for layout, path in paths.items():
+            print(
+                f"{layout:>10}: {disk_bytes(path) / 1e6:7.1f} MB on disk, {memory_bytes(path) / 1e6:7.1f} MB in arrow, "
+                f"stage 5 {min(seconds for seconds, _ in runs[layout]):.2f}s, "
+                f"peak RSS {max(rss for _, rss in runs[layout]) / 1e6:.0f} MB"
+            )
+    finally:
+        shutil.rmtree(tmp)
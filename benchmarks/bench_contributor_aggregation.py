@@ -0,0 +1,127 @@
+import argparse
+import glob
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import daft
+import pyarrow.parquet as pq
+
+from bench_git_log_parser import render_z, synthetic_commits
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "4_Extract_commits"))
+from git_log_stream import commit_batches, output_file, repo_columns, write_batches  # noqa: E402
+
+# Compares stage 5's bounded aggregation with the groupby it replaced, which
+# concatenated every message and file list per contributor, on synthetic histories
+# where a handful of authors write most of the commits. Reports runtime, peak RSS and
+# the size of the largest message and file list each one produces.
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def write_commits(path, repos, commits_per_repo, authors):
+    for i in range(repos):
+        commits = synthetic_commits(commits_per_repo, seed=i)
+        rng = random.Random(i)
+        people = [(f"Author {i}-{a}", f"author{i}-{a}@example.com") for a in range(authors)]
+        for commit in commits:
+            commit["author"] = rng.choice(people)
+        url = f"https://github.com/some-organization/some-project-{i}"
+        values = repo_columns(f"some-project-{i}", "some-organization", url)
+        write_batches(commit_batches([render_z(commits)], values), output_file(path, url))
+
+
+def unbounded_groupby(input_path, output_path):
+    # stage 5 before the bounded aggregation
+    df = daft.read_parquet(input_path)
+    df = df.groupby("repo_owner", "repo_name", "author_email").agg(
+        [
+            daft.col("author_name").any_value(),
+            daft.col("date").count().alias("commit_count"),
+            daft.col("lines_added").sum(),
+            daft.col("lines_deleted").sum(),
+            daft.col("lines_modified").sum(),
+            daft.col("files_changed").agg_concat(),
+            daft.col("message").agg_concat(),
+            daft.col("date").min().alias("first_commit"),
+            daft.col("date").max().alias("last_commit"),
+        ]
+    )
+    df.write_parquet(output_path)
+
+
+def run(command, output_path):
+    # seconds and peak RSS of one run in a subprocess
+    shutil.rmtree(output_path, ignore_errors=True)
+    start = time.time()
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _, status, usage = os.wait4(process.pid, 0)
+    if status:
+        raise RuntimeError(f"{command} failed")
+    return time.time() - start, usage.ru_maxrss * 1024
+
+
+def output_stats(path):
+    table = pq.read_table(path, columns=["message", "files_changed", "commit_count"])
+    messages = [len(m) for m in table.column("message").to_pylist()]
+    files = [len(f) for f in table.column("files_changed").to_pylist()]
+    disk = sum(os.path.getsize(f) for f in glob.glob(os.path.join(path, "*.parquet")))
+    return table.num_rows, max(messages), max(files), disk
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repos", type=int, default=10)
+    parser.add_argument("--commits-per-repo", type=int, default=20_000)
+    parser.add_argument("--authors", type=int, default=5, help="Authors per repo")
+    parser.add_argument("--repeat", type=int, default=2)
+    parser.add_argument("--generate", type=str, help=argparse.SUPPRESS)
+    parser.add_argument("--unbounded", nargs=2, metavar=("INPUT", "OUTPUT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.generate:
+        write_commits(args.generate, args.repos, args.commits_per_repo, args.authors)
+        sys.exit()
+    if args.unbounded:
+        unbounded_groupby(*args.unbounded)
+        sys.exit()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        commits_path = os.path.join(tmp, "raw_commits")
+        os.makedirs(commits_path)
+        # in a subprocess, a child forked from a big parent starts out with the parent's RSS
+        subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--generate", commits_path, "--repos", str(args.repos),
+             "--commits-per-repo", str(args.commits_per_repo), "--authors", str(args.authors)],
+            check=True,
+        )
+        print(f"{args.repos} repos x {args.commits_per_repo:,} commits, {args.authors} authors per repo")
+        runs = [
+            ("agg_concat groupby", [sys.executable, os.path.abspath(__file__), "--unbounded", commits_path]),
+            (
+                "bounded aggregation",
+                [sys.executable, os.path.join(ROOT, "5_Extract_contributors", "extract_contributors.py"),
+                 "--input-path", commits_path, "--write-to-file", "--output-path"],
+            ),
+        ]
+        # every run before reading any output, so the parent is still small when it forks
+        results = {}
+        for label, command in runs:
+            output_path = os.path.join(tmp, label.replace(" ", "_"))
+            results[label] = [run(command + [output_path], output_path) for _ in range(args.repeat)]
+        for label, _ in runs:
+            rows, message, files, disk = output_stats(os.path.join(tmp, label.replace(" ", "_")))
+            print(
+                f"{label:>20}: {min(s for s, _ in results[label]):5.1f}s, "
+                f"peak RSS {max(r for _, r in results[label]) / 1e6:5.0f} MB, "
+                f"{rows} contributors, largest message {message / 1e6:5.2f} MB, largest file list {files}, "
+                f"{disk / 1e6:5.1f} MB parquet"
+            )
+    finally:
+        shutil.rmtree(tmp)
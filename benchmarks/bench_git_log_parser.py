@@ -0,0 +1,270 @@
+import argparse
+import os
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+import pyarrow as pa
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "4_Extract_commits"))
+from git_log_parser import LOG_ARGS_Z, columns_to_arrays, parse_log_z  # noqa: E402
+from git_log_stream import READ_SIZE  # noqa: E402
+
+# Compares parse_logs on the sentinel `git log` format with the NUL-delimited bytes
+# parser on `git log -z --numstat`, on the same synthetic history or on a real repo.
+# Commits/sec is the best of --repeat runs without tracemalloc, peak memory is
+# measured in a separate run with it. Arrow buffers aren't seen by tracemalloc, the
+# arrow column shows what the parsed result holds in pyarrow's memory pool.
+
+SENTINEL_FORMAT = "--pretty=format:---COMMIT START---%n%H%n%an%n%ae%n%ai%n%B%n---COMMIT END---"
+WORDS = "fix add remove update refactor parser cache test docs build release bump handle error path config".split()
+
+
+def synthetic_commits(n, seed=0):
+    rng = random.Random(seed)
+    authors = [(f"Author {i}", f"author{i}@example.com") for i in range(max(1, n // 50))]
+    paths = [f"src/module_{i // 20}/file_{i}.py" for i in range(2000)]
+    date = datetime(2015, 1, 1, tzinfo=timezone(timedelta(hours=-7)))
+    commits = []
+    for i in range(n):
+        date += timedelta(seconds=rng.randint(60, 20000))
+        subject = " ".join(rng.choices(WORDS, k=rng.randint(3, 8))).capitalize()
+        body = ["", " ".join(rng.choices(WORDS, k=rng.randint(5, 30)))] if rng.random() < 0.4 else []
+        stats = []
+        for path in rng.sample(paths, rng.randint(1, 12)):
+            binary = rng.random() < 0.03
+            stats.append(("-" if binary else str(rng.randint(0, 200)), "-" if binary else str(rng.randint(0, 80)), path))
+        commits.append(
+            dict(
+                hash=f"{rng.getrandbits(160):040x}",
+                author=rng.choice(authors),
+                date=date,
+                message="\n".join([subject] + body) + "\n",
+                stats=stats,
+            )
+        )
+    return commits
+
+
+# the parser stage 4 used before it streamed `git log -z`, kept as the baseline
+def safe_encode(text):
+    if isinstance(text, str):
+        return text.encode("utf-8", "replace").decode("utf-8")
+    return text
+
+
+def parse_logs(logs):
+    commits = []
+    current_commit = None
+
+    lines = logs.split("\n")
+    i = 0
+
+    while i < len(lines):
+        line = lines[i]
+        # Start of a new commit
+        if line == "---COMMIT START---":
+            current_commit = {}
+            i += 1
+            continue
+
+        # End of current commit
+        elif line == "---COMMIT END---":
+            # Look ahead for file stats before next commit
+            file_stats = []
+            j = i + 1
+
+            while (
+                j < len(lines)
+                and lines[j] != "---COMMIT START---"
+                and lines[j] != "---COMMIT END---"
+            ):
+                parts = lines[j].strip().split("\t")
+                if len(parts) >= 3:
+                    file_stats.append(parts)
+                j += 1
+
+            # Process file stats for current commit
+            if current_commit:
+                lines_added = 0
+                lines_deleted = 0
+                lines_modified = 0
+                files_changed = []
+
+                for file_stat in file_stats:
+                    try:
+                        added = int(file_stat[0]) if file_stat[0] != "-" else 0
+                        deleted = int(file_stat[1]) if file_stat[1] != "-" else 0
+                        lines_added += added
+                        lines_deleted += deleted
+                        lines_modified += added + deleted
+                        files_changed.append(file_stat[2])
+                    except ValueError:
+                        continue
+
+                current_commit["lines_added"] = lines_added
+                current_commit["lines_deleted"] = lines_deleted
+                current_commit["lines_modified"] = lines_modified
+                current_commit["files_changed"] = files_changed
+
+                safe_encoded_commit = {
+                    k: safe_encode(v) for k, v in current_commit.items()
+                }
+                commits.append(safe_encoded_commit)
+
+            # Skip processed file stats
+            i = j
+            continue
+
+        # Parse commit details
+        elif current_commit is not None:
+            # Hash
+            if "hash" not in current_commit:
+                current_commit["hash"] = line.strip()
+            # Author name
+            elif "author_name" not in current_commit:
+                current_commit["author_name"] = line.strip()
+            # Author email
+            elif "author_email" not in current_commit:
+                current_commit["author_email"] = line.strip()
+            # Date
+            elif "date" not in current_commit:
+                try:
+                    dt = datetime.strptime(line.strip(), "%Y-%m-%d %H:%M:%S %z")
+                    current_commit["date"] = dt
+                except ValueError:
+                    # Handle potential date format issues
+                    current_commit["date"] = None
+            # Commit message
+            elif "message" not in current_commit:
+                message_lines = [line]
+                i += 1
+
+                while i < len(lines) and lines[i] != "---COMMIT END---":
+                    message_lines.append(lines[i])
+                    i += 1
+
+                # Join message lines, handling empty messages
+                if len(message_lines) > 1:
+                    message = message_lines[0] + "\n" + "\n".join(message_lines[1:])
+                else:
+                    message = message_lines[0]
+
+                current_commit["message"] = message
+
+                i -= 1  # Adjust index since we'll increment at the end of the loop
+
+        i += 1
+
+    return commits
+
+
+def render_sentinel(commits):
+    out = []
+    for c in commits:
+        out.append(
+            f"---COMMIT START---\n{c['hash']}\n{c['author'][0]}\n{c['author'][1]}\n"
+            f"{c['date'].strftime('%Y-%m-%d %H:%M:%S %z')}\n{c['message']}\n---COMMIT END---\n"
+        )
+        if c["stats"]:
+            out.append("\n" + "".join(f"{a}\t{d}\t{p}\n" for a, d, p in c["stats"]))
+    return "".join(out).rstrip("\n")
+
+
+def render_z(commits):
+    out = []
+    for c in commits:
+        out.append(f"{c['hash']}\0{c['author'][0]}\0{c['author'][1]}\0{int(c['date'].timestamp())}\0{c['message']}\0")
+        if c["stats"]:
+            out.append("\n" + "".join(f"{a}\t{d}\t{p}\0" for a, d, p in c["stats"]))
+    return "".join(out).encode()
+
+
+def repo_logs(path):
+    sentinel = subprocess.run(["git", "-C", path, "log", SENTINEL_FORMAT, "--date=iso", "--numstat"], capture_output=True, check=True)
+    z = subprocess.run(["git", "-C", path, "log", *LOG_ARGS_Z], capture_output=True, check=True)
+    return sentinel.stdout.decode("utf-8", "replace"), z.stdout
+
+
+def chunks(data):
+    # what git_log_chunks reads from the pipe
+    return (data[i : i + READ_SIZE] for i in range(0, len(data), READ_SIZE))
+
+
+def parse_columns(data):
+    # everything in one set of columns, the shape parse_logs returns
+    return next(parse_log_z(chunks(data), batch_size=sys.maxsize), None)
+
+
+def parse_arrow(data):
+    return [columns_to_arrays(columns) for columns in parse_log_z(chunks(data), batch_size=sys.maxsize)]
+
+
+def stream_arrow(data, batch_size=10_000):
+    # like stage 4: every batch is converted and dropped before the next one is parsed
+    n = 0
+    for columns in parse_log_z(chunks(data), batch_size):
+        n += len(columns_to_arrays(columns)["hash"])
+    return n
+
+
+def measure(fn, data, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(data)
+        times.append(time.perf_counter() - start)
+        del result
+    arrow_before = pa.total_allocated_bytes()
+    tracemalloc.start()
+    result = fn(data)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    arrow = pa.total_allocated_bytes() - arrow_before
+    del result
+    return min(times), peak, arrow
+
+
+def check_same(sentinel, z):
+    old = parse_logs(sentinel)
+    new = parse_columns(z)
+    new_files = new["files_changed"]
+    offsets = new["file_offsets"]
+    for i, commit in enumerate(old):
+        assert commit["hash"] == new["hash"][i].decode()
+        assert commit["author_email"] == new["author_email"][i].decode()
+        assert int(commit["date"].timestamp()) == int(new["date"][i])
+        assert commit["lines_added"] == new["lines_added"][i] and commit["lines_deleted"] == new["lines_deleted"][i]
+        assert commit["files_changed"] == [path.decode() for path in new_files[offsets[i] : offsets[i + 1]]]
+    assert len(old) == len(new["hash"])
+    return len(old)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--commits", type=int, default=100_000)
+    parser.add_argument("--repo", type=str, default=None, help="Benchmark the log of a local git repo instead of a synthetic one")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.repo:
+        sentinel, z = repo_logs(args.repo)
+    else:
+        commits = synthetic_commits(args.commits)
+        sentinel, z = render_sentinel(commits), render_z(commits)
+        del commits
+    n = check_same(sentinel, z)
+    print(f"{n:,} commits, {len(sentinel.encode()) / 1e6:.1f} MB sentinel log, {len(z) / 1e6:.1f} MB -z log, same results")
+
+    runs = [
+        ("parse_logs (dicts)", parse_logs, sentinel),
+        ("-z parser (columns)", parse_columns, z),
+        ("-z parser + arrow", parse_arrow, z),
+        ("-z streaming, 10k batches", stream_arrow, z),
+    ]
+    for label, fn, data in runs:
+        elapsed, peak, arrow = measure(fn, data, args.repeat)
+        print(f"{label:>26}: {n / elapsed:>10,.0f} commits/sec, peak {peak / 1e6:7.1f} MB python, {arrow / 1e6:6.1f} MB arrow held")
@@ -0,0 +1,50 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from fake_github_api import FakeGithub, generate_repos, start_server
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "1_Search_for_repos"))
+
+
+def run_search(client, query, limit):
+    repos = client.search_repositories(query=query, sort="stars", order="desc")
+    return [repo.clone_url for repo in repos[: min(limit, repos.totalCount)]]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-repos", type=int, default=20000)
+    parser.add_argument("--query", type=str, default="language:rust")
+    parser.add_argument("--limit", type=int, default=1000)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        os.environ["GITHUB_HTTP_CACHE_PATH"] = os.path.join(temp_dir, "cache.sqlite")
+        from github import Auth, Github
+        from github_cache import get_cache, install_http_cache
+
+        install_http_cache()
+        fake = FakeGithub(generate_repos(args.num_repos), search_limit=10000, latency=args.latency)
+        server, url = start_server(fake)
+        client = Github(auth=Auth.Token("fake"), per_page=100, base_url=url)
+        cache = get_cache()
+
+        for run in range(args.runs):
+            cache.reset_stats()
+            fake.requests = fake.not_modified = 0
+            start = time.time()
+            urls = run_search(client, args.query, args.limit)
+            elapsed = time.time() - start
+            stats = cache.stats()
+            print(
+                f"run {run}: {len(urls)} repos in {elapsed:.2f}s, "
+                f"{fake.requests - fake.not_modified} quota-charged requests, "
+                f"{stats['hits']} cache hits, {stats['misses']} misses, "
+                f"{stats['entries']} entries ({stats['size_bytes'] / 1024:.0f} KiB)"
+            )
+        server.shutdown()
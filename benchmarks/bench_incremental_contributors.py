@@ -0,0 +1,96 @@
+import argparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import daft
+import pyarrow.parquet as pq
+
+from bench_git_log_parser import render_z, synthetic_commits
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "4_Extract_commits"))
+from git_log_stream import commit_batches, output_file, repo_columns, write_batches  # noqa: E402
+
+# Aggregates synthetic raw_commits with stage 5, adds delta files of new commits to some
+# of the repos the way incremental stage 4 runs do, then brings the output up to date
+# incrementally and with --full-rescan. Reports the time of each run, the contributors
+# each one lists as changed, and whether both give stage 6 the same aggregates.
+
+STAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "5_Extract_contributors", "extract_contributors.py")
+KEYS = ["repo_owner", "repo_name", "author_email"]
+# once a contributor has more distinct files than the sketch holds, the two runs prune
+# its tail at different points, the columns stage 6 reads still match
+SKETCH_COLUMNS = ["file_sketch", "file_counts", "message_dates", "message_lengths"]
+
+
+def repo_commits(i, commits, delta, authors):
+    # the repo's history, oldest first, split into what the first run sees and the delta
+    history = synthetic_commits(commits + delta, seed=i)
+    rng = random.Random(i)
+    people = [(f"Author {i}-{a}", f"author{i}-{a}@example.com") for a in range(authors)]
+    for commit in history:
+        commit["author"] = rng.choice(people)
+    return history[:commits], history[commits:]
+
+
+def write_repo(path, i, commits, delta=None):
+    url = f"https://github.com/some-organization/some-project-{i}"
+    values = repo_columns(f"some-project-{i}", "some-organization", url)
+    # git log order, newest first
+    write_batches(commit_batches([render_z(commits[::-1])], values), output_file(path, url, delta))
+
+
+def run(*args):
+    start = time.time()
+    subprocess.run([sys.executable, STAGE, *args], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.time() - start
+
+
+def read_rows(path):
+    rows = daft.read_parquet(path).exclude(*SKETCH_COLUMNS).to_arrow().to_pylist()
+    return {tuple(row[name] for name in KEYS): row for row in rows}
+
+
+def changed(output_path):
+    return {tuple(row[name] for name in KEYS) for row in pq.read_table(f"{output_path}_changed.parquet").to_pylist()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repos", type=int, default=200)
+    parser.add_argument("--commits-per-repo", type=int, default=5_000)
+    parser.add_argument("--authors", type=int, default=10, help="Authors per repo")
+    parser.add_argument("--changed-repos", type=float, default=0.1, help="Fraction of repos with new commits")
+    parser.add_argument("--new-commits", type=int, default=20, help="New commits per changed repo")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        commits_path = os.path.join(tmp, "raw_commits")
+        os.makedirs(commits_path)
+        deltas = {}
+        for i in range(args.repos):
+            history, deltas[i] = repo_commits(i, args.commits_per_repo, args.new_commits, args.authors)
+            write_repo(commits_path, i, history)
+        incremental, full = os.path.join(tmp, "incremental"), os.path.join(tmp, "full")
+        first = run("--input-path", commits_path, "--write-to-file", "--output-path", incremental)
+        shutil.copytree(incremental, full)
+
+        updated = random.Random(0).sample(range(args.repos), int(args.repos * args.changed_repos))
+        for i in updated:
+            write_repo(commits_path, i, deltas[i], delta=f"{i:012x}")
+        print(
+            f"{args.repos} repos x {args.commits_per_repo:,} commits, {args.authors} authors per repo, "
+            f"{len(updated)} repos with {args.new_commits} new commits"
+        )
+        print(f"{'first run':>12}: {first:5.1f}s")
+        for label, path, extra in [("incremental", incremental, []), ("full rescan", full, ["--full-rescan"])]:
+            seconds = run("--input-path", commits_path, "--write-to-file", "--output-path", path, *extra)
+            print(f"{label:>12}: {seconds:5.1f}s, {len(changed(path))} contributors changed")
+        print(f"same aggregates: {read_rows(incremental) == read_rows(full)}, same changed list: {changed(incremental) == changed(full)}")
+    finally:
+        shutil.rmtree(tmp)
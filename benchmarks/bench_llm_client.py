@@ -0,0 +1,118 @@
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+import instructor
+from openai import AsyncOpenAI
+from pydantic import BaseModel
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_utils.llm_clients import BackgroundLoop, make_http_client  # noqa: E402
+
+
+class ProjectAnalysis(BaseModel):
+    languages: list[str]
+    keywords: list[str]
+
+
+async def analyze_batch(client, batch, max_concurrent_requests):
+    semaphore = asyncio.Semaphore(max_concurrent_requests)
+
+    async def analyze(i):
+        async with semaphore:
+            return await client.chat.completions.create(
+                model="fake",
+                messages=[{"role": "user", "content": f"Analyze repo {i}"}],
+                max_tokens=256,
+                response_model=ProjectAnalysis,
+            )
+
+    return await asyncio.gather(*[analyze(i) for i in batch])
+
+
+def start_fake_server(latency, connect_latency, tls, extra_args=()):
+    # in its own process so the server doesn't compete with the client for the GIL
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    command = [
+        sys.executable,
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_openai_api.py"),
+        "--port", str(port),
+        "--latency", str(latency),
+        "--connect-latency", str(connect_latency),
+    ]
+    process = subprocess.Popen(command + (["--tls"] if tls else []) + list(extra_args), stdout=subprocess.DEVNULL)
+    url = f"{'https' if tls else 'http'}://127.0.0.1:{port}/v1"
+    for _ in range(100):
+        try:
+            httpx.get(f"{url}/stats", verify=False)
+            return process, url
+        except httpx.TransportError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("fake OpenAI server did not start")
+
+
+def server_stats(url):
+    return httpx.get(f"{url}/stats", verify=False).json()
+
+
+def per_batch_client(url, batches, max_concurrent_requests):
+    # the previous UDFs: a new client, connection pool and event loop for every batch
+    for batch in batches:
+        client = instructor.from_openai(
+            AsyncOpenAI(api_key="fake", base_url=url, http_client=httpx.AsyncClient(verify=False))
+        )
+        asyncio.run(analyze_batch(client, batch, max_concurrent_requests))
+
+
+def long_lived_client(url, batches, max_concurrent_requests):
+    loop = BackgroundLoop()
+    http_client = make_http_client(max_concurrent_requests, verify=False)
+    client = instructor.from_openai(AsyncOpenAI(api_key="fake", base_url=url, http_client=http_client))
+    for batch in batches:
+        loop.run(analyze_batch(client, batch, max_concurrent_requests))
+    loop.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--max-concurrent-requests", type=int, default=64)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--connect-latency", type=float, default=0.1, help="Simulated TCP + TLS round trips per new connection")
+    parser.add_argument("--no-tls", action="store_true")
+    args = parser.parse_args()
+
+    process, url = start_fake_server(args.latency, args.connect_latency, not args.no_tls)
+    rows = list(range(args.rows))
+    batches = [rows[i : i + args.batch_size] for i in range(0, len(rows), args.batch_size)]
+    print(
+        f"{len(rows)} rows in {len(batches)} batches of {args.batch_size}, {args.latency * 1000:.0f}ms mock latency, "
+        f"{args.connect_latency * 1000:.0f}ms per new connection, {'HTTP' if args.no_tls else 'HTTPS'}"
+    )
+
+    try:
+        for label, run in (
+            ("client + event loop per batch", per_batch_client),
+            ("long-lived client + loop", long_lived_client),
+        ):
+            before = server_stats(url)
+            start = time.time()
+            run(url, batches, args.max_concurrent_requests)
+            elapsed = time.time() - start
+            after = server_stats(url)
+            print(
+                f"{label:>30}: {elapsed:.2f}s, {len(rows) / elapsed:,.0f} rows/sec, "
+                f"{elapsed / len(batches) * 1000:.0f}ms per batch, {after['requests'] - before['requests']} requests over "
+                f"{after['connections'] - before['connections'] - 1} connections"
+            )
+    finally:
+        process.kill()
@@ -0,0 +1,119 @@
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from git import Repo
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "2_Extract_readmes"))
+from extract_readme import extract_readme, extract_readme_async, readme_patterns  # noqa: E402
+
+README_NAMES = ["README.md", "readme.md", "Readme.md", "README.rst", "README", "docs/README.md", "README.txt", None]
+
+
+def extract_readme_sparse_checkout(url):
+    # the previous implementation: sparse clone, then probe every pattern on disk
+    with tempfile.TemporaryDirectory() as temp_dir:
+        try:
+            Repo.clone_from(url, to_path=temp_dir, multi_options=["--sparse"])
+        except Exception:
+            return None
+        if not os.listdir(temp_dir):
+            return None
+        try:
+            for pattern in readme_patterns:
+                readme_path = os.path.join(temp_dir, pattern)
+                if os.path.exists(readme_path):
+                    with open(readme_path, "r") as f:
+                        return f.read().encode("utf-8", "replace").decode("utf-8")
+        except Exception:
+            return None
+    return None
+
+
+def git(cwd, *args):
+    subprocess.run(["git", *args], cwd=cwd, check=True, capture_output=True)
+
+
+def make_repo(path, rng, commits, files, blob_kb):
+    os.makedirs(path)
+    git(path, "init", "-q", "-b", "main")
+    # needed for --filter and on-demand blob fetches over file://
+    git(path, "config", "uploadpack.allowFilter", "true")
+    git(path, "config", "uploadpack.allowAnySHA1InWant", "true")
+    readme = rng.choice(README_NAMES)
+    for c in range(commits):
+        for f in range(files):
+            file_path = os.path.join(path, "src", f"file_{f}.bin")
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, "wb") as out:
+                out.write(rng.randbytes(blob_kb * 1024))
+        if readme:
+            readme_path = os.path.join(path, readme)
+            os.makedirs(os.path.dirname(readme_path), exist_ok=True)
+            with open(readme_path, "w") as out:
+                out.write(f"# {os.path.basename(path)}\n\nRevision {c}\n")
+        git(path, "add", "-A")
+        git(path, "-c", "user.name=bench", "-c", "user.email=bench@example.com", "commit", "-q", "-m", f"commit {c}")
+
+
+def dir_size(path):
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, fs in os.walk(path) for f in fs)
+
+
+def measure_transfer(url, multi_options):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        Repo.clone_from(url, to_path=temp_dir, multi_options=multi_options)
+        return dir_size(temp_dir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-repos", type=int, default=20)
+    parser.add_argument("--commits", type=int, default=5)
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--blob-kb", type=int, default=64)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as corpus:
+        print(f"Building {args.num_repos} repos with {args.commits} commits of {args.files} x {args.blob_kb} KiB files")
+        urls = []
+        for i in range(args.num_repos):
+            path = os.path.join(corpus, f"repo_{i}")
+            make_repo(path, rng, args.commits, args.files, args.blob_kb)
+            urls.append(f"file://{path}")
+
+        results = {}
+        for label, fn, options in (
+            ("sparse checkout + os.path.exists", extract_readme_sparse_checkout, ["--sparse"]),
+            ("blobless ls-tree + cat-file", extract_readme, ["--filter=blob:none", "--no-checkout", "--depth=1"]),
+        ):
+            start = time.time()
+            results[label] = [fn(url) for url in urls]
+            elapsed = time.time() - start
+            on_disk = sum(measure_transfer(url, options) for url in urls)
+            found = sum(r is not None for r in results[label])
+            print(
+                f"{label:>34}: {found}/{len(urls)} READMEs, {elapsed:.2f}s, "
+                f"{len(urls) / elapsed:.1f} repos/sec, {on_disk / len(urls) / 1024:.0f} KiB cloned per repo"
+            )
+
+        async def run_async_pool():
+            network, disk = asyncio.Semaphore(32), asyncio.Semaphore(8)
+            return await asyncio.gather(*[extract_readme_async(url, network, disk) for url in urls])
+
+        start = time.time()
+        async_results = asyncio.run(run_async_pool())
+        elapsed = time.time() - start
+        found = sum(r["readme"] is not None for r in async_results)
+        print(f"{'asyncio subprocess pool':>34}: {found}/{len(urls)} READMEs, {elapsed:.2f}s, {len(urls) / elapsed:.1f} repos/sec")
+
+        # --sparse only checks out top-level files, so the old lookup misses docs/ READMEs
+        old, new = results.values()
+        both = [(a, b) for a, b in zip(old, new) if a is not None]
+        print(f"Identical READMEs where the old lookup found one: {sum(a == b for a, b in both)}/{len(both)}")
@@ -0,0 +1,107 @@
+import argparse
+import glob
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "3_Analyze_repos"))
+from readme_text import TOKEN_COUNTER, compact_readme, count_tokens, readme_to_text  # noqa: E402
+
+MARKDOWN_SECTIONS = [
+    "## Installation\n\n```bash\npip install {name}\n```\n",
+    "## Usage\n\n```python\nimport {name}\n\n{name}.run(config=\"config.yaml\")\n```\n",
+    "[![Build](https://img.shields.io/badge/build-passing-green.svg)](https://ci.example.com/{name}) "
+    "[![PyPI](https://img.shields.io/pypi/v/{name}.svg)](https://pypi.org/project/{name})\n",
+    "<p align=\"center\"><img src=\"docs/logo.png\" width=\"200\"/></p>\n<!-- badges -->\n",
+    "## Features\n\n- **Fast** parsing of `{name}` files\n- *Streaming* API, see [the docs](https://{name}.readthedocs.io)\n- Works with [numpy][np]\n\n[np]: https://numpy.org\n",
+    "| Option | Default | Description |\n|--------|---------|-------------|\n| `--workers` | 4 | Worker count |\n| `--verbose` | false | Print more |\n",
+    "> **Note**\n> {name} is still in beta, expect breaking changes.\n",
+    "## License\n\nMIT &copy; {name} contributors, see <https://opensource.org/licenses/MIT>.\n",
+]
+
+RST_SECTIONS = [
+    "Installation\n============\n\n.. code-block:: bash\n   :linenos:\n\n   pip install {name}\n",
+    ".. image:: https://img.shields.io/pypi/v/{name}.svg\n   :target: https://pypi.org/project/{name}\n   :alt: PyPI\n",
+    "Usage\n-----\n\nCall :func:`{name}.run` with ``config.yaml``, see `the docs <https://{name}.readthedocs.io>`_::\n\n    {name}.run()\n",
+    ".. note::\n\n   {name} is still in **beta**.\n",
+    "Links\n-----\n\n* `Source`_\n* |badge|\n\n.. _Source: https://github.com/example/{name}\n.. |badge| image:: https://example.com/badge.svg\n",
+]
+
+
+def synthetic_corpus(n, seed=0):
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(n):
+        name = f"project{i}"
+        if rng.random() < 0.8:
+            sections = [f"# {name}\n\nA library for [doing things](https://example.com/{name}) quickly.\n"]
+            sections += rng.choices(MARKDOWN_SECTIONS, k=rng.randint(3, 12))
+        else:
+            sections = [f"{name}\n{'=' * len(name)}\n\nA library for doing things quickly.\n"]
+            sections += rng.choices(RST_SECTIONS, k=rng.randint(3, 10))
+        corpus.append("\n".join(s.format(name=name) for s in sections))
+    return corpus
+
+
+def load_corpus(args):
+    if args.input_path:
+        import daft
+
+        return [r for r in daft.read_parquet(args.input_path).to_pydict()["readme"] if r][: args.limit]
+    if args.readme_dir:
+        paths = sorted(
+            glob.glob(os.path.join(args.readme_dir, "**", "README*.md"), recursive=True)
+            + glob.glob(os.path.join(args.readme_dir, "**", "README*.rst"), recursive=True)
+        )
+        corpus = []
+        for path in paths[: args.limit]:
+            with open(path, errors="replace") as f:
+                corpus.append(f.read())
+        return corpus
+    return synthetic_corpus(args.limit)
+
+
+def report(label, corpus, outputs, elapsed):
+    tokens_in = sum(count_tokens(r) for r in corpus)
+    tokens_out = sum(count_tokens(r) for r in outputs)
+    print(
+        f"{label:>28}: {len(corpus)} READMEs in {elapsed:.2f}s, {len(corpus) / elapsed:,.0f} rows/sec, "
+        f"{tokens_in:,} -> {tokens_out:,} tokens ({tokens_out / max(tokens_in, 1):.0%})"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input-path", type=str, default=None, help="Parquet with a readme column (stage 2 output)")
+    parser.add_argument("--readme-dir", type=str, default=None, help="Directory to collect README*.md/rst files from")
+    parser.add_argument("--limit", type=int, default=2000)
+    parser.add_argument("--pandoc-limit", type=int, default=200, help="pandoc is slow, only convert this many")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--readme-max-tokens", type=int, default=2048)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args)
+    print(f"Loaded {len(corpus)} READMEs, tokens counted as {TOKEN_COUNTER}")
+
+    start = time.time()
+    outputs = [readme_to_text(r) for r in corpus]
+    report("in-process", corpus, outputs, time.time() - start)
+
+    start = time.time()
+    compacted = [compact_readme(r, args.readme_max_tokens)[0] for r in corpus]
+    report(f"compacted to {args.readme_max_tokens} tokens", corpus, compacted, time.time() - start)
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        start = time.time()
+        pooled = list(executor.map(readme_to_text, corpus, chunksize=16))
+        report(f"in-process, {args.workers} processes", corpus, pooled, time.time() - start)
+
+    sample = corpus[: args.pandoc_limit]
+    start = time.time()
+    pandoc_outputs = [readme_to_text(r, use_pandoc=True) for r in sample]
+    report("pandoc subprocess per row", sample, pandoc_outputs, time.time() - start)
+    ours = sum(count_tokens(r) for r in outputs[: len(sample)])
+    theirs = sum(count_tokens(r) for r in pandoc_outputs)
+    print(f"On the pandoc sample the in-process converter emits {ours:,} tokens vs {theirs:,} from pandoc")
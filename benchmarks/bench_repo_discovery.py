@@ -0,0 +1,65 @@
+import argparse
+import os
+import sys
+import time
+
+from github import Auth, Github
+
+from fake_github_api import FakeGithub, build_filter, generate_repos, start_server
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "1_Search_for_repos"))
+from sharded_search import RateLimitBudget, ShardedRepoSearch, repo_to_row  # noqa: E402
+
+
+def run_baseline(client, query, limit=None):
+    # mirrors get_repo_data: one paginated search, capped at 1000 results
+    repos = client.search_repositories(query=query, sort="stars", order="desc")
+    total_count = repos.totalCount
+    return [repo_to_row(repo) for repo in repos[: min(limit or total_count, total_count, 1000)]]
+
+
+def run_sharded(client_factory, query, max_workers, limit=None):
+    search = ShardedRepoSearch(client_factory, max_workers=max_workers, budget=RateLimitBudget())
+    return search.search(query, limit), search.budget.requests
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-repos", type=int, default=20000)
+    parser.add_argument("--query", type=str, default="language:rust")
+    parser.add_argument("--max-workers", type=int, default=8)
+    parser.add_argument("--search-limit", type=int, default=10000)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--limit", type=int, default=None)
+    args = parser.parse_args()
+
+    repos = generate_repos(args.num_repos)
+    matching = sum(1 for r in repos if build_filter(args.query)(r))
+    fake = FakeGithub(repos, search_limit=args.search_limit, latency=args.latency)
+    server, url = start_server(fake)
+
+    def client_factory():
+        return Github(auth=Auth.Token("fake"), per_page=100, base_url=url)
+
+    print(f"Benchmarking discovery of '{args.query}' ({matching} matching repos) against {url}")
+
+    start = time.time()
+    baseline = run_baseline(client_factory(), args.query, args.limit)
+    baseline_time = time.time() - start
+    baseline_requests = fake.requests
+
+    fake.requests = 0
+    start = time.time()
+    sharded, sharded_requests = run_sharded(client_factory, args.query, args.max_workers, args.limit)
+    sharded_time = time.time() - start
+    server.shutdown()
+
+    for label, rows, elapsed, requests in (
+        ("baseline", baseline, baseline_time, baseline_requests),
+        ("sharded", sharded, sharded_time, sharded_requests),
+    ):
+        unique = len({row["url"] for row in rows})
+        print(
+            f"{label:>8}: {unique} repos, coverage {unique / max(matching, 1):.1%}, "
+            f"{requests} requests, {elapsed:.2f}s, {unique / elapsed:.0f} repos/sec"
+        )
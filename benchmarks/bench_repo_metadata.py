@@ -0,0 +1,83 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+from github import Auth, Github
+
+from fake_github_api import FakeGithub, generate_repos, start_server as start_rest_server
+from github_graphql_standin import GraphQLStandIn, load_recording, start_server, write_synthetic_recording
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "1_Search_for_repos"))
+from graphql_metadata import GraphQLRepoFetcher  # noqa: E402
+
+
+def run_rest(client, repos):
+    # search results already carry size, default branch and language, the commit count is
+    # the field that costs a REST round trip per repo: one commit per page, read the last page
+    counts = []
+    for owner, name in repos:
+        repo = client.get_repo(f"{owner}/{name}")
+        counts.append(repo.get_commits().totalCount)
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-repos", type=int, default=20000)
+    parser.add_argument("--sample", type=int, default=2000)
+    parser.add_argument("--rest-sample", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--per-repo-latency", type=float, default=0.002)
+    parser.add_argument("--max-connections", type=int, default=8)
+    args = parser.parse_args()
+
+    all_repos = generate_repos(args.num_repos)
+    sample = [(r["owner"]["login"], r["name"]) for r in random.Random(1).sample(all_repos, args.sample)]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        recording = os.path.join(temp_dir, "recording.jsonl")
+        write_synthetic_recording(recording, args.num_repos)
+        nodes = load_recording(recording)
+        standin = GraphQLStandIn(nodes, latency=args.latency, per_repo_latency=args.per_repo_latency)
+        graphql_server, graphql_url = start_server(standin)
+
+    # serve the same commit counts over REST as the recording does over GraphQL
+    commit_counts = {
+        r["full_name"]: nodes[r["full_name"].lower()]["defaultBranchRef"]["target"]["history"]["totalCount"]
+        for r in all_repos
+    }
+    fake = FakeGithub(all_repos, latency=args.latency, commit_counts=commit_counts)
+    rest_server, rest_url = start_rest_server(fake)
+
+    # lazy, so get_repo doesn't spend a request on what the search result already has, and
+    # without PyGithub's 0.25s pause between requests so only the round trips are compared
+    client = Github(
+        auth=Auth.Token("fake"), per_page=100, base_url=rest_url, lazy=True, seconds_between_requests=None
+    )
+    start = time.time()
+    rest_counts = run_rest(client, sample[: args.rest_sample])
+    rest_time = time.time() - start
+    print(
+        f"    REST: commit counts of {args.rest_sample} repos, {fake.requests} requests, {rest_time:.2f}s, "
+        f"{args.rest_sample / rest_time:.0f} repos/sec"
+    )
+
+    for max_connections in sorted({1, args.max_connections}):
+        standin.requests = 0
+        fetcher = GraphQLRepoFetcher("fake", api_url=graphql_url, max_connections=max_connections)
+        start = time.time()
+        rows = fetcher.fetch(sample)
+        graphql_time = time.time() - start
+        found = sum(row is not None for row in rows)
+        same = [row["commit_count"] for row in rows[: args.rest_sample]] == rest_counts
+        print(
+            f" GraphQL: {found}/{len(sample)} repos, {standin.requests} requests, "
+            f"{max_connections} connections, {graphql_time:.2f}s, {len(sample) / graphql_time:.0f} repos/sec, "
+            f"same commit counts as REST: {same}"
+        )
+
+    rest_server.shutdown()
+    graphql_server.shutdown()
@@ -0,0 +1,77 @@
+import argparse
+import heapq
+import os
+import random
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_utils.scheduling import pack_partitions  # noqa: E402
+
+# Simulates clone + extraction runs over repos with heavy-tailed costs (most repos are
+# small, a few are huge) on a pool of workers that each take the next partition when
+# they are free. Compares the partitions into_partitions() gives in input order with
+# longest-first packing, both with exact costs and with noisy estimates of them.
+
+
+def repo_seconds(n, seed):
+    rng = random.Random(seed)
+    # pareto tail, like GitHub repo sizes: a median repo takes ~2s, the largest minutes
+    return [min(1.0 + rng.paretovariate(1.1), 2000.0) for _ in range(n)]
+
+
+def count_partitions(n, num_partitions):
+    # into_partitions(): contiguous slices of equal row count, in input order
+    size, extra = divmod(n, num_partitions)
+    bounds, start = [], 0
+    for i in range(num_partitions):
+        end = start + size + (i < extra)
+        bounds.append(list(range(start, end)))
+        start = end
+    return [indices for indices in bounds if indices]
+
+
+def simulate(partitions, seconds, workers):
+    # (makespan, busy seconds per worker) when workers pull partitions in order
+    free = [(0.0, worker) for worker in range(workers)]
+    busy = [0.0] * workers
+    for indices in partitions:
+        at, worker = heapq.heappop(free)
+        cost = sum(seconds[i] for i in indices)
+        busy[worker] += cost
+        heapq.heappush(free, (at + cost, worker))
+    return max(at for at, _ in free), busy
+
+
+def report(label, partitions, seconds, workers, bound):
+    makespan, busy = simulate(partitions, seconds, workers)
+    utilization = [b / makespan for b in busy]
+    print(
+        f"{label:>32}: makespan {makespan:8.1f}s ({makespan / bound:4.2f}x lower bound), "
+        f"utilization mean {sum(utilization) / workers:4.0%} min {min(utilization):4.0%}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repos", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=10)
+    parser.add_argument("--partitions", type=int, default=1024, help="--partition-size of the stage")
+    parser.add_argument("--noise", type=float, default=0.5, help="lognormal sigma of the cost estimates")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    seconds = repo_seconds(args.repos, args.seed)
+    rng = random.Random(args.seed + 1)
+    estimates = [s * rng.lognormvariate(0, args.noise) for s in seconds]
+    bound = max(sum(seconds) / args.workers, max(seconds))
+    print(
+        f"{args.repos} repos, {sum(seconds):.0f}s of work, largest {max(seconds):.0f}s, "
+        f"{args.workers} workers, lower bound {bound:.0f}s"
+    )
+
+    report(f"input order, {args.partitions} partitions", count_partitions(args.repos, args.partitions), seconds, args.workers, bound)
+    report("input order, one repo at a time", count_partitions(args.repos, args.repos), seconds, args.workers, bound)
+    for label, costs in [("exact", seconds), (f"estimated (sigma {args.noise})", estimates)]:
+        packed = [indices for _, indices in pack_partitions(costs, args.partitions)]
+        report(f"packed, {label}", packed, seconds, args.workers, bound)
+        report(f"largest first, {label}", [[i] for _, indices in pack_partitions(costs, 1) for i in indices], seconds, args.workers, bound)
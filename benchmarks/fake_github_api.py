@@ -0,0 +1,279 @@
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+# A small stand-in for the parts of the GitHub REST API the pipeline touches, so
+# repo discovery can be benchmarked offline. It mimics the behaviour that matters
+# for throughput and coverage: the 1000-result search cap, Link pagination, ETag
+# revalidation and the X-RateLimit-* headers of the search quota.
+
+LANGUAGES = ["rust", "python", "go", "typescript", "c++", "java"]
+WORDS = ["fast", "async", "database", "parser", "web", "cli", "compiler", "engine", "ml", "graph"]
+SEARCH_RESULT_CAP = 1000
+
+
+def generate_repos(n, seed=0):
+    rng = random.Random(seed)
+    start = date(2008, 1, 1).toordinal()
+    end = date(2025, 3, 1).toordinal()
+    repos = []
+    for i in range(n):
+        owner = f"owner{rng.randrange(n // 4 + 1)}"
+        name = f"{rng.choice(WORDS)}-{rng.choice(WORDS)}-{i}"
+        created = date.fromordinal(rng.randrange(start, end))
+        updated = date.fromordinal(rng.randrange(created.toordinal(), end + 1))
+        repos.append(
+            {
+                "id": i + 1,
+                "name": name,
+                "full_name": f"{owner}/{name}",
+                "owner": {"login": owner, "id": i + 1, "type": "User"},
+                "description": f"A {rng.choice(WORDS)} {rng.choice(WORDS)} library",
+                # star counts on GitHub are roughly Pareto distributed
+                "stargazers_count": int(rng.paretovariate(1.1)) - 1,
+                "language": rng.choice(LANGUAGES),
+                "size": rng.randrange(10, 500_000),
+                "default_branch": "main",
+                "created_at": f"{created.isoformat()}T12:00:00Z",
+                "updated_at": f"{updated.isoformat()}T12:00:00Z",
+                "pushed_at": f"{updated.isoformat()}T12:00:00Z",
+            }
+        )
+    return repos
+
+
+def parse_range(value, convert):
+    if ".." in value:
+        lo, hi = value.split("..", 1)
+        return (
+            convert(lo) if lo not in ("", "*") else None,
+            convert(hi) if hi not in ("", "*") else None,
+        )
+    for op in (">=", "<=", ">", "<"):
+        if value.startswith(op):
+            bound = convert(value[len(op):])
+            if op == ">":
+                return bound + (1 if isinstance(bound, int) else timedelta(days=1)), None
+            if op == "<":
+                return None, bound - (1 if isinstance(bound, int) else timedelta(days=1))
+            return (bound, None) if op == ">=" else (None, bound)
+    bound = convert(value)
+    return bound, bound
+
+
+def in_range(value, bounds):
+    lo, hi = bounds
+    return (lo is None or value >= lo) and (hi is None or value <= hi)
+
+
+def build_filter(query):
+    filters = []
+    for token in query.split():
+        key, _, value = token.partition(":")
+        if not value:
+            word = token.lower()
+            filters.append(lambda r, w=word: w in r["name"] or w in (r["description"] or "").lower())
+        elif key == "stars":
+            bounds = parse_range(value, int)
+            filters.append(lambda r, b=bounds: in_range(r["stargazers_count"], b))
+        elif key == "created":
+            bounds = parse_range(value, date.fromisoformat)
+            filters.append(lambda r, b=bounds: in_range(date.fromisoformat(r["created_at"][:10]), b))
+        elif key == "language":
+            filters.append(lambda r, v=value.lower(): r["language"] == v)
+    return lambda r: all(f(r) for f in filters)
+
+
+class FakeGithub:
+    def __init__(self, repos, search_limit=30, core_limit=5000, window=60.0, latency=0.0, commit_counts=None):
+        self.repos = repos
+        # full_name -> commits on the default branch, defaults to one per 20 KB of repo
+        self.commit_counts = commit_counts or {}
+        self.search_limit = search_limit
+        self.core_limit = core_limit
+        self.window = window
+        self.latency = latency
+        self.requests = 0
+        self.not_modified = 0
+        self._quota = {}
+        self._lock = threading.Lock()
+
+    def take(self, resource, consume=True):
+        limit = self.search_limit if resource == "search" else self.core_limit
+        now = time.time()
+        with self._lock:
+            self.requests += 1
+            used, reset = self._quota.get(resource, (0, now + self.window))
+            if now >= reset:
+                used, reset = 0, now + self.window
+            allowed = used < limit
+            if allowed and consume:
+                used += 1
+            if not consume:
+                self.not_modified += 1
+            self._quota[resource] = (used, reset)
+        headers = {
+            "X-RateLimit-Limit": str(limit),
+            "X-RateLimit-Remaining": str(limit - used),
+            "X-RateLimit-Used": str(used),
+            "X-RateLimit-Reset": str(int(reset) + 1),
+            "X-RateLimit-Resource": resource,
+        }
+        return allowed, headers
+
+    def search(self, params):
+        query = params.get("q", [""])[0]
+        per_page = int(params.get("per_page", ["30"])[0])
+        page = int(params.get("page", ["1"])[0])
+        matches = [r for r in self.repos if build_filter(query)(r)]
+        matches.sort(key=lambda r: (-r["stargazers_count"], r["id"]))
+        if (page - 1) * per_page >= SEARCH_RESULT_CAP:
+            return 422, {"message": "Only the first 1000 search results are available"}, {}
+        reachable = matches[:SEARCH_RESULT_CAP]
+        items = reachable[(page - 1) * per_page : page * per_page]
+        headers = {}
+        if page * per_page < len(reachable):
+            next_params = dict(params, page=[str(page + 1)])
+            headers["Link"] = f'</search/repositories?{urlencode(next_params, doseq=True)}>; rel="next"'
+        body = {"total_count": len(matches), "incomplete_results": False, "items": items}
+        return 200, body, headers
+
+    def commits(self, repo, params):
+        # only what a per_page=1 request needs to read the count off the last page link
+        per_page = int(params.get("per_page", ["30"])[0])
+        page = int(params.get("page", ["1"])[0])
+        count = self.commit_counts.get(repo["full_name"], max(1, repo["size"] // 20))
+        first = (page - 1) * per_page
+        items = [{"sha": f"{i:040x}"} for i in range(first, min(first + per_page, count))]
+        pages = -(-count // per_page)
+        links = []
+        if page < pages:
+            links.append(f'</repos/{repo["full_name"]}/commits?per_page={per_page}&page={page + 1}>; rel="next"')
+            links.append(f'</repos/{repo["full_name"]}/commits?per_page={per_page}&page={pages}>; rel="last"')
+        return 200, items, {"Link": ", ".join(links)} if links else {}
+
+    def rate_limit(self):
+        now = time.time()
+        resources = {}
+        for resource, limit in (("core", self.core_limit), ("search", self.search_limit)):
+            used, reset = self._quota.get(resource, (0, now + self.window))
+            resources[resource] = {"limit": limit, "remaining": limit - used, "used": used, "reset": int(reset) + 1}
+        return 200, {"resources": resources, "rate": resources["core"]}, {}
+
+
+def decorate_repo(repo, base_url):
+    repo = dict(repo)
+    repo["url"] = f"{base_url}/repos/{repo['full_name']}"
+    repo["html_url"] = f"https://github.com/{repo['full_name']}"
+    repo["clone_url"] = f"https://github.com/{repo['full_name']}.git"
+    return repo
+
+
+def make_handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if fake.latency:
+                time.sleep(fake.latency)
+            parsed = urlparse(self.path)
+            params = parse_qs(parsed.query)
+            base_url = f"http://{self.headers['Host']}"
+
+            if parsed.path == "/rate_limit":
+                self.respond(*fake.rate_limit())
+                return
+
+            if parsed.path == "/search/repositories":
+                status, body, headers = fake.search(params)
+                if status == 200:
+                    body["items"] = [decorate_repo(r, base_url) for r in body["items"]]
+                    if "Link" in headers:
+                        headers["Link"] = headers["Link"].replace("</", f"<{base_url}/")
+            elif m := re.fullmatch(r"/repos/([^/]+)/([^/]+)/commits", parsed.path):
+                full_name = f"{m.group(1)}/{m.group(2)}"
+                repo = next((r for r in fake.repos if r["full_name"] == full_name), None)
+                if repo is None:
+                    status, body, headers = 404, {"message": "Not Found"}, {}
+                else:
+                    status, body, headers = fake.commits(repo, params)
+                    if "Link" in headers:
+                        headers["Link"] = headers["Link"].replace("</", f"<{base_url}/")
+            elif m := re.fullmatch(r"/repos/([^/]+)/([^/]+)", parsed.path):
+                full_name = f"{m.group(1)}/{m.group(2)}"
+                repo = next((r for r in fake.repos if r["full_name"] == full_name), None)
+                if repo is None:
+                    status, body, headers = 404, {"message": "Not Found"}, {}
+                else:
+                    status, body, headers = 200, decorate_repo(repo, base_url), {}
+            else:
+                status, body, headers = 404, {"message": "Not Found"}, {}
+
+            payload = json.dumps(body).encode()
+            etag = f'"{hashlib.sha1(payload).hexdigest()}"'
+            # like GitHub, conditional requests that come back 304 do not use up quota
+            not_modified = status == 200 and self.headers.get("If-None-Match") == etag
+            resource = "search" if parsed.path.startswith("/search/") else "core"
+            allowed, quota_headers = fake.take(resource, consume=not not_modified)
+            if not_modified:
+                self.respond(304, None, {**quota_headers, "ETag": etag})
+            elif not allowed:
+                self.respond(403, {"message": "API rate limit exceeded"}, quota_headers)
+            else:
+                if status == 200:
+                    headers["ETag"] = etag
+                self.respond(status, body, {**quota_headers, **headers})
+
+        def respond(self, status, body, headers):
+            payload = json.dumps(body).encode() if body is not None else b""
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(payload)))
+            self.send_header("Date", datetime.now(timezone.utc).strftime("%a, %d %b %Y %H:%M:%S GMT"))
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(payload)
+
+    return Handler
+
+
+def start_server(fake, host="127.0.0.1", port=0):
+    server = ThreadingHTTPServer((host, port), make_handler(fake))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--num-repos", type=int, default=20000)
+    parser.add_argument("--search-limit", type=int, default=30)
+    parser.add_argument("--window", type=float, default=60.0)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    fake = FakeGithub(
+        generate_repos(args.num_repos),
+        search_limit=args.search_limit,
+        window=args.window,
+        latency=args.latency,
+    )
+    server, url = start_server(fake, port=args.port)
+    print(f"Fake GitHub API with {args.num_repos} repos listening on {url}")
+    print(f"Run the pipeline against it with GITHUB_API_URL={url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,511 @@
+import argparse
+import asyncio
+import datetime
+import hashlib
+import json
+import os
+import random
+import ssl
+import tempfile
+import threading
+import time
+
+# Local stand-in for the OpenAI chat completions endpoint. It answers instructor's
+# tool calls with arguments generated from the tool's JSON schema, so the analysis
+# stages can run end to end without spending API budget. It also implements the
+# files and batches endpoints used by --mode batch.
+#
+#   synthetic: --latency 0.5 --latency-dist lognormal --throttle-rate 0.05
+#   record:    --recording llm.jsonl --upstream https://api.openai.com/v1
+#   replay:    --recording llm.jsonl [--replay-latency]
+
+
+def value_for_schema(schema, defs, rng):
+    if "$ref" in schema:
+        schema = defs[schema["$ref"].split("/")[-1]]
+    if "anyOf" in schema:
+        schema = next((s for s in schema["anyOf"] if s.get("type") != "null"), schema["anyOf"][0])
+    kind = schema.get("type")
+    if kind == "object":
+        return {
+            name: value_for_schema(prop, defs, rng)
+            for name, prop in schema.get("properties", {}).items()
+        }
+    if kind == "array":
+        return [value_for_schema(schema.get("items", {}), defs, rng) for _ in range(rng.randint(1, 3))]
+    if kind == "integer":
+        return rng.randint(schema.get("minimum", 1), schema.get("maximum", 10))
+    if kind == "number":
+        return rng.uniform(schema.get("minimum", 0), schema.get("maximum", 1))
+    if kind == "boolean":
+        return rng.random() < 0.5
+    if kind == "null":
+        return None
+    return rng.choice(["python", "rust", "data pipeline", "web framework", "compiler"])
+
+
+def request_key(body):
+    # requests with the same body get the same synthetic answer and the same recorded response
+    return hashlib.sha256(json.dumps(body, sort_keys=True).encode()).hexdigest()
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def load_recording(path):
+    recording = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                record = json.loads(line)
+                recording[record["key"]] = record
+    except FileNotFoundError:
+        pass
+    return recording
+
+
+class FakeOpenAI:
+    def __init__(
+        self,
+        latency=0.0,
+        connect_latency=0.0,
+        seed=0,
+        max_in_flight=None,
+        retry_after=1.0,
+        batch_latency=1.0,
+        batch_error_rate=0.0,
+        latency_dist="fixed",
+        latency_sigma=0.5,
+        throttle_rate=0.0,
+        recording=None,
+        upstream=None,
+        replay_latency=False,
+        invalid_rate=0.0,
+    ):
+        # latency is the mean of the distribution (the median for lognormal)
+        self.latency = latency
+        self.latency_dist = latency_dist
+        self.latency_sigma = latency_sigma
+        # stands in for the TCP and TLS round trips to a remote provider, paid once per connection
+        self.connect_latency = connect_latency
+        # requests beyond this many in flight get a 429 with Retry-After, like a provider's rate limit,
+        # and throttle_rate of the remaining ones get a 429 at random
+        self.max_in_flight = max_in_flight
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        # invalid_rate of the first asks get a tool call that fails validation (no
+        # arguments), re-asks, which carry the failed answer, always get a valid one
+        self.invalid_rate = invalid_rate
+        self.invalid = 0
+        # every random choice is seeded from the request body and attempt number, so a
+        # rerun sends back the same answers, latencies and 429s whatever the request order
+        self.seed = seed
+        self.attempts = {}
+        # record: forward chat completions to upstream and append the responses to recording
+        # replay: answer from recording, falling back to a synthetic answer for unseen requests
+        self.recording_path = recording
+        self.upstream = upstream.rstrip("/") if upstream else None
+        self.recording = load_recording(recording) if recording else {}
+        self.replay_latency = replay_latency
+        self.replayed = 0
+        self.replay_misses = 0
+        self.requests = 0
+        self.connections = 0
+        self.in_flight = 0
+        self.throttled = 0
+        self.http_requests = 0
+        # per call latency, from the first attempt at a request to its successful response
+        self.first_attempt = {}
+        self.call_latencies = []
+        # batch endpoint: every batch finishes batch_latency seconds after it's created,
+        # with batch_error_rate of its requests answered with a 500 in the error file
+        self.batch_latency = batch_latency
+        self.batch_error_rate = batch_error_rate
+        self.files = {}
+        self.batches = {}
+        self._tasks = set()
+        self._upstream_client = None
+        self._lock = threading.Lock()
+
+    def rng_for(self, key, attempt=0):
+        return random.Random(f"{self.seed}:{key}:{attempt}")
+
+    def sample_latency(self, rng):
+        if not self.latency or self.latency_dist == "fixed":
+            return self.latency
+        if self.latency_dist == "uniform":
+            return rng.uniform(0, 2 * self.latency)
+        if self.latency_dist == "exponential":
+            return rng.expovariate(1 / self.latency)
+        if self.latency_dist == "lognormal":
+            return self.latency * rng.lognormvariate(0, self.latency_sigma)
+        raise ValueError(f"Unknown latency distribution: {self.latency_dist}")
+
+    def reset_stats(self):
+        self.requests = self.connections = self.throttled = self.http_requests = self.invalid = 0
+        self.replayed = self.replay_misses = 0
+        self.first_attempt.clear()
+        self.call_latencies.clear()
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "connections": self.connections,
+            "http_requests": self.http_requests,
+            "throttled": self.throttled,
+            "invalid": self.invalid,
+            "batches": len(self.batches),
+            "replayed": self.replayed,
+            "replay_misses": self.replay_misses,
+            "calls": len(self.call_latencies),
+            "latency_p50": percentile(self.call_latencies, 0.5),
+            "latency_p99": percentile(self.call_latencies, 0.99),
+        }
+
+    def complete(self, body, rng):
+        with self._lock:
+            self.requests += 1
+            request_id = self.requests
+        message = {"role": "assistant", "content": None}
+        tools = body.get("tools") or []
+        if tools:
+            function = tools[0]["function"]
+            schema = function.get("parameters", {})
+            arguments = value_for_schema(schema, schema.get("$defs", {}), rng)
+            if len(body.get("messages", [])) == 1 and rng.random() < self.invalid_rate:
+                with self._lock:
+                    self.invalid += 1
+                arguments = {}
+            message["tool_calls"] = [
+                {
+                    "id": f"call_{request_id}",
+                    "type": "function",
+                    "function": {"name": function["name"], "arguments": json.dumps(arguments)},
+                }
+            ]
+        else:
+            message["content"] = "ok"
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in body.get("messages", [])) // 4
+        return {
+            "id": f"chatcmpl-{request_id}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 20, "total_tokens": prompt_tokens + 20},
+        }
+
+    async def forward(self, key, headers, raw_body):
+        import httpx
+
+        if self._upstream_client is None:
+            self._upstream_client = httpx.AsyncClient(timeout=120)
+        start = time.time()
+        response = await self._upstream_client.post(
+            f"{self.upstream}/chat/completions",
+            content=raw_body,
+            headers={"authorization": headers.get("authorization", ""), "content-type": "application/json"},
+        )
+        if response.status_code != 200:
+            try:
+                return response.status_code, response.json()
+            except ValueError:
+                return response.status_code, {"error": {"message": response.text}}
+        record = {"key": key, "latency": time.time() - start, "response": response.json()}
+        self.recording[key] = record
+        with open(self.recording_path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+        return 200, record["response"]
+
+    async def chat_completion(self, headers, raw_body):
+        # returns (status, response, extra response headers)
+        body = json.loads(raw_body or b"{}")
+        key = request_key(body)
+        attempt = self.attempts.get(key, 0)
+        self.attempts[key] = attempt + 1
+        self.first_attempt.setdefault(key, time.time())
+        rng = self.rng_for(key, attempt)
+        throttled = self.max_in_flight is not None and self.in_flight >= self.max_in_flight
+        if throttled or rng.random() < self.throttle_rate:
+            self.throttled += 1
+            return 429, {"error": {"message": "Rate limit reached", "type": "requests"}}, f"Retry-After: {self.retry_after}\r\n"
+        self.in_flight += 1
+        try:
+            if self.upstream:
+                status, response = await self.forward(key, headers, raw_body)
+            elif key in self.recording:
+                self.replayed += 1
+                record = self.recording[key]
+                await asyncio.sleep(record["latency"] if self.replay_latency else self.sample_latency(rng))
+                status, response = 200, record["response"]
+            else:
+                if self.recording_path:
+                    self.replay_misses += 1
+                await asyncio.sleep(self.sample_latency(rng))
+                status, response = 200, self.complete(body, rng)
+        finally:
+            self.in_flight -= 1
+        if status == 200:
+            self.call_latencies.append(time.time() - self.first_attempt.pop(key))
+        return status, response, ""
+
+    def create_file(self, content, filename, purpose):
+        file_id = f"file-{len(self.files) + 1}"
+        self.files[file_id] = {
+            "id": file_id,
+            "object": "file",
+            "bytes": len(content),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+            "status": "processed",
+            "content": content,
+        }
+        return {k: v for k, v in self.files[file_id].items() if k != "content"}
+
+    def create_batch(self, body):
+        batch_id = f"batch_{len(self.batches) + 1}"
+        lines = self.files[body["input_file_id"]]["content"].decode().splitlines()
+        self.batches[batch_id] = {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": body["endpoint"],
+            "input_file_id": body["input_file_id"],
+            "completion_window": body["completion_window"],
+            "metadata": body.get("metadata"),
+            "status": "in_progress",
+            "created_at": int(time.time()),
+            "output_file_id": None,
+            "error_file_id": None,
+            "request_counts": {"total": len(lines), "completed": 0, "failed": 0},
+        }
+        task = asyncio.get_running_loop().create_task(self._run_batch(batch_id, lines))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return self.batches[batch_id]
+
+    async def _run_batch(self, batch_id, lines):
+        await asyncio.sleep(self.batch_latency)
+        output, errors = [], []
+        for line in lines:
+            request = json.loads(line)
+            record = {"id": f"batch_req_{self.requests + 1}", "custom_id": request["custom_id"], "error": None}
+            key = request_key(request["body"])
+            attempt = self.attempts.get(key, 0)
+            self.attempts[key] = attempt + 1
+            rng = self.rng_for(key, attempt)
+            if rng.random() < self.batch_error_rate:
+                record["response"] = {"status_code": 500, "body": {"error": {"message": "Internal error"}}}
+                errors.append(record)
+            else:
+                record["response"] = {"status_code": 200, "body": self.complete(request["body"], rng)}
+                output.append(record)
+        batch = self.batches[batch_id]
+        for key, records in (("output_file_id", output), ("error_file_id", errors)):
+            if records:
+                content = "".join(json.dumps(r) + "\n" for r in records).encode()
+                batch[key] = self.create_file(content, f"{batch_id}_{key}.jsonl", "batch_output")["id"]
+        batch["request_counts"].update(completed=len(output), failed=len(errors))
+        batch.update(status="completed", completed_at=int(time.time()))
+
+
+def parse_multipart(headers, body):
+    # {field name: (filename, bytes)} from a multipart/form-data body
+    from email.parser import BytesParser
+    from email.policy import HTTP
+
+    message = BytesParser(policy=HTTP).parsebytes(
+        f"Content-Type: {headers['content-type']}\r\n\r\n".encode() + body
+    )
+    return {
+        part.get_param("name", header="content-disposition"): (part.get_filename(), part.get_payload(decode=True))
+        for part in message.iter_parts()
+    }
+
+
+async def read_request(reader):
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, path, _ = request_line.decode().split(" ", 2)
+    headers = {}
+    while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+        name, _, value = line.decode().partition(":")
+        headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get("content-length", 0)))
+    return method, path, headers, body
+
+
+REASONS = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found", 429: "Too Many Requests", 500: "Internal Server Error"}
+
+
+def make_handler(fake):
+    # asyncio rather than a thread per connection: with dozens of keep-alive
+    # connections waking up at once, threads spend most of their time waiting on the GIL
+    async def handle(reader, writer):
+        with fake._lock:
+            fake.connections += 1
+        try:
+            if fake.connect_latency:
+                await asyncio.sleep(fake.connect_latency)
+            while request := await read_request(reader):
+                method, path, headers, body = request
+                path = path.split("?")[0].rstrip("/")
+                if "/stats" not in path:
+                    fake.http_requests += 1
+                extra_headers = ""
+                content_type = "application/json"
+                if method == "POST" and path.endswith("/files"):
+                    fields = parse_multipart(headers, body)
+                    filename, content = fields["file"]
+                    status, response = 200, fake.create_file(content, filename, fields["purpose"][1].decode())
+                elif method == "GET" and path.endswith("/content") and "/files/" in path:
+                    file = fake.files.get(path.split("/")[-2])
+                    if file:
+                        status, response, content_type = 200, file["content"], "application/jsonl"
+                    else:
+                        status, response = 404, {"error": {"message": "Not Found"}}
+                elif method == "POST" and path.endswith("/batches"):
+                    status, response = 200, fake.create_batch(json.loads(body))
+                elif method == "GET" and "/batches/" in path:
+                    batch = fake.batches.get(path.split("/")[-1])
+                    status, response = (200, batch) if batch else (404, {"error": {"message": "Not Found"}})
+                elif method == "GET" and path.endswith("/stats"):
+                    status, response = 200, fake.stats()
+                elif method == "POST" and path.endswith("/stats/reset"):
+                    fake.reset_stats()
+                    status, response = 200, fake.stats()
+                elif method == "POST" and path.endswith("/chat/completions"):
+                    status, response, extra_headers = await fake.chat_completion(headers, body)
+                else:
+                    status, response = 404, {"error": {"message": "Not Found"}}
+                payload = response if isinstance(response, bytes) else json.dumps(response).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} {REASONS.get(status, 'Error')}\r\n{extra_headers}"
+                    f"Content-Type: {content_type}\r\nContent-Length: {len(payload)}\r\n\r\n".encode()
+                    + payload
+                )
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ssl.SSLError):
+            pass
+        finally:
+            writer.close()
+
+    return handle
+
+
+def self_signed_context(host):
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, host)])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        cert_path, key_path = os.path.join(tmp, "cert.pem"), os.path.join(tmp, "key.pem")
+        with open(cert_path, "wb") as f:
+            f.write(cert.public_bytes(serialization.Encoding.PEM))
+        with open(key_path, "wb") as f:
+            f.write(
+                key.private_bytes(
+                    serialization.Encoding.PEM,
+                    serialization.PrivateFormat.PKCS8,
+                    serialization.NoEncryption(),
+                )
+            )
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert_path, key_path)
+    return context
+
+
+class Server:
+    def __init__(self, fake, host, port, tls):
+        self.loop = asyncio.new_event_loop()
+        ssl_context = self_signed_context(host) if tls else None
+        self.server = self.loop.run_until_complete(
+            asyncio.start_server(make_handler(fake), host, port, ssl=ssl_context, backlog=1024)
+        )
+        self.server_address = self.server.sockets[0].getsockname()
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+
+    def shutdown(self):
+        self.loop.call_soon_threadsafe(self.server.close)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+
+
+def start_server(fake, host="127.0.0.1", port=0, tls=False):
+    # with tls=True clients need verification turned off (httpx.AsyncClient(verify=False))
+    server = Server(fake, host, port, tls)
+    scheme = "https" if tls else "http"
+    return server, f"{scheme}://{host}:{server.server_address[1]}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--latency", type=float, default=0.2, help="Mean response latency in seconds (median for lognormal)")
+    parser.add_argument("--latency-dist", type=str, default="fixed", choices=["fixed", "uniform", "exponential", "lognormal"])
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="Shape of the lognormal distribution")
+    parser.add_argument("--connect-latency", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tls", action="store_true")
+    parser.add_argument("--max-in-flight", type=int, default=None, help="Answer 429 beyond this many concurrent requests")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests answered with a 429 at random")
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--invalid-rate", type=float, default=0.0, help="Fraction of first asks answered with a tool call that fails validation")
+    parser.add_argument("--batch-latency", type=float, default=1.0, help="Seconds before a submitted batch completes")
+    parser.add_argument("--batch-error-rate", type=float, default=0.0, help="Fraction of batch requests that fail")
+    parser.add_argument("--recording", type=str, default=None, help="JSONL of recorded responses to replay, or to record into with --upstream")
+    parser.add_argument("--upstream", type=str, default=None, help="e.g. https://api.openai.com/v1, forwards and records chat completions")
+    parser.add_argument("--replay-latency", action="store_true", help="Replay with the recorded latency instead of --latency")
+    args = parser.parse_args()
+    if args.upstream and not args.recording:
+        parser.error("--upstream needs --recording to record into")
+
+    fake = FakeOpenAI(
+        latency=args.latency,
+        connect_latency=args.connect_latency,
+        seed=args.seed,
+        max_in_flight=args.max_in_flight,
+        retry_after=args.retry_after,
+        batch_latency=args.batch_latency,
+        batch_error_rate=args.batch_error_rate,
+        latency_dist=args.latency_dist,
+        latency_sigma=args.latency_sigma,
+        throttle_rate=args.throttle_rate,
+        recording=args.recording,
+        upstream=args.upstream,
+        replay_latency=args.replay_latency,
+        invalid_rate=args.invalid_rate,
+    )
+    server, url = start_server(fake, port=args.port, tls=args.tls)
+    print(f"Fake OpenAI API listening on {url}")
+    if args.upstream:
+        print(f"Recording responses from {args.upstream} into {args.recording}")
+    elif args.recording:
+        print(f"Replaying {len(fake.recording)} recorded responses from {args.recording}")
+    print(f"Run the analysis stages against it with OPENAI_BASE_URL={url} OPENAI_API_KEY=fake")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
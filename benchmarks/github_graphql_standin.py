@@ -0,0 +1,173 @@
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from fake_github_api import generate_repos
+
+# Stand-in for GitHub's GraphQL endpoint that serves recorded repository nodes.
+# Recordings are JSONL files with one {"owner", "name", "node"} object per line, so
+# any batch of repositories can be answered regardless of how queries were built.
+#
+#   record:  --recording repos.jsonl --upstream https://api.github.com/graphql --token ...
+#   replay:  --recording repos.jsonl
+#   offline: --synthetic 20000 --recording repos.jsonl  (generates a recording first)
+
+
+def synthetic_node(repo, rng):
+    return {
+        "name": repo["name"],
+        "owner": {"login": repo["owner"]["login"]},
+        "url": f"https://github.com/{repo['full_name']}",
+        "description": repo["description"],
+        "stargazerCount": repo["stargazers_count"],
+        "createdAt": repo["created_at"],
+        "updatedAt": repo["updated_at"],
+        "diskUsage": repo["size"],
+        "primaryLanguage": {"name": repo["language"]},
+        "defaultBranchRef": {
+            "name": repo["default_branch"],
+            "target": {"history": {"totalCount": max(1, int(repo["size"] * rng.uniform(0.01, 0.2)))}},
+        },
+    }
+
+
+def write_synthetic_recording(path, n, seed=0):
+    rng = random.Random(seed)
+    with open(path, "w") as f:
+        for repo in generate_repos(n, seed):
+            record = {"owner": repo["owner"]["login"], "name": repo["name"], "node": synthetic_node(repo, rng)}
+            f.write(json.dumps(record) + "\n")
+
+
+def load_recording(path):
+    nodes = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                record = json.loads(line)
+                nodes[f"{record['owner']}/{record['name']}".lower()] = record["node"]
+    except FileNotFoundError:
+        pass
+    return nodes
+
+
+class GraphQLStandIn:
+    def __init__(self, nodes, latency=0.0, per_repo_latency=0.0, upstream=None, token=None, record_path=None):
+        self.nodes = nodes
+        self.latency = latency
+        self.per_repo_latency = per_repo_latency
+        self.upstream = upstream
+        self.token = token
+        self.record_path = record_path
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def requested_repos(self, variables):
+        repos = []
+        i = 0
+        while f"o{i}" in variables:
+            repos.append((variables[f"o{i}"], variables[f"n{i}"]))
+            i += 1
+        return repos
+
+    def replay(self, repos):
+        data = {"rateLimit": {"cost": 1, "remaining": 4999, "resetAt": (datetime.now(timezone.utc) + timedelta(hours=1)).strftime("%Y-%m-%dT%H:%M:%SZ")}}
+        errors = []
+        for i, (owner, name) in enumerate(repos):
+            node = self.nodes.get(f"{owner}/{name}".lower())
+            data[f"r{i}"] = node
+            if node is None:
+                errors.append({"type": "NOT_FOUND", "path": [f"r{i}"], "message": f"Could not resolve to a Repository with the name '{owner}/{name}'."})
+        body = {"data": data}
+        if errors:
+            body["errors"] = errors
+        return body
+
+    def record(self, payload, repos):
+        response = requests.post(self.upstream, data=payload, headers={"Authorization": f"bearer {self.token}"}, timeout=120)
+        body = response.json()
+        data = body.get("data") or {}
+        with self._lock, open(self.record_path, "a") as f:
+            for i, (owner, name) in enumerate(repos):
+                node = data.get(f"r{i}")
+                if node is not None:
+                    self.nodes[f"{owner}/{name}".lower()] = node
+                    f.write(json.dumps({"owner": owner, "name": name, "node": node}) + "\n")
+        return response.status_code, body
+
+    def handle(self, payload):
+        with self._lock:
+            self.requests += 1
+        request = json.loads(payload)
+        repos = self.requested_repos(request.get("variables") or {})
+        if self.upstream:
+            return self.record(payload, repos)
+        time.sleep(self.latency + self.per_repo_latency * len(repos))
+        return 200, self.replay(repos)
+
+
+def make_handler(standin):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            payload = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if self.path.rstrip("/") != "/graphql":
+                status, body = 404, {"message": "Not Found"}
+            else:
+                status, body = standin.handle(payload)
+            out = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(out)))
+            self.end_headers()
+            self.wfile.write(out)
+
+    return Handler
+
+
+def start_server(standin, host="127.0.0.1", port=0):
+    server = ThreadingHTTPServer((host, port), make_handler(standin))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--recording", type=str, default="graphql_recording.jsonl")
+    parser.add_argument("--synthetic", type=int, default=None)
+    parser.add_argument("--upstream", type=str, default=None)
+    parser.add_argument("--token", type=str, default=None)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--per-repo-latency", type=float, default=0.002)
+    args = parser.parse_args()
+
+    if args.synthetic:
+        write_synthetic_recording(args.recording, args.synthetic)
+
+    standin = GraphQLStandIn(
+        load_recording(args.recording),
+        latency=args.latency,
+        per_repo_latency=args.per_repo_latency,
+        upstream=args.upstream,
+        token=args.token,
+        record_path=args.recording if args.upstream else None,
+    )
+    server, url = start_server(standin, port=args.port)
+    mode = f"recording from {args.upstream}" if args.upstream else f"replaying {len(standin.nodes)} repos"
+    print(f"GraphQL stand-in {mode} on {url}/graphql")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
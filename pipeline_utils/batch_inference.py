@@ -0,0 +1,193 @@
+import glob
+import io
+import json
+import os
+import time
+
+# Offline batch inference through the provider's batch endpoint. Prompts are
+# written as JSONL request files, one job directory per input parquet file, and
+# every request carries a stable id (a hash of its inputs) so results can be joined
+# back onto the rows. Each job directory holds:
+#
+#   requests_<n>.jsonl  the requests sent in the n-th batch of this partition
+#   state.json          the batches submitted so far and their status
+#   results.jsonl       parsed results by request id, appended as batches finish
+#
+# The batch id is recorded as soon as the batch is created, so a restarted run
+# polls the batches already in flight instead of submitting them again, and only
+# requests without a result (failed, expired or unparseable) go into a new batch.
+
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def parquet_partitions(input_path):
+    # (partition name, file) for every parquet file under input_path
+    if os.path.isfile(input_path):
+        return [(os.path.splitext(os.path.basename(input_path))[0], input_path)]
+    paths = sorted(glob.glob(os.path.join(input_path, "**", "*.parquet"), recursive=True))
+    return [(os.path.splitext(os.path.relpath(path, input_path))[0].replace(os.sep, "_"), path) for path in paths]
+
+
+def load_openai_batch_client_and_model(timeout=60):
+    from openai import OpenAI
+
+    OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+    if not OPENAI_API_KEY:
+        raise ValueError("OPENAI_API_KEY is not set")
+
+    OPENAI_MODEL = os.environ.get("OPENAI_MODEL")
+    if not OPENAI_MODEL:
+        raise ValueError("OPENAI_MODEL is not set")
+
+    return OpenAI(api_key=OPENAI_API_KEY, timeout=timeout), OPENAI_MODEL
+
+
+def tool_request(custom_id, model, prompt, response_model, max_tokens):
+    # the same forced tool call instructor sends in TOOLS mode, as a batch request line
+    from instructor import openai_schema
+
+    function = openai_schema(response_model).openai_schema
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {
+            "model": model,
+            "messages": [{"role": "user", "content": prompt}],
+            "max_tokens": max_tokens,
+            "tools": [{"type": "function", "function": function}],
+            "tool_choice": {"type": "function", "function": {"name": function["name"]}},
+        },
+    }
+
+
+def parse_tool_response(body, response_model):
+    arguments = body["choices"][0]["message"]["tool_calls"][0]["function"]["arguments"]
+    return response_model.model_validate_json(arguments).model_dump()
+
+
+def _write_json(path, value):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(value, f, indent=2)
+    os.replace(tmp, path)
+
+
+class BatchJob:
+    def __init__(self, client, job_dir, requests, parse, max_attempts=3, completion_window="24h"):
+        # requests: {request id: request line from tool_request}
+        # parse: response body -> result, raising if the response is unusable
+        self.client = client
+        self.job_dir = job_dir
+        self.requests = requests
+        self.parse = parse
+        self.max_attempts = max_attempts
+        self.completion_window = completion_window
+        os.makedirs(job_dir, exist_ok=True)
+        self.state_path = os.path.join(job_dir, "state.json")
+        self.results_path = os.path.join(job_dir, "results.jsonl")
+        self.state = {"batches": []}
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                self.state = json.load(f)
+        self._results = {}
+        if os.path.exists(self.results_path):
+            with open(self.results_path) as f:
+                for line in f:
+                    # a run killed mid-append can leave a partial last line
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self._results[record["custom_id"]] = record["result"]
+
+    def results(self):
+        return {key: self._results[key] for key in self.requests if key in self._results}
+
+    def pending(self):
+        return [key for key in self.requests if key not in self._results]
+
+    def in_flight(self):
+        batches = self.state["batches"]
+        return batches[-1] if batches and batches[-1]["status"] not in TERMINAL_STATUSES else None
+
+    def submit(self):
+        # submits the requests that have no result yet, returns False if there is nothing to submit
+        pending = self.pending()
+        if not pending or self.in_flight() or len(self.state["batches"]) >= self.max_attempts:
+            return False
+        name = f"requests_{len(self.state['batches'])}.jsonl"
+        payload = "".join(json.dumps(self.requests[key]) + "\n" for key in pending)
+        with open(os.path.join(self.job_dir, name), "w") as f:
+            f.write(payload)
+        input_file = self.client.files.create(file=(name, io.BytesIO(payload.encode())), purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window=self.completion_window,
+            metadata={"job": os.path.basename(self.job_dir)},
+        )
+        self.state["batches"].append({"id": batch.id, "file": name, "requests": len(pending), "status": batch.status})
+        _write_json(self.state_path, self.state)
+        return True
+
+    def _collect(self, batch):
+        parsed = []
+        if batch.output_file_id:
+            for line in self.client.files.content(batch.output_file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                response = record.get("response") or {}
+                try:
+                    if response.get("status_code") != 200:
+                        raise ValueError(f"status {response.get('status_code')}")
+                    parsed.append({"custom_id": record["custom_id"], "result": self.parse(response["body"])})
+                except Exception as e:
+                    print(f"Request {record.get('custom_id')} in batch {batch.id} failed: {e}")
+        with open(self.results_path, "a") as f:
+            for record in parsed:
+                f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        for record in parsed:
+            self._results[record["custom_id"]] = record["result"]
+        entry = self.state["batches"][-1]
+        entry.update(status=batch.status, succeeded=len(parsed), failed=entry["requests"] - len(parsed))
+        _write_json(self.state_path, self.state)
+
+    def step(self):
+        # polls the batch in flight, collects it once it's done and resubmits what's still
+        # missing; returns True once the job has nothing left to wait for
+        entry = self.in_flight()
+        if entry:
+            batch = self.client.batches.retrieve(entry["id"])
+            if batch.status not in TERMINAL_STATUSES:
+                if batch.status != entry["status"]:
+                    entry["status"] = batch.status
+                    _write_json(self.state_path, self.state)
+                return False
+            self._collect(batch)
+        return not self.submit()
+
+    def summary(self):
+        return (
+            f"{os.path.basename(self.job_dir)}: {len(self.results())}/{len(self.requests)} results, "
+            f"{len(self.state['batches'])} batches submitted"
+        )
+
+
+def run_batch_jobs(jobs, poll_interval=30, wait=True):
+    # submits every job before waiting on any of them so the partitions run side by side
+    for job in jobs:
+        job.submit()
+    waiting = list(jobs)
+    while waiting:
+        waiting = [job for job in waiting if not job.step()]
+        if not waiting or not wait:
+            break
+        print(f"Waiting on {len(waiting)} of {len(jobs)} batch jobs, polling again in {poll_interval}s")
+        time.sleep(poll_interval)
+    for job in jobs:
+        print(job.summary())
+    return not waiting
@@ -0,0 +1,112 @@
+import glob
+import os
+import re
+
+import daft
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Reading and writing the repo dimension table of the normalized raw_commits layout.
+# Commit files in that layout hold an int32 repo_id instead of the repo's name,
+# owner, url and extraction window on every row; those live once per repo in
+# <commits path>_repos.parquet. Ids are assigned when a repo is first seen and
+# never change, so delta files from later incremental runs keep pointing at the
+# right row. read_commits() gives the wide view of either layout.
+
+REPOS_SCHEMA = pa.schema(
+    [
+        ("repo_id", pa.int32()),
+        ("repo_name", pa.large_string()),
+        ("url", pa.large_string()),
+        ("repo_owner", pa.large_string()),
+        ("window_since", pa.timestamp("ms")),
+        ("window_until", pa.timestamp("ms")),
+    ]
+)
+
+WIDE_COLUMNS = [
+    "repo_name",
+    "url",
+    "repo_owner",
+    "hash",
+    "author_name",
+    "author_email",
+    "date",
+    "message",
+    "files_changed",
+    "lines_added",
+    "lines_deleted",
+    "lines_modified",
+    "window_since",
+    "window_until",
+]
+
+
+# stage 4 writes <key>.parquet per repo, plus <key>-<head>.parquet for incremental runs
+REPO_FILE = re.compile(r"^([0-9a-f]{16})(?:-[0-9a-f]+)?\.parquet$")
+
+
+def repos_file(commits_path):
+    return f"{commits_path.rstrip('/')}_repos.parquet"
+
+
+def read_repos(commits_path):
+    path = repos_file(commits_path)
+    return pq.read_table(path).to_pylist() if os.path.exists(path) else []
+
+
+def assign_repo_ids(commits_path, urls):
+    # url -> repo_id, keeping the ids of repos already in the dimension table
+    ids = {row["url"]: row["repo_id"] for row in read_repos(commits_path)}
+    next_id = max(ids.values(), default=-1) + 1
+    for url in sorted(set(urls) - set(ids)):
+        ids[url] = next_id
+        next_id += 1
+    return ids
+
+
+def write_repos(commits_path, rows):
+    # upserts rows by repo_id
+    repos = {row["repo_id"]: row for row in read_repos(commits_path)}
+    repos.update((row["repo_id"], row) for row in rows)
+    path = repos_file(commits_path)
+    tmp = f"{path}.tmp"
+    pq.write_table(pa.Table.from_pylist(sorted(repos.values(), key=lambda row: row["repo_id"]), schema=REPOS_SCHEMA), tmp)
+    os.replace(tmp, path)
+
+
+def is_normalized(df):
+    return "repo_id" in df.column_names
+
+
+def read_commits(path):
+    # raw_commits as one row per commit with the repo columns on every row, whichever
+    # layout it was written in
+    df = daft.read_parquet(path)
+    if not is_normalized(df):
+        return df
+    repos = daft.read_parquet(repos_file(path))
+    df = df.join(repos, on="repo_id").exclude("repo_id")
+    return df.select(*[name for name in WIDE_COLUMNS if name in df.column_names])
+
+
+# the group of raw_commits files that aren't named after their repo
+UNKEYED_GROUP = "unkeyed"
+
+
+def repo_file_groups(path):
+    # raw_commits files grouped by repo, {key: files}, so each group holds all of its
+    # repos' commits. Files named any other way (written by daft before commits were
+    # streamed) can hold any repo, so they form one group together.
+    if os.path.isfile(path):
+        return {UNKEYED_GROUP: [path]}
+    groups, other = {}, []
+    for file in sorted(glob.glob(os.path.join(path, "**", "*.parquet"), recursive=True)):
+        match = REPO_FILE.match(os.path.basename(file))
+        if match:
+            groups.setdefault(match.group(1), []).append(file)
+        else:
+            other.append(file)
+    if other:
+        groups[UNKEYED_GROUP] = other
+    return groups
@@ -0,0 +1,169 @@
+import asyncio
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+# Adaptive concurrency limit for LLM calls (additive increase, multiplicative
+# decrease). The number of requests in flight grows by one per window of healthy
+# completions and halves on 429s, timeouts and server errors, and a Retry-After
+# from the provider pauses every new request until it has passed. Congestion
+# signals from requests that started before the last decrease are ignored, so a
+# burst of 429s from one window only halves the limit once.
+
+THROUGHPUT_WINDOW = 30.0
+
+
+def status_code(error):
+    code = getattr(error, "status_code", None)
+    if code is None:
+        code = getattr(getattr(error, "response", None), "status_code", None)
+    return code
+
+
+def retry_after(error):
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    return retry_after_seconds(headers)
+
+
+def retry_after_seconds(headers):
+    # seconds the server asked us to wait, from retry-after-ms or Retry-After, which
+    # is either a number of seconds or an HTTP date
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        try:
+            return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+        except (TypeError, ValueError):
+            return None
+
+
+def classify(error):
+    code = status_code(error)
+    if code == 429:
+        return "throttled"
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError)) or "Timeout" in type(error).__name__:
+        return "timeout"
+    if code is not None and code >= 500 or type(error).__name__ == "APIConnectionError":
+        return "server_error"
+    return None
+
+
+class AIMDLimiter:
+    def __init__(
+        self,
+        initial=8,
+        min_limit=1,
+        max_limit=64,
+        backoff=0.5,
+        latency_tolerance=2.0,
+        max_retries=5,
+    ):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        # completions slower than this multiple of the best latency seen don't grow the limit
+        self.latency_tolerance = latency_tolerance
+        self.max_retries = max_retries
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.baseline_latency = None
+        self.latency = None
+        self.counts = {"completed": 0, "throttled": 0, "timeout": 0, "server_error": 0, "failed": 0, "retries": 0}
+        self._completions = deque()
+        self._condition = None
+
+    async def _acquire(self):
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        while True:
+            pause = self.paused_until - time.time()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+            async with self._condition:
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return time.time()
+                await self._condition.wait()
+
+    async def _release(self):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def _on_success(self, started):
+        now = time.time()
+        latency = now - started
+        self.counts["completed"] += 1
+        self._completions.append(now)
+        self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+        if self.baseline_latency is None or self.latency < self.baseline_latency:
+            self.baseline_latency = self.latency
+        if self.latency <= self.baseline_latency * self.latency_tolerance:
+            # +1 per limit's worth of completions, i.e. roughly +1 per round trip
+            self.limit = min(self.limit + 1 / self.limit, self.max_limit)
+
+    def _on_congestion(self, started, kind, delay):
+        self.counts[kind] += 1
+        now = time.time()
+        if delay:
+            self.paused_until = max(self.paused_until, now + delay)
+        if started >= self.last_decrease:
+            self.limit = max(self.limit * self.backoff, self.min_limit)
+            self.last_decrease = now
+
+    async def run(self, fn, *args, **kwargs):
+        # awaits fn(*args, **kwargs) under the limit, retrying throttled, timed out
+        # and server-error calls with backoff after shrinking the limit
+        for attempt in range(self.max_retries + 1):
+            started = await self._acquire()
+            try:
+                result = await fn(*args, **kwargs)
+            except Exception as e:
+                kind = classify(e)
+                if kind is None:
+                    self.counts["failed"] += 1
+                    raise
+                delay = retry_after(e)
+                self._on_congestion(started, kind, delay)
+                if attempt == self.max_retries:
+                    self.counts["failed"] += 1
+                    raise
+                self.counts["retries"] += 1
+            else:
+                self._on_success(started)
+                return result
+            finally:
+                await self._release()
+            await asyncio.sleep(delay if delay is not None else min(2**attempt, 30))
+
+    def metrics(self):
+        now = time.time()
+        while self._completions and self._completions[0] < now - THROUGHPUT_WINDOW:
+            self._completions.popleft()
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "throughput": len(self._completions) / THROUGHPUT_WINDOW,
+            "latency": self.latency,
+            **self.counts,
+        }
+
+    def summary(self):
+        m = self.metrics()
+        latency = f"{m['latency']:.2f}s" if m["latency"] is not None else "n/a"
+        return (
+            f"Concurrency limit {m['limit']} ({m['in_flight']} in flight), {m['throughput']:.1f} req/s over the last "
+            f"{THROUGHPUT_WINDOW:.0f}s, latency {latency}, {m['completed']} completed, {m['throttled']} throttled, "
+            f"{m['timeout']} timeouts, {m['server_error']} server errors, {m['retries']} retries, {m['failed']} failed"
+        )
@@ -0,0 +1,66 @@
+import hashlib
+import json
+
+from pipeline_utils.sqlite_store import SqliteLRUStore, get_store
+
+# Persistent cache of structured LLM responses keyed by a hash of everything that
+# determines the answer (provider, model, prompt version and the prompt inputs).
+# Lookups and writes are batched so a UDF can resolve a whole batch in one query
+# before sending anything to the provider. Stats live in the database so they add
+# up across daft UDF worker processes.
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+def cache_key(*parts):
+    return hashlib.sha256(json.dumps(parts, default=str).encode()).hexdigest()
+
+
+class LLMCache(SqliteLRUStore):
+    COLUMNS = ("value TEXT",)
+    STATS = ("hits", "misses", "writes", "evictions")
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES):
+        super().__init__(path, max_bytes, timeout=60)
+
+    def get_many(self, keys):
+        # returns {key: value} for the keys that are cached
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start : start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                for key, value in self._db.execute(
+                    f"SELECT key, value FROM responses WHERE key IN ({placeholders})",
+                    chunk,
+                ):
+                    found[key] = json.loads(value)
+            self._touch(found)
+            self._bump("hits", len(found))
+            self._bump("misses", len(keys) - len(found))
+            self._db.commit()
+        return found
+
+    def put_many(self, items):
+        rows = []
+        for key, value in items:
+            payload = json.dumps(value)
+            rows.append((key, payload, len(payload)))
+        with self._lock:
+            self._put_rows(rows)
+            self._bump("writes", len(rows))
+            self._db.commit()
+
+    def summary(self):
+        stats = self.stats()
+        lookups = stats["hits"] + stats["misses"]
+        return (
+            f"LLM cache {self.path}: {stats['hits']} hits, {stats['misses']} misses "
+            f"({stats['hits'] / max(lookups, 1):.0%} hit rate), {stats['writes']} writes, "
+            f"{stats['evictions']} evictions, {stats['entries']} entries "
+            f"({stats['size_bytes'] / 1024 / 1024:.1f} MiB)"
+        )
+
+
+def get_cache(path, max_bytes=DEFAULT_MAX_BYTES):
+    return get_store(LLMCache, path, max_bytes)
@@ -0,0 +1,58 @@
+import asyncio
+import threading
+
+import httpx
+
+# Long-lived pieces for the LLM stages. A class-based daft UDF run with
+# with_concurrency() is instantiated once per worker, so it can keep one event loop
+# running on a background thread and one pooled HTTP client for the whole run instead
+# of paying for a new loop, connection pool and TLS handshakes on every batch.
+
+class BackgroundLoop:
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+
+    def run(self, coro):
+        # runs coro on the background loop and blocks until it's done
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def close(self):
+        if self.loop.is_closed():
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+
+def make_http_client(max_connections=64, timeout=60, **kwargs):
+    # keep-alive connections are kept open between batches, so a worker only pays for
+    # connection setup and TLS handshakes once per connection
+    return httpx.AsyncClient(
+        timeout=timeout,
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=300,
+        ),
+        **kwargs,
+    )
+
+
+def validation_retries(max_attempts):
+    # instructor retries every exception by default, including 429s, which should be
+    # left to the AIMD limiter; only re-ask the model when its output fails validation.
+    # Depending on the instructor version an attempt raises the ValidationError or
+    # JSONDecodeError itself or wraps it in an InstructorRetryException.
+    from json import JSONDecodeError
+
+    from instructor.retry import InstructorRetryException
+    from pydantic import ValidationError
+    from tenacity import AsyncRetrying, retry_if_exception_type, stop_after_attempt
+
+    return AsyncRetrying(
+        stop=stop_after_attempt(max_attempts),
+        retry=retry_if_exception_type((ValidationError, JSONDecodeError, InstructorRetryException)),
+        reraise=True,
+    )
@@ -0,0 +1,194 @@
+import fcntl
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from git import Repo
+
+# Persistent store of bare repository mirrors shared by the clone-based stages.
+# Mirrors are keyed by a hash of the clone URL, updated with `git fetch` instead of
+# being recloned, guarded by a per-repo file lock (daft UDF workers are separate
+# processes) and evicted least-recently-used once the store exceeds its disk budget.
+
+DEFAULT_MAX_BYTES = 50 * 1024**3
+FETCH_REFSPEC = "+refs/heads/*:refs/heads/*"
+
+
+def dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            try:
+                total += os.path.getsize(os.path.join(root, f))
+            except OSError:
+                pass
+    return total
+
+
+class MirrorStore:
+    def __init__(self, root, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+        self._db_lock = threading.Lock()
+        self._db = sqlite3.connect(
+            os.path.join(root, "index.sqlite"), timeout=60, check_same_thread=False
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS mirrors (
+                key TEXT PRIMARY KEY,
+                url TEXT,
+                size INTEGER,
+                last_used REAL
+            )"""
+        )
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS timings (
+                url TEXT,
+                op TEXT,
+                seconds REAL,
+                at REAL
+            )"""
+        )
+        self._db.commit()
+
+    @staticmethod
+    def key(url):
+        url = url.strip().rstrip("/")
+        if url.endswith(".git"):
+            url = url[: -len(".git")]
+        return hashlib.sha256(url.lower().encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], f"{key}.git")
+
+    @contextmanager
+    def _lock(self, key, blocking=True):
+        lock_path = os.path.join(self.root, key[:2], f"{key}.lock")
+        os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+        with open(lock_path, "w") as f:
+            flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+            try:
+                fcntl.flock(f, flags)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _execute(self, sql, params=()):
+        with self._db_lock:
+            rows = self._db.execute(sql, params).fetchall()
+            self._db.commit()
+        return rows
+
+    def _record(self, url, op, seconds):
+        self._execute(
+            "INSERT INTO timings VALUES (?, ?, ?, ?)", (url, op, seconds, time.time())
+        )
+
+    def _update(self, url, path):
+        start = time.time()
+        if os.path.exists(os.path.join(path, "HEAD")):
+            print(f"[{url}] Fetching mirror")
+            repo = Repo(path)
+            repo.git.fetch("--prune", "--tags", "origin")
+            op = "fetch"
+        else:
+            print(f"[{url}] Cloning mirror")
+            # clone into a temp dir first so a failed clone never leaves a half-built mirror
+            tmp = tempfile.mkdtemp(dir=os.path.dirname(path), suffix=".tmp")
+            try:
+                repo = Repo.clone_from(url, to_path=tmp, multi_options=["--bare"])
+                repo.git.config("remote.origin.fetch", FETCH_REFSPEC)
+                os.rename(tmp, path)
+            except Exception:
+                shutil.rmtree(tmp, ignore_errors=True)
+                raise
+            repo = Repo(path)
+            op = "clone"
+        self._record(url, op, time.time() - start)
+        return repo
+
+    @contextmanager
+    def open(self, url):
+        # yields an up-to-date bare Repo for url, holding its lock while in use
+        key = self.key(url)
+        path = self.path(key)
+        with self._lock(key):
+            repo = self._update(url, path)
+            try:
+                yield repo
+            finally:
+                self._execute(
+                    "INSERT OR REPLACE INTO mirrors VALUES (?, ?, ?, ?)",
+                    (key, url, dir_size(path), time.time()),
+                )
+        self.evict()
+
+    def evict(self):
+        [(total,)] = self._execute("SELECT COALESCE(SUM(size), 0) FROM mirrors")
+        if total <= self.max_bytes:
+            return
+        candidates = self._execute(
+            "SELECT key, url, size FROM mirrors ORDER BY last_used"
+        )
+        for key, url, size in candidates:
+            if total <= self.max_bytes:
+                break
+            # skip mirrors another worker is using right now
+            with self._lock(key, blocking=False) as locked:
+                if not locked:
+                    continue
+                print(f"[{url}] Evicting mirror ({size / 1024 / 1024:.0f} MiB)")
+                shutil.rmtree(self.path(key), ignore_errors=True)
+                self._execute("DELETE FROM mirrors WHERE key = ?", (key,))
+                total -= size
+
+    def summary(self, since=0.0):
+        rows = self._execute(
+            "SELECT op, COUNT(*), SUM(seconds) FROM timings WHERE at >= ? GROUP BY op",
+            (since,),
+        )
+        stats = {"clone": (0, 0.0), "fetch": (0, 0.0)}
+        stats.update({op: (count, seconds) for op, count, seconds in rows})
+        [(size,)] = self._execute("SELECT COALESCE(SUM(size), 0) FROM mirrors")
+        clones, clone_seconds = stats["clone"]
+        fetches, fetch_seconds = stats["fetch"]
+        return (
+            f"Mirror store {self.root}: {clones} clones in {clone_seconds:.1f}s "
+            f"({clone_seconds / max(clones, 1):.2f}s avg), {fetches} fetches in {fetch_seconds:.1f}s "
+            f"({fetch_seconds / max(fetches, 1):.2f}s avg), {size / 1024**3:.2f} GiB on disk"
+        )
+
+
+_stores = {}
+
+
+def get_store(mirror_dir, max_bytes=DEFAULT_MAX_BYTES):
+    store = _stores.get(mirror_dir)
+    if store is None:
+        store = _stores[mirror_dir] = MirrorStore(mirror_dir, max_bytes)
+    store.max_bytes = max_bytes
+    return store
+
+
+@contextmanager
+def open_repo(url, mirror_dir=None, max_bytes=DEFAULT_MAX_BYTES, multi_options=None):
+    # yields a Repo for url, from the mirror store when mirror_dir is set and from a
+    # throwaway clone otherwise
+    if mirror_dir:
+        with get_store(mirror_dir, max_bytes).open(url) as repo:
+            yield repo
+        return
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        yield Repo.clone_from(url, to_path=temp_dir, multi_options=multi_options or [])
@@ -0,0 +1,91 @@
+import heapq
+import statistics
+from collections import defaultdict
+
+import daft
+import pyarrow as pa
+
+# Longest-job-first scheduling for the stages that clone repos and log their history.
+# A repo's cost is its extraction time in the previous run when there is one, otherwise
+# an estimate from the stage 1 metadata (disk_usage_kb, commit_count). Repos are then
+# bin-packed into partitions by cost rather than by count, largest first, so the giant
+# repos start at the beginning of the run instead of trailing at the end of it.
+
+# Rough per-repo cost in seconds for repos with no timing yet: a clone at ~10 MB/s plus
+# `git log --numstat` at ~4000 commits/s. Only the ordering matters, not the absolute time.
+BASE_SECONDS = 1.0
+SECONDS_PER_KB = 1e-4
+SECONDS_PER_COMMIT = 2.5e-4
+
+
+def estimate_seconds(disk_usage_kb=None, commit_count=None):
+    if disk_usage_kb is None and commit_count is None:
+        return None
+    return BASE_SECONDS + (disk_usage_kb or 0) * SECONDS_PER_KB + (commit_count or 0) * SECONDS_PER_COMMIT
+
+
+def repo_costs(table, known_seconds=None):
+    # (costs, sources) for every row of a repo table, sources counts where the costs came from
+    known_seconds = known_seconds or {}
+    rows = table.select([name for name in ["url", "disk_usage_kb", "commit_count"] if name in table.column_names])
+    costs, sources = [], dict(previous=0, metadata=0, unknown=0)
+    for row in rows.to_pylist():
+        cost = known_seconds.get(row["url"])
+        source = "previous"
+        if cost is None:
+            cost = estimate_seconds(row.get("disk_usage_kb"), row.get("commit_count"))
+            source = "metadata"
+        if cost is None:
+            source = "unknown"
+        costs.append(cost)
+        sources[source] += 1
+    # repos we know nothing about are assumed to be typical
+    typical = statistics.median([cost for cost in costs if cost is not None] or [BASE_SECONDS])
+    return [typical if cost is None else cost for cost in costs], sources
+
+
+def pack_partitions(costs, num_partitions):
+    # Longest processing time first: repos in decreasing cost each go to the least loaded
+    # partition. Returns (load, row indices) per partition, most loaded first, with the
+    # rows of each partition in decreasing cost.
+    bins = [(0.0, i, []) for i in range(max(1, min(num_partitions, len(costs))))]
+    for index in sorted(range(len(costs)), key=lambda i: -costs[i]):
+        load, i, indices = heapq.heappop(bins)
+        indices.append(index)
+        heapq.heappush(bins, (load + costs[index], i, indices))
+    return [(load, indices) for load, _, indices in sorted(bins, key=lambda b: -b[0]) if indices]
+
+
+def schedule_repos(df, num_partitions, known_seconds=None):
+    # df with one partition per bin of the packing, in the order they should run. The
+    # native runner ignores partition boundaries and hands rows to its workers in order,
+    # so it should get num_partitions=1, i.e. every repo largest first.
+    table = df.to_arrow()
+    if not len(table):
+        return df
+    costs, sources = repo_costs(table, known_seconds)
+    bins = pack_partitions(costs, num_partitions)
+    print(
+        f"Scheduled {len(costs)} repos longest first into {len(bins)} partitions, "
+        f"estimated {sum(costs):.0f}s of work, largest repo {max(costs):.0f}s, largest partition {bins[0][0]:.0f}s "
+        f"({sources['previous']} timed in the previous run, {sources['metadata']} from metadata, {sources['unknown']} unknown)"
+    )
+    return daft.from_arrow([table.take(pa.array(indices, pa.int64())) for _, indices in bins])
+
+
+def print_schedule_summary(workers, started, seconds):
+    # makespan of the run and how busy each worker was during it
+    if not seconds:
+        return
+    begin = min(started)
+    makespan = max(start + duration for start, duration in zip(started, seconds)) - begin
+    busy, finished = defaultdict(float), defaultdict(float)
+    for worker, start, duration in zip(workers, started, seconds):
+        busy[worker] += duration
+        finished[worker] = max(finished[worker], start + duration - begin)
+    utilization = sorted((busy[worker] / makespan if makespan else 1.0 for worker in busy), reverse=True)
+    print(
+        f"Makespan {makespan:.1f}s on {len(busy)} workers, longest repo {max(seconds):.1f}s, "
+        f"mean utilization {statistics.mean(utilization):.0%}, first worker idle after {min(finished.values()):.1f}s"
+    )
+    print("Worker utilization: " + ", ".join(f"{u:.0%}" for u in utilization))
@@ -0,0 +1,115 @@
+import os
+import sqlite3
+import threading
+import time
+
+# SQLite store under the GitHub HTTP cache and the LLM cache. Rows live in a
+# `responses` table as (key, <payload columns>, size, last_access); once the stored
+# size passes max_bytes the least recently used rows are evicted. Hit/miss counters
+# live in a `stats` table so they add up across daft UDF worker processes.
+
+
+class SqliteLRUStore:
+    # subclasses set the payload columns and the counters stats() always reports
+    COLUMNS = ()
+    STATS = ("hits", "misses", "evictions")
+
+    def __init__(self, path, max_bytes, timeout=30):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        columns = "".join(f"{column},\n                " for column in self.COLUMNS)
+        self._db.execute(
+            f"""CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                {columns}size INTEGER,
+                last_access REAL
+            )"""
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER)"
+        )
+        self._db.commit()
+
+    def _put_rows(self, rows):
+        # rows of (key, *payload, size), callers hold the lock and commit
+        now = time.time()
+        placeholders = ", ".join("?" * (len(self.COLUMNS) + 3))
+        self._db.executemany(
+            f"INSERT OR REPLACE INTO responses VALUES ({placeholders})",
+            [(*row, now) for row in rows],
+        )
+        self._evict()
+
+    def _touch(self, keys):
+        self._db.executemany(
+            "UPDATE responses SET last_access = ? WHERE key = ?",
+            [(time.time(), key) for key in keys],
+        )
+
+    def _evict(self):
+        (total,) = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        if total <= self.max_bytes:
+            return
+        # drop least recently used responses until we are comfortably under budget
+        target = total - int(self.max_bytes * 0.9)
+        freed = 0
+        keys = []
+        for key, size in self._db.execute(
+            "SELECT key, size FROM responses ORDER BY last_access"
+        ):
+            keys.append((key,))
+            freed += size
+            if freed >= target:
+                break
+        self._db.executemany("DELETE FROM responses WHERE key = ?", keys)
+        self._bump("evictions", len(keys))
+
+    def _bump(self, name, n=1):
+        if n:
+            self._db.execute(
+                "INSERT INTO stats VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + ?",
+                (name, n, n),
+            )
+
+    def record(self, name, n=1):
+        with self._lock:
+            self._bump(name, n)
+            self._db.commit()
+
+    def reset_stats(self):
+        with self._lock:
+            self._db.execute("DELETE FROM stats")
+            self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            rows = self._db.execute("SELECT name, value FROM stats").fetchall()
+            entries, size = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        stats = {**dict.fromkeys(self.STATS, 0), **dict(rows)}
+        stats["entries"] = entries
+        stats["size_bytes"] = size
+        return stats
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(cls, path, max_bytes):
+    # one store per class and path in each process, later calls only update the budget
+    with _stores_lock:
+        store = _stores.get((cls, path))
+        if store is None:
+            store = _stores[(cls, path)] = cls(path, max_bytes)
+        store.max_bytes = max_bytes
+        return store